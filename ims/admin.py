@@ -1,6 +1,6 @@
 from django.contrib import admin
 from ims.models import InventoryItem, Site, ProductInformation, \
-ProductCategory
+ProductCategory, RequestTiming, ImportJob
     
 class ProductInline(admin.TabularInline):
     model = InventoryItem
@@ -41,9 +41,21 @@ class ProductCategoryAdmin(admin.ModelAdmin):
     list_display = ['category']
     search_fields = ['category']
      
+class RequestTimingAdmin(admin.ModelAdmin):
+    list_display = ['name', 'started', 'user', 'wallTime', 'queries', 'sqlTime',
+                    'rows', 'peakMemoryIncrease']
+    list_filter = ['name']
+    
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ['fileName', 'kind', 'status', 'modifier', 'created',
+                    'finished', 'rowsProcessed', 'rowsSkipped']
+    list_filter = ['status', 'kind']
+    
 # Register your models here.
 admin.site.register(ProductInformation, ProductInformationAdmin)
 admin.site.register(Site, SiteAdmin)
 admin.site.register(ProductCategory, ProductCategoryAdmin)
 #admin.site.register(TransactionPrefix)
-admin.site.register(InventoryItem, ProductAdmin)
\ No newline at end of file
+admin.site.register(InventoryItem, ProductAdmin)
+admin.site.register(RequestTiming, RequestTimingAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
\ No newline at end of file
@@ -0,0 +1,271 @@
+"""
+Helpers for timing the inventory engine against synthetic data
+"""
+from django.utils import timezone
+from django.db import transaction
+from django.db.models import Min, Max
+from django.test import RequestFactory
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .models import (Site, ProductInformation, ProductCategory, InventoryItem,
+CurrentInventory, InventoryRollup, epoch_microseconds)
+from .reportcache import bump_dataset_version, increment_dataset_version
+from .views import (get_sorted_inventory, home, import_sites, import_products,
+import_categories, import_inventory, create_site_export_sheet,
+create_product_export_sheet, create_category_export_sheet,
+create_inventory_sheet, create_backup_archive_response,
+import_backup_from_archive)
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import StringIO
+import pytz
+import random
+import time
+import xlwt
+
+class RollbackBenchmark(Exception): pass
+
+class BenchmarkError(Exception): pass
+
+def create_synthetic_history(numSites=10,
+                             numProducts=50,
+                             numChanges=10,
+                             numCategories=0,
+                             seed=0,
+                             modifier='benchmark',
+                             startDate=datetime(2015, 1, 1, tzinfo=pytz.utc)):
+    """
+    create sites and products with a random inventory history.  Each product
+    at each site gets between 1 and 2 * numChanges change records, a few of
+    which are deletions, one minute apart from startDate on.  The same 
+    arguments always create the same data.  Returns the sites, products, and
+    the range of modification dates used in the history.
+    """
+    rand=random.Random(seed)
+    categories=[]
+    for c in range(numCategories):
+        category, __=ProductCategory.objects.get_or_create(
+                                category='benchmark category %d' % (c+1))
+        categories.append(category)
+    sites=[]
+    for s in range(numSites):
+        site=Site(name='benchmark site %d' % (s+1),
+                  modifier=modifier)
+        site.save()
+        sites.append(site)
+    products=[]
+    for p in range(numProducts):
+        products.append(ProductInformation(name='benchmark product %d' % (p+1),
+                                           # upper case, like the imports save them
+                                           code='BENCH-%d-%05d' % (seed, p+1),
+                                           category=rand.choice(categories) if categories else None,
+                                           quantityOfMeasure=rand.randint(1,24),
+                                           costPerItem='%d.%02d' % (rand.randint(0,20),
+                                                                    rand.randint(0,99)),
+                                           modifier=modifier,
+                                           modified=startDate,
+                                           modifiedUs=epoch_microseconds(startDate)))
+    ProductInformation.objects.bulk_create(products)
+    changes=[]
+    for site in sites:
+        for product in products:
+            for __ in range(rand.randint(1, 2 * numChanges)):
+                changes.append((site, product))
+    rand.shuffle(changes)
+    inventory=[]
+    for indx, (site, product) in enumerate(changes):
+        modified=startDate + timedelta(seconds=60 * indx,
+                                       microseconds=rand.randint(0,999999))
+        deleted=rand.random() < 0.05
+        inventory.append(InventoryItem(site=site,
+                                       information=product,
+                                       quantity=0 if deleted else rand.randint(0,500),
+                                       deleted=deleted,
+                                       modified=modified,
+                                       modifiedMicroseconds=modified.microsecond,
+                                       modifiedUs=epoch_microseconds(modified),
+                                       modifier=modifier))
+    InventoryItem.objects.bulk_create(inventory, batch_size=500)
+    # bulk_create skips InventoryItem.save(), so bring the current inventory
+    # up to date in one go
+    CurrentInventory.rebuild([site.pk for site in sites])
+    InventoryRollup.invalidate(startDate)
+    bump_dataset_version()
+    return sites, products, (startDate, startDate + timedelta(seconds=60 * len(changes)))
+
+def legacy_latest_inventory(site, stopDate=None):
+    """
+    the original Site.latest_inventory algorithm, kept as a reference for
+    timing and for checking results.  One query per product, then a sort of
+    that product's history in Python.  Returns the primary keys of the latest,
+    non-deleted inventory.
+    """
+    siteInventory=site.inventoryitem_set.all()
+    if stopDate:
+        siteInventory=siteInventory.filter(modified__lte=stopDate)
+    productInformation=siteInventory.values('information').distinct()
+    latestInventoryIds=[]
+    for information in productInformation:
+        inventoryList=list(siteInventory.filter(information=information['information']))
+        inventoryList.sort(key=lambda item: item.timestamp(), reverse=True)
+        latest=inventoryList[0]
+        if not latest.deleted:
+            latestInventoryIds.append(latest.pk)
+    return latestInventoryIds
+
+def time_call(func, repeat=3):
+    """
+    call func repeat times and return the best wall time in seconds and the
+    result of the last call
+    """
+    best=None
+    result=None
+    for __ in range(repeat):
+        start=time.time()
+        result=func()
+        elapsed=time.time() - start
+        if best is None or elapsed < best:
+            best=elapsed
+    return best, result
+
+def time_runs(func, repeat=3, setup=None):
+    """
+    call func repeat times and return the best and mean wall times and all of
+    the run times, in seconds.  setup, if given, is called before each run,
+    outside of its time.
+    """
+    runs=[]
+    for __ in range(repeat):
+        if setup is not None:
+            setup()
+        start=time.time()
+        func()
+        runs.append(time.time() - start)
+    return OrderedDict((('best', min(runs)),
+                        ('mean', sum(runs) / len(runs)),
+                        ('runs', runs)))
+
+def rolled_back(func):
+    """
+    wrap func so that its database changes are rolled back after each call
+    """
+    def call():
+        try:
+            with transaction.atomic():
+                func()
+                raise RollbackBenchmark
+        except RollbackBenchmark:
+            pass
+    return call
+
+def benchmark_request(user, path='/', data=None):
+    """
+    a request with a session for calling views directly.  Requests with data
+    are POSTs.
+    """
+    factory=RequestFactory()
+    if data is None:
+        request=factory.get(path)
+    else:
+        request=factory.post(path, data)
+    SessionMiddleware().process_request(request)
+    request.session.save()
+    request.user=user
+    return request
+
+def upload_request(user, fileName, contents, action='Import'):
+    """
+    a POST request uploading contents as fileName
+    """
+    return benchmark_request(user, data={action:action,
+                                         'file':SimpleUploadedFile(fileName,
+                                                                   contents)})
+
+def checked_import(view, user, fileName, contents):
+    """
+    import contents as fileName with one of the import views, raising
+    BenchmarkError if the import didn't succeed, so that a failed import
+    isn't timed as if it worked
+    """
+    request=upload_request(user, fileName, contents)
+    view(request)
+    errorMessage=request.session.get('errorMessage', '')
+    infoMessage=request.session.get('infoMessage', '')
+    if errorMessage or not infoMessage.startswith('Successful'):
+        raise BenchmarkError('importing %s failed: %s' %
+                             (fileName, errorMessage or infoMessage))
+
+def checked_restore(user, backup, perms):
+    """
+    restore backup, raising BenchmarkError if the restore didn't succeed
+    """
+    __, __, errorMessage=import_backup_from_archive(
+                                upload_request(user, 'Backup.zip', backup,
+                                               action='Restore'),
+                                modifier=user.username,
+                                perms=perms)
+    if errorMessage:
+        raise BenchmarkError('restoring Backup.zip failed: %s' % errorMessage)
+
+def export_contents(createSheet, **kwargs):
+    """
+    the contents of an xls file written by one of the export sheet functions
+    """
+    xls=xlwt.Workbook(encoding='utf-8')
+    xls=createSheet(xls=xls, **kwargs)
+    stream=StringIO.StringIO()
+    xls.save(stream)
+    return stream.getvalue()
+
+def run_benchmarks(user, repeat=3):
+    """
+    time the key code paths against the data in the database.  Changes made
+    by imports and restores are rolled back after every run.  Returns an
+    OrderedDict of benchmark name: timings.  Raises BenchmarkError if an
+    import or restore fails.
+    """
+    results=OrderedDict()
+    sites=list(Site.objects.order_by('name'))
+    history=InventoryItem.objects.aggregate(Min('modified'), Max('modified'))
+    today=timezone.now().strftime('%m-%d-%Y')
+    results['site.latest_inventory']=time_runs(
+        lambda: [list(site.latest_inventory()) for site in sites], repeat)
+    if history['modified__min']:
+        midDate=(history['modified__min'] + 
+                 (history['modified__max'] - history['modified__min']) / 2)
+        results['site.latest_inventory(stopDate)']=time_runs(
+            lambda: [list(site.latest_inventory(stopDate=midDate)) for site in sites],
+            repeat)
+    # the reports are cached, so each run starts from a new data set version
+    # to time computing the report rather than reading it from the cache
+    for report in ('site_inventory_print',
+                   'site_detail_print',
+                   'inventory_detail_print',
+                   'inventory_status_print'):
+        results['get_sorted_inventory(%s)' % report]=time_runs(
+            lambda report=report: list(get_sorted_inventory(benchmark_request(user),
+                                                            report=report,
+                                                            startDate=today,
+                                                            stopDate=today)[1]),
+            repeat, setup=increment_dataset_version)
+    results['home']=time_runs(lambda: home(benchmark_request(user)), repeat)
+    # an inventory import takes one row per product at each site, so the
+    # current inventory is imported rather than the whole history
+    for name, view, createSheet, kwargs in (
+            ('import_sites', import_sites, create_site_export_sheet, {}),
+            ('import_products', import_products, create_product_export_sheet, {}),
+            ('import_categories', import_categories, create_category_export_sheet, {}),
+            ('import_inventory', import_inventory, create_inventory_sheet, {'exportType':'Current'})):
+        contents=export_contents(createSheet, **kwargs)
+        results[name]=time_runs(
+            rolled_back(lambda view=view, name=name, contents=contents: 
+                        checked_import(view, user, name + '.xls', contents)),
+            repeat)
+    results['create_backup_archive_response']=time_runs(
+        lambda: create_backup_archive_response(benchmark_request(user)), repeat)
+    backup=create_backup_archive_response(benchmark_request(user)).content
+    perms=user.get_all_permissions()
+    results['import_backup_from_archive']=time_runs(
+        rolled_back(lambda: checked_restore(user, backup, perms)),
+        repeat)
+    return results
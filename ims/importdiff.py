@@ -0,0 +1,231 @@
+"""
+Dry runs of the spreadsheet imports.  Instead of saving each row, the rows
+are read in batches and compared with the current state of the records they
+would write, loaded a batch at a time with a few bulk queries, so that even
+a large sheet can be checked without writing anything or holding locks.  The
+result is a diff of the rows that would be inserted, the rows that would
+update a record and the fields they would change, the unchanged rows and, for
+inventory, the rows for sites or products that aren't in the database.
+"""
+from django.utils import timezone
+from .models import (Site, ProductInformation, ProductCategory, InventoryItem,
+CurrentInventory, import_rows, importBatchSize)
+from .importschema import text, upper_text
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import re
+
+# fields that an import always rewrites, so they aren't compared
+UNCOMPARED_FIELDS = ('modified', 'modifier')
+
+class ImportDiff(object):
+    """
+    what importing a sheet would change.  Inserts are (key, fields), updates
+    are (key, [(field, current value, imported value)]), unknown rows are
+    (key, reason) and unchanged and duplicated rows are keys.
+    """
+    def __init__(self, kind, keyTitle):
+        self.kind = kind
+        self.keyTitle = keyTitle
+        self.inserts = []
+        self.updates = []
+        self.unchanged = []
+        self.unknown = []
+        self.duplicates = []
+        self.rowsRead = 0
+        self.rowsSkipped = 0
+
+    def has_changes(self):
+        return bool(self.inserts or self.updates)
+
+    def summary(self):
+        return OrderedDict((('rowsRead', self.rowsRead),
+                            ('inserts', len(self.inserts)),
+                            ('updates', len(self.updates)),
+                            ('unchanged', len(self.unchanged)),
+                            ('unknown', len(self.unknown)),
+                            ('duplicates', len(self.duplicates)),
+                            ('skipped', self.rowsSkipped),))
+
+def same_value(current, imported):
+    """
+    whether saving imported into a field holding current leaves it unchanged
+    """
+    if current in (None, '') and imported in (None, ''):
+        return True
+    if isinstance(current, bool):
+        return current == bool(imported)
+    if isinstance(current, Decimal):
+        try:
+            return current == Decimal(str(imported))
+        except InvalidOperation:
+            return False
+    if isinstance(imported, datetime) and not isinstance(current, datetime) \
+            and isinstance(current, date):
+        # date fields keep the local date of a datetime
+        if timezone.is_aware(imported):
+            imported = timezone.localtime(imported)
+        return current == imported.date()
+    return current == imported or unicode(current) == unicode(imported)
+
+def category_name(product):
+    return product.category.category if product.category else ''
+
+def diff_records(diff, model, keyField, rows, batchSize, queryset=None,
+                 normalizeKey=None, currentValues=None):
+    """
+    compare rows of model with the records of the same keyField that they
+    would replace.  Records are replaced as a whole, so fields that are
+    missing from a row are compared with their defaults.
+    """
+    queryset = queryset if queryset is not None else model.objects.all()
+    normalizeKey = normalizeKey or (lambda key: key)
+    currentValues = currentValues or {}
+    fields = [field for field in model.importSchema.fields()
+              if field != keyField and field not in UNCOMPARED_FIELDS]
+    defaults = dict((field, model._meta.get_field(field).get_default())
+                    for field in fields if field not in currentValues)
+    seenKeys = set()
+    while True:
+        batch = [OrderedDict(values) for values in islice(rows, batchSize)]
+        if not batch:
+            break
+        keys = [record.get(keyField) for record in batch]
+        existing = dict((normalizeKey(key), record) for key, record in
+                        queryset.in_bulk([key for key in keys
+                                          if key not in (None, '')]).iteritems())
+        for key, record in zip(keys, batch):
+            diff.rowsRead += 1
+            if key in (None, ''):
+                # saved under a new key
+                diff.inserts.append((key, record))
+                continue
+            if normalizeKey(key) in seenKeys:
+                diff.duplicates.append(key)
+            seenKeys.add(normalizeKey(key))
+            current = existing.get(normalizeKey(key))
+            if current is None:
+                diff.inserts.append((key, record))
+                continue
+            changes = []
+            for field in fields:
+                if field in currentValues:
+                    currentValue = currentValues[field](current)
+                    importedValue = record.get(field, '')
+                else:
+                    currentValue = getattr(current, field)
+                    importedValue = record.get(field, defaults[field])
+                if not same_value(currentValue, importedValue):
+                    changes.append((field, currentValue, importedValue))
+            if changes:
+                diff.updates.append((key, changes))
+            else:
+                diff.unchanged.append(key)
+    return diff
+
+def diff_inventory(diff, rows, batchSize):
+    """
+    compare inventory rows with the current inventory of their products at
+    their sites.  Rows for sites or products that aren't in the database are
+    unknown, and a later row for the same product at the same site is
+    compared with the one before it, and reported as a duplicate.
+    """
+    latest = {}
+    seenKeys = set()
+    while True:
+        records = [OrderedDict(values) for values in islice(rows, batchSize)]
+        if not records:
+            break
+        diff.rowsRead += len(records)
+        # rows without a code or a product prefix aren't inventory
+        batch = [record for record in records if 'code' in record and
+                 re.match('p', record.get('prefix', ''), re.IGNORECASE)]
+        diff.rowsSkipped += len(records) - len(batch)
+        products = dict((code.upper(), product) for code, product in
+                        ProductInformation.objects.in_bulk(
+                            list(set(record['code'] for record in batch))).iteritems())
+        sites = Site.objects.in_bulk(list(set(record['site_id'] for record in batch
+                                              if record.get('site_id') is not None)))
+        for current in CurrentInventory.objects.filter(
+                            site__in=sites.keys(),
+                            information__in=[product.pk for product in products.values()]
+                            ).select_related('item'):
+            key = (current.site_id, current.information_id.upper())
+            if key not in latest:
+                latest[key] = (current.item.quantity, current.item.deleted)
+        for record in batch:
+            siteId = record.get('site_id')
+            key = (siteId, record['code'])
+            # the rows of the diff are shown as site number, product code
+            rowKey = '%s, %s' % key
+            if siteId not in sites:
+                diff.unknown.append((rowKey, 'unknown site'))
+                continue
+            if record['code'] not in products:
+                diff.unknown.append((rowKey, 'unknown product'))
+                continue
+            imported = (record.get('quantity', 0), bool(record.get('deleted', False)))
+            if key in seenKeys:
+                diff.duplicates.append(rowKey)
+            seenKeys.add(key)
+            current = latest.get(key)
+            latest[key] = imported
+            if current is None or current[1]:
+                if imported[1]:
+                    # deleting inventory that isn't there
+                    diff.unchanged.append(rowKey)
+                else:
+                    diff.inserts.append((rowKey, OrderedDict((('quantity', imported[0]),))))
+                continue
+            changes = [(field, currentValue, importedValue) for field, currentValue, importedValue
+                       in (('quantity', current[0], imported[0]),
+                           ('deleted', current[1], imported[1]))
+                       if currentValue != importedValue]
+            if changes:
+                diff.updates.append((rowKey, changes))
+            else:
+                diff.unchanged.append(rowKey)
+    return diff
+
+def diff_import(model, filename=None, file_contents=None, upload=None,
+                batchSize=None):
+    """
+    the ImportDiff of importing a model's sheet, from an upload or from
+    filename or file_contents as the parse functions read them, and a
+    warning message.  The diff is None if the sheet couldn't be read.
+    Nothing is written, not even the new categories of products.
+    """
+    if batchSize is None:
+        batchSize = importBatchSize
+    importers = {Site:Site.import_sites_from_xls,
+                 ProductCategory:ProductCategory.import_categories_from_xls,
+                 ProductInformation:ProductInformation.import_product_information_from_xls,
+                 InventoryItem:InventoryItem.import_inventory_from_xls,}
+    # products name their category rather than create it
+    converters = {'category':text} if model is ProductInformation else None
+    rows, warningMessage = import_rows(model, importers[model],
+                                       filename=filename,
+                                       file_contents=file_contents,
+                                       upload=upload,
+                                       skipFields=UNCOMPARED_FIELDS,
+                                       converters=converters)
+    if rows is None:
+        return None, warningMessage
+    if model is Site:
+        diff = diff_records(ImportDiff('sites', 'Site Number'), Site, 'number',
+                            rows, batchSize)
+    elif model is ProductCategory:
+        diff = diff_records(ImportDiff('categories', 'Category ID'), ProductCategory,
+                            'pk', rows, batchSize)
+    elif model is ProductInformation:
+        diff = diff_records(ImportDiff('products', 'Product Code'), ProductInformation,
+                            'code', rows, batchSize,
+                            queryset=ProductInformation.objects.select_related('category'),
+                            normalizeKey=upper_text,
+                            currentValues={'category':category_name})
+    else:
+        diff = diff_inventory(ImportDiff('inventory', 'Site Number, Product Code'),
+                              rows, batchSize)
+    return diff, warningMessage
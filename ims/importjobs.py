@@ -0,0 +1,117 @@
+"""
+Running the spreadsheet imports queued by the import views.  Each job is
+imported in one transaction, like the views import, on a thread with its own
+database connection.  The thread that runs the job writes the import's
+progress to the job from the other connection, so that the status view sees
+the progress of an import that hasn't been committed yet.
+"""
+from django.db import transaction, connections
+from django.utils import timezone
+from .models import ImportJob
+from .importreaders import read_rows, ImportReaderError
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class ImportJobError(Exception):
+    pass
+
+def count_rows(job):
+    """
+    number of rows in the sheet the job imports, or 0 if it can't be read
+    """
+    try:
+        __, rows = read_rows(job.upload.path, sheet=job.model().importSchema.sheet,
+                             fileName=job.fileName)
+    except ImportReaderError:
+        # reported when the import reads it
+        return 0
+    return sum(1 for __ in rows)
+
+def import_job(job, progress):
+    """
+    import the job's spreadsheet, rolling back all of its changes if the
+    import reports any problem.  Returns the error message, empty if the
+    import succeeded.  The message is plain text, as it includes the name
+    of the uploaded file, and is shown as text.
+    """
+    try:
+        with transaction.atomic():
+            __, msg = job.parse_method()(upload=job.upload.path,
+                                         modifier=job.modifier,
+                                         retainModDate=False,
+                                         progress=progress)
+            if len(msg) > 0:
+                raise ImportJobError(msg)
+    except ImportJobError as e:
+        return ('Error while trying to import %s from spreadsheet "%s".\n\nError Message:\n%s\n\nChanges to the database have been cancelled.'
+                % (job.kind, job.fileName, e))
+    except Exception as e:
+        logger.exception('import job %d failed' % job.pk)
+        return ('Unhandled exception occurred during the import of %s from "%s": %s\nChanges to the database have been cancelled.'
+                % (job.kind, job.fileName, repr(e)))
+    return ''
+
+def run_import_job(job, inThread=True, progressInterval=1.0):
+    """
+    run a claimed job and record how it went.  With inThread the import runs
+    on a thread of its own and its progress is saved every progressInterval
+    seconds.  Without, the import shares this thread's connection, and its
+    progress is only saved when it finishes.
+    """
+    job.rowsTotal = count_rows(job)
+    ImportJob.objects.filter(pk=job.pk).update(rowsTotal=job.rowsTotal)
+    counts = {'processed':0, 'skipped':0}
+    def progress(processed, skipped):
+        counts['processed'] = processed
+        counts['skipped'] = skipped
+    if inThread:
+        result = {}
+        def target():
+            try:
+                result['errors'] = import_job(job, progress)
+            finally:
+                connections.close_all()
+        worker = threading.Thread(target=target, name='import job %d' % job.pk)
+        worker.start()
+        while worker.is_alive():
+            worker.join(progressInterval)
+            ImportJob.objects.filter(pk=job.pk).update(rowsProcessed=counts['processed'],
+                                                       rowsSkipped=counts['skipped'])
+        errors = result.get('errors', 'The import stopped without finishing')
+    else:
+        errors = import_job(job, progress)
+    job.rowsProcessed = counts['processed']
+    job.rowsSkipped = counts['skipped']
+    if job.rowsSkipped:
+        job.warnings = ('%d of the %d rows read were skipped, as they were unchanged or not for this import'
+                        % (job.rowsSkipped, job.rowsProcessed))
+    job.errors = errors
+    job.status = ImportJob.FAILED if errors else ImportJob.DONE
+    job.finished = timezone.now()
+    job.save()
+    if errors:
+        logger.error('%s, %s' % (job.modifier, errors))
+    else:
+        logger.info('%s, successful bulk import of %s using "%s"' %
+                    (job.modifier, job.kind, job.fileName))
+    return job
+
+def process_import_jobs(once=False, interval=5, inThread=True):
+    """
+    run the queued jobs, oldest first.  When the queue is empty, return if
+    once, otherwise check it again every interval seconds.  Returns the
+    number of jobs run.
+    """
+    jobsRun = 0
+    while True:
+        job = ImportJob.claim_next()
+        if job is None:
+            if once:
+                return jobsRun
+            time.sleep(interval)
+            continue
+        run_import_job(job, inThread=inThread)
+        jobsRun += 1
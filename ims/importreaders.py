@@ -0,0 +1,174 @@
+"""
+Readers that stream the rows of an uploaded spreadsheet, instead of building
+every sheet in memory.  CSV files are read with the csv module, XLSX files
+with a read-only row iterator when openpyxl is installed, and legacy XLS
+files load only the sheet that is imported.  Each reader accepts a file path
+or a file object, such as Django's uploaded files, and returns the headers
+and a generator of rows.  Dates are returned as UTC datetimes, like
+xlrdutils returns them.
+"""
+from django.conf import settings
+from datetime import datetime
+import csv
+import mmap
+import os
+import re
+import pytz
+import xlrd
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+class ImportReaderError(Exception):
+    pass
+
+# dates written in CSV files, YYYY-MM-DD with an optional time
+CSV_DATE_RE = re.compile(r'^\s*(\d{4})-(\d{1,2})-(\d{1,2})'
+                         r'(?:[ T](\d{1,2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?)?\s*$')
+
+def local_to_utc(value):
+    """
+    a naive spreadsheet date, in the local time zone, as a UTC datetime
+    """
+    return pytz.timezone(settings.TIME_ZONE).localize(value).astimezone(pytz.utc)
+
+def csv_value(cell):
+    # utf-8-sig drops the byte order mark Excel writes at the start
+    cell = cell.decode('utf-8-sig')
+    match = CSV_DATE_RE.match(cell)
+    if match:
+        parts = list(match.groups())
+        parts[6] = (parts[6] or '0').ljust(6, '0')
+        try:
+            return local_to_utc(datetime(*[int(part or 0) for part in parts]))
+        except ValueError:
+            pass
+    return cell
+
+def csv_rows(source, sheet=None):
+    """
+    rows of a CSV file, all of them in the one sheet
+    """
+    opened = isinstance(source, basestring)
+    if opened:
+        source = open(source, 'rb')
+    reader = csv.reader(source)
+    try:
+        headers = [csv_value(cell) for cell in next(reader)]
+    except StopIteration:
+        raise ImportReaderError('The CSV file is empty')
+    except csv.Error as e:
+        raise ImportReaderError('Unable to read the CSV file: %s' % e)
+    def rows():
+        try:
+            for row in reader:
+                yield [csv_value(cell) for cell in row]
+        finally:
+            if opened:
+                source.close()
+    return headers, rows()
+
+def xlsx_value(value):
+    if isinstance(value, datetime):
+        return local_to_utc(value)
+    if value is None:
+        return ''
+    return value
+
+def xlsx_rows(source, sheet=None):
+    """
+    rows of a sheet of an XLSX workbook, read one at a time.  Workbooks
+    without that sheet are read from their first sheet.
+    """
+    if openpyxl is None:
+        raise ImportReaderError('Importing XLSX files needs the openpyxl package')
+    try:
+        workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportReaderError('Unable to open the XLSX workbook: %r' % e)
+    if sheet in workbook.sheetnames:
+        worksheet = workbook[sheet]
+    else:
+        worksheet = workbook.worksheets[0]
+    sheetRows = worksheet.iter_rows()
+    try:
+        headers = [xlsx_value(cell.value) for cell in next(sheetRows)]
+    except StopIteration:
+        raise ImportReaderError('The sheet is empty')
+    def rows():
+        for row in sheetRows:
+            yield [xlsx_value(cell.value) for cell in row]
+    return headers, rows()
+
+def xls_rows(source, sheet=None):
+    """
+    rows of a sheet of a legacy XLS workbook, or of its first sheet if it has
+    none by that name.  Only that sheet is loaded, and a file on disk, by
+    path, as an upload saved to a temporary file or as an open file, is
+    mapped rather than read into memory.  xlrd needs the whole of an XLS
+    workbook, so an upload that is only in memory, one smaller than Django's
+    FILE_UPLOAD_MAX_MEMORY_SIZE, is read as a whole.
+    """
+    if hasattr(source, 'temporary_file_path'):
+        source = source.temporary_file_path()
+    opened = getattr(source, 'file', source)
+    try:
+        if isinstance(source, basestring):
+            workbook = xlrd.open_workbook(filename=source, on_demand=True)
+        elif isinstance(opened, file):
+            # mapped from the open file, as its path may already be removed
+            try:
+                contents = mmap.mmap(opened.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ImportReaderError('The XLS file is empty')
+            workbook = xlrd.open_workbook(file_contents=contents, on_demand=True)
+        else:
+            workbook = xlrd.open_workbook(file_contents=source.read(), on_demand=True)
+        if sheet in workbook.sheet_names():
+            worksheet = workbook.sheet_by_name(sheet)
+        else:
+            worksheet = workbook.sheet_by_index(0)
+    except xlrd.XLRDError as e:
+        raise ImportReaderError('Unable to read the XLS workbook: %s' % e)
+    def value(cell):
+        if cell.ctype == xlrd.XL_CELL_DATE:
+            return local_to_utc(datetime(*xlrd.xldate_as_tuple(cell.value,
+                                                               workbook.datemode)))
+        return cell.value
+    if worksheet.nrows == 0:
+        raise ImportReaderError('The sheet is empty')
+    headers = [value(cell) for cell in worksheet.row(0)]
+    def rows():
+        for rowIndex in range(1, worksheet.nrows):
+            yield [value(cell) for cell in worksheet.row(rowIndex)]
+    return headers, rows()
+
+READERS = {'.csv':csv_rows,
+           '.xlsx':xlsx_rows,
+           '.xls':xls_rows,}
+
+def read_rows(source, sheet=None, headerKeys=(), fileName=None):
+    """
+    the headers and a generator of the rows of sheet in source, a file path
+    or a file object, using the reader for the extension of fileName or of
+    the path.  Raises ImportReaderError if the file can't be read or any of
+    headerKeys is missing.
+    """
+    if fileName is None:
+        fileName = source if isinstance(source, basestring) else getattr(source, 'name', '')
+    if hasattr(source, 'temporary_file_path'):
+        # uploaded to a temporary file on disk
+        source = source.temporary_file_path()
+    extension = os.path.splitext(fileName or '')[1].lower()
+    if extension not in READERS:
+        raise ImportReaderError('Unable to import "%s", the file should be CSV, XLSX or XLS'
+                                % fileName)
+    headers, rows = READERS[extension](source, sheet)
+    headers = [unicode(header).strip() for header in headers]
+    lowerHeaders = [header.lower() for header in headers]
+    missing = [key for key in headerKeys if key.lower() not in lowerHeaders]
+    if missing:
+        raise ImportReaderError('Missing the %s column(s) in "%s"' %
+                                (', '.join(missing), fileName))
+    return headers, rows
@@ -0,0 +1,107 @@
+"""
+Declarative description of the spreadsheet columns of each model.  Header
+patterns are compiled once, the headers of a sheet are resolved to fields
+once per sheet, and each column converts its cells with a function chosen up
+front, so parsing a row is a column-wise conversion.  The column titles are
+the headers written by the exports.
+"""
+import re
+
+def unchanged(value):
+    return value
+
+def flag(value):
+    if isinstance(value, basestring):
+        return value.strip().lower() in ('1', '1.0', 'true', 'yes')
+    return value==1
+
+def integer(value):
+    # Excel and CSV numbers may be floats or their text
+    return int(float(value))
+
+def text(value):
+    # numbers in text columns come back from Excel as floats
+    if isinstance(value, float) and value.is_integer():
+        value=int(value)
+    return unicode(value).strip()
+
+def ascii_text(value):
+    return str(text(value).encode('ascii','replace'))
+
+def upper_text(value):
+    return text(value).upper()
+
+class ImportColumn(object):
+    """
+    a spreadsheet column: its export title, the pattern that recognizes its
+    header on import, the field it fills in and the conversion of its cells.
+    Columns without a field are exported but not imported.
+    """
+    def __init__(self, title, pattern, field=None, convert=unchanged):
+        self.title=title
+        self.pattern=re.compile(pattern, re.IGNORECASE)
+        self.field=field
+        self.convert=convert
+
+class ImportSchema(object):
+    """
+    the columns of a model's spreadsheet sheet, in export order, and the
+    headers a sheet must have.  A header belongs to the first column whose
+    pattern matches it.
+    """
+    def __init__(self, sheet, required, *columns):
+        self.sheet=sheet
+        self.required=required
+        self.columns=columns
+
+    def titles(self):
+        return [column.title for column in self.columns]
+
+    def fields(self):
+        return [column.field for column in self.columns if column.field]
+
+    def column_for_header(self, header):
+        for column in self.columns:
+            if column.pattern.match(header):
+                return column
+        return None
+
+    def resolve(self, headers, skipFields=(), converters=None):
+        """
+        (header, field, convert) for each of the headers that is imported.
+        converters replaces the conversions of the fields it has.
+        """
+        converters=converters or {}
+        resolved=[]
+        for header in headers:
+            column=self.column_for_header(header)
+            if column and column.field and column.field not in skipFields:
+                resolved.append((header, column.field,
+                                 converters.get(column.field, column.convert)))
+        return resolved
+
+    def rows(self, data, skipFields=(), converters=None):
+        """
+        the converted cells of each row of data, as read by
+        xlrdutils.read_lines
+        """
+        if not data:
+            return iter([])
+        return self.records(data.keys(), zip(*data.values()), skipFields,
+                            converters)
+
+    def records(self, headers, rows, skipFields=(), converters=None):
+        """
+        the converted cells of each of rows, as a list of (field, value).
+        Empty cells are left out.
+        """
+        columns=[(headers.index(header), field, convert)
+                 for header, field, convert in self.resolve(headers, skipFields,
+                                                            converters)]
+        for row in rows:
+            values=[]
+            for indx, field, convert in columns:
+                value=row[indx] if indx < len(row) else ''
+                if value==0 or value:
+                    values.append((field, convert(value)))
+            yield values
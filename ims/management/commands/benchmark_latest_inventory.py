@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from ims.benchmarks import (RollbackBenchmark, create_synthetic_history,
+legacy_latest_inventory, time_call)
+
+class Command(BaseCommand):
+    help = ('Compare Site.latest_inventory with the original per-product '
+            'algorithm on a synthetic history.  The synthetic data is rolled '
+            'back when the benchmark finishes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', type=int, default=10)
+        parser.add_argument('--products', type=int, default=50)
+        parser.add_argument('--changes', type=int, default=10,
+                            help='average number of changes per product per site')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run_benchmark(options)
+                raise RollbackBenchmark
+        except RollbackBenchmark:
+            pass
+
+    def run_benchmark(self, options):
+        sites, __, (startDate, stopDate) = create_synthetic_history(
+                                            numSites=options['sites'],
+                                            numProducts=options['products'],
+                                            numChanges=options['changes'],
+                                            seed=options['seed'])
+        midDate = startDate + (stopDate - startDate) / 2
+        for label, date in (('stop date at mid history', midDate),
+                            ('stop date at end of history', stopDate)):
+            legacyTime, legacyIds = time_call(
+                lambda: [legacy_latest_inventory(site, stopDate=date)
+                         for site in sites],
+                repeat=options['repeat'])
+            queryTime, queryIds = time_call(
+                lambda: [list(site.latest_inventory(stopDate=date).values_list('pk', flat=True))
+                         for site in sites],
+                repeat=options['repeat'])
+            for legacy, query in zip(legacyIds, queryIds):
+                if sorted(legacy) != sorted(query):
+                    raise CommandError('latest inventory mismatch (%s)' % label)
+            self.stdout.write('%s: per-product %.4fs, single statement %.4fs (%.1fx)' %
+                              (label, legacyTime, queryTime,
+                               legacyTime / max(queryTime, 1e-9)))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ims.models import InventoryCheckpoint
+from datetime import datetime, timedelta
+
+class Command(BaseCommand):
+    help = ('Write inventory checkpoints, so that reports as of a past date '
+            'only need the changes made after the nearest checkpoint.  By '
+            'default a checkpoint is written for each month end that does '
+            'not have one yet.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', action='append', default=[],
+                            help=('write a checkpoint as of the end of this '
+                                  'day (YYYY-MM-DD).  May be repeated.'))
+        parser.add_argument('--rebuild', action='store_true', default=False,
+                            help='rewrite checkpoints that already exist')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            dates = []
+            for date in options['date']:
+                try:
+                    day = datetime.strptime(date, '%Y-%m-%d')
+                except ValueError:
+                    raise CommandError('Invalid date %s, expected YYYY-MM-DD' % date)
+                dates.append(timezone.make_aware(day + timedelta(days=1) -
+                                                 timedelta(microseconds=1)))
+        else:
+            dates = InventoryCheckpoint.month_ends()
+        for asOf in dates:
+            if (not options['rebuild'] and
+                InventoryCheckpoint.objects.filter(asOf=asOf).exists()):
+                continue
+            numRecords = InventoryCheckpoint.create_checkpoint(asOf)
+            self.stdout.write('checkpoint as of %s: %d records' % (asOf, numRecords))
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils import timezone
+from ims.models import Site, ProductInformation, InventoryItem
+
+class Command(BaseCommand):
+    help = ('Print the database EXPLAIN output for the key inventory queries, '
+            'to check which indexes they use.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--site', type=int, default=None,
+                            help='site number to use in the queries')
+        parser.add_argument('--product', default=None,
+                            help='product code to use in the queries')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        try:
+            if options['site'] is None:
+                site = Site.objects.all()[:1].get()
+            else:
+                site = Site.objects.get(pk=options['site'])
+            if options['product'] is None:
+                product = ProductInformation.objects.all()[:1].get()
+            else:
+                product = ProductInformation.objects.get(pk=options['product'])
+        except (Site.DoesNotExist, ProductInformation.DoesNotExist):
+            raise CommandError('Need at least one site and one product to explain queries')
+        stopDate = timezone.now()
+        queries = (
+            ('inventory history for product',
+             site.inventory_history_for_product(code=product.code,
+                                                stopDate=stopDate)),
+            ('latest inventory',
+             site.latest_inventory()),
+            ('latest inventory as of a date',
+             site.latest_inventory(stopDate=stopDate)),
+            ('sites containing product',
+             InventoryItem.objects.filter(information=product.pk,
+                                          deleted=False).values('site').distinct()),
+        )
+        connection = connections[options['database']]
+        if connection.vendor == 'sqlite':
+            explain = 'EXPLAIN QUERY PLAN '
+        else:
+            explain = 'EXPLAIN '
+        cursor = connection.cursor()
+        try:
+            for label, queryset in queries:
+                sql, params = queryset.using(options['database']).query.sql_with_params()
+                cursor.execute(explain + sql, params)
+                self.stdout.write('-- %s' % label)
+                self.stdout.write(sql % tuple(params))
+                columns = [column[0] for column in cursor.description]
+                self.stdout.write(' | '.join(columns))
+                for row in cursor.fetchall():
+                    self.stdout.write(' | '.join(unicode(value) for value in row))
+                self.stdout.write('')
+        finally:
+            cursor.close()
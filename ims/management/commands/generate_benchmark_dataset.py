@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from ims.benchmarks import create_synthetic_history
+from ims.models import Site, ProductInformation, ProductCategory, InventoryItem
+
+class Command(BaseCommand):
+    help = ('Generate a reproducible synthetic dataset of sites, products, '
+            'categories and inventory history for benchmarking.  The same '
+            'options always generate the same data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', type=int, default=100)
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--changes', type=int, default=5,
+                            help='average number of changes per product per site')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true', default=False,
+                            help=('delete all existing sites, products, '
+                                  'categories and inventory first'))
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['clear']:
+                InventoryItem.objects.all().delete()
+                Site.objects.all().delete()
+                ProductInformation.objects.all().delete()
+                ProductCategory.objects.all().delete()
+            elif ProductInformation.objects.filter(
+                    code__startswith='BENCH-%d-' % options['seed']).exists():
+                raise CommandError('A dataset with seed %d already exists.  '
+                                   'Use --clear to replace it.' % options['seed'])
+            sites, products, (startDate, stopDate) = create_synthetic_history(
+                                            numSites=options['sites'],
+                                            numProducts=options['products'],
+                                            numChanges=options['changes'],
+                                            numCategories=options['categories'],
+                                            seed=options['seed'])
+        self.stdout.write('created %d sites, %d products and %d inventory '
+                          'changes from %s to %s' %
+                          (len(sites), len(products),
+                           InventoryItem.objects.filter(site__in=sites).count(),
+                           startDate, stopDate))
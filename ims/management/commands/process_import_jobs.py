@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from ims.importjobs import process_import_jobs
+
+class Command(BaseCommand):
+    help = ('Run the spreadsheet imports queued by the import pages, oldest '
+            'first, recording their progress for the imports page.  Keeps '
+            'checking for new imports until stopped, unless --once is given. '
+            'More than one worker can run at a time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='stop when there are no queued imports')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='seconds between checks of an empty queue')
+
+    def handle(self, *args, **options):
+        jobsRun = process_import_jobs(once=options['once'],
+                                      interval=options['interval'])
+        self.stdout.write('%d imports run' % jobsRun)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ims.views import create_report_artifacts, reportStoreDir
+from datetime import datetime
+
+class Command(BaseCommand):
+    help = ('Render the four print reports, and their csv equivalents, into '
+            'the report store (settings.REPORT_STORE_DIR, by default '
+            'MEDIA_ROOT/reports), where the reports page offers them without '
+            'recomputing.  Meant to be run by a scheduler at the end of the '
+            'day.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', default=None,
+                            help='render the reports as of this day (YYYY-MM-DD), by default today')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                day = datetime.strptime(options['date'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('Invalid date %s, expected YYYY-MM-DD' % options['date'])
+        else:
+            day = timezone.now()
+        for fileName in create_report_artifacts(day.strftime('%m-%d-%Y')):
+            self.stdout.write('wrote %s' % fileName)
+        self.stdout.write('reports are in %s' % reportStoreDir)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from ims.models import InventoryRollup
+from datetime import datetime
+
+class Command(BaseCommand):
+    help = ('Write the daily inventory rollups (totals per product, per site '
+            'and per category) for the days that do not have them yet, '
+            'through yesterday.  Run nightly; changes to the history drop '
+            'the rollups they affect, so only changed days are rebuilt.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--through', default=None,
+                            help='write rollups through this day (YYYY-MM-DD)')
+        parser.add_argument('--rebuild', action='store_true', default=False,
+                            help='drop all of the rollups and write them again')
+
+    def handle(self, *args, **options):
+        throughDate = None
+        if options['through']:
+            try:
+                throughDate = datetime.strptime(options['through'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Invalid date %s, expected YYYY-MM-DD' % options['through'])
+        if options['rebuild']:
+            InventoryRollup.invalidate()
+        dates = InventoryRollup.rollup(throughDate=throughDate)
+        if dates:
+            self.stdout.write('rollups written for %d days, %s through %s' %
+                              (len(dates), dates[0], dates[-1]))
+        else:
+            self.stdout.write('rollups are up to date')
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from ims.benchmarks import RollbackBenchmark, BenchmarkError, run_benchmarks
+from ims.models import Site, ProductInformation, ProductCategory, InventoryItem
+from collections import OrderedDict
+import json
+
+class Command(BaseCommand):
+    help = ('Time the key inventory code paths against the data in the '
+            'database and write the results as JSON, for comparison across '
+            'commits.  Nothing is changed in the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--label', default='',
+                            help='label for this run, e.g. a commit id')
+        parser.add_argument('--output', default=None,
+                            help='write the JSON results to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        report = OrderedDict()
+        report['label'] = options['label']
+        report['started'] = timezone.now().isoformat()
+        report['database'] = connection.vendor
+        report['repeat'] = options['repeat']
+        report['dataset'] = OrderedDict((
+            ('sites', Site.objects.count()),
+            ('products', ProductInformation.objects.count()),
+            ('categories', ProductCategory.objects.count()),
+            ('inventoryItems', InventoryItem.objects.count()),
+        ))
+        try:
+            with transaction.atomic():
+                user = User(username='ims-benchmark',
+                            is_staff=True,
+                            is_superuser=True)
+                user.save()
+                report['results'] = run_benchmarks(user,
+                                                   repeat=options['repeat'])
+                raise RollbackBenchmark
+        except RollbackBenchmark:
+            pass
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+        results = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                fp.write(results + '\n')
+        else:
+            self.stdout.write(results)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_current_inventory(apps, schema_editor):
+    """
+    walk the inventory history once, in order, and keep the last record seen
+    for each site and product
+    """
+    InventoryItem = apps.get_model('ims', 'InventoryItem')
+    CurrentInventory = apps.get_model('ims', 'CurrentInventory')
+    latest = {}
+    history = InventoryItem.objects.order_by('modified',
+                                             'modifiedMicroseconds',
+                                             'pk').values_list('pk',
+                                                               'site_id',
+                                                               'information_id')
+    for pk, siteId, informationId in history.iterator():
+        latest[(siteId, informationId)] = pk
+    currentInventory = [CurrentInventory(site_id=siteId,
+                                         information_id=informationId,
+                                         item_id=pk)
+                        for (siteId, informationId), pk in latest.iteritems()]
+    CurrentInventory.objects.bulk_create(currentInventory, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ims', '0012_auto_20160115_1330'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentInventory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('information', models.ForeignKey(help_text=b'The detailed information about this product type', on_delete=django.db.models.deletion.CASCADE, to='ims.ProductInformation')),
+                ('item', models.OneToOneField(help_text=b'The latest inventory change record for this product at this site', on_delete=django.db.models.deletion.CASCADE, related_name='current', to='ims.InventoryItem')),
+                ('site', models.ForeignKey(help_text=b'The site containing this inventory', on_delete=django.db.models.deletion.CASCADE, to='ims.Site')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='currentinventory',
+            unique_together=set([('site', 'information')]),
+        ),
+        migrations.RunPython(populate_current_inventory,
+                             migrations.RunPython.noop),
+    ]
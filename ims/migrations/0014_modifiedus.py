@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.utils import timezone
+import calendar
+import pytz
+
+
+# modifiedUs from the modified and modifiedMicroseconds columns in one
+# UPDATE.  Whole seconds since the epoch are computed independently of the
+# connection's time zone, as modified is stored in UTC.
+EPOCH_SECONDS = {
+    'mysql': "TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', %(modified)s)",
+    'sqlite': "CAST(strftime('%%s', %(modified)s) AS INTEGER)",
+    'postgresql': "CAST(FLOOR(EXTRACT(EPOCH FROM %(modified)s)) AS BIGINT)",
+}
+
+def populate_modified_us(apps, schema_editor):
+    """
+    fill in modifiedUs from modified and modifiedMicroseconds, with a single
+    UPDATE per table where the database is known, otherwise a row at a time
+    """
+    quote = schema_editor.quote_name
+    vendor = schema_editor.connection.vendor
+    for modelName in ('Site', 'ProductInformation', 'InventoryItem'):
+        model = apps.get_model('ims', modelName)
+        if vendor in EPOCH_SECONDS:
+            columns = {'table':quote(model._meta.db_table),
+                       'modifiedUs':quote(model._meta.get_field('modifiedUs').column),
+                       'modified':quote(model._meta.get_field('modified').column),
+                       'microseconds':quote(model._meta.get_field('modifiedMicroseconds').column)}
+            columns['seconds'] = EPOCH_SECONDS[vendor] % columns
+            schema_editor.execute('UPDATE %(table)s SET %(modifiedUs)s = '
+                                  '%(seconds)s * 1000000 + COALESCE(%(microseconds)s, 0) '
+                                  'WHERE %(modified)s IS NOT NULL' % columns,
+                                  params=None)
+            continue
+        records = model.objects.values_list('pk',
+                                            'modified',
+                                            'modifiedMicroseconds')
+        for pk, modified, microseconds in records.iterator():
+            if modified is None:
+                continue
+            if timezone.is_aware(modified):
+                modified = modified.astimezone(pytz.utc)
+            modifiedUs = (calendar.timegm(modified.timetuple()) * 1000000 +
+                          (microseconds or 0))
+            model.objects.filter(pk=pk).update(modifiedUs=modifiedUs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ims', '0013_currentinventory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventoryitem',
+            name='modifiedUs',
+            field=models.BigIntegerField(db_index=True, default=0, help_text=b'modification time in microseconds since the epoch'),
+        ),
+        migrations.AddField(
+            model_name='productinformation',
+            name='modifiedUs',
+            field=models.BigIntegerField(db_index=True, default=0, help_text=b'modification time in microseconds since the epoch'),
+        ),
+        migrations.AddField(
+            model_name='site',
+            name='modifiedUs',
+            field=models.BigIntegerField(db_index=True, default=0, help_text=b'modification time in microseconds since the epoch'),
+        ),
+        migrations.RunPython(populate_modified_us,
+                             migrations.RunPython.noop),
+    ]
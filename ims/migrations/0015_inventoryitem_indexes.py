@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ims', '0014_modifiedus'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='inventoryitem',
+            index_together=set([('site', 'information', 'modified', 'modifiedMicroseconds'), ('site', 'information', 'modifiedUs'), ('information', 'deleted', 'site')]),
+        ),
+    ]
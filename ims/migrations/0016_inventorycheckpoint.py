@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ims', '0015_inventoryitem_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asOf', models.DateTimeField(db_index=True, help_text=b'the inventory state is as of this date')),
+                ('information', models.ForeignKey(help_text=b'The detailed information about this product type', on_delete=django.db.models.deletion.CASCADE, to='ims.ProductInformation')),
+                ('item', models.ForeignKey(help_text=b'The latest inventory change record for this product at this site as of this date', on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='ims.InventoryItem')),
+                ('site', models.ForeignKey(help_text=b'The site containing this inventory', on_delete=django.db.models.deletion.CASCADE, to='ims.Site')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='inventorycheckpoint',
+            unique_together=set([('asOf', 'site', 'information')]),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, ExpressionWrapper, F, Sum
+import django.db.models.deletion
+
+
+def populate_site_inventory_totals(apps, schema_editor):
+    """
+    total up the current inventory at each site.  Sites without any current
+    inventory get all zero totals.
+    """
+    Site = apps.get_model('ims', 'Site')
+    CurrentInventory = apps.get_model('ims', 'CurrentInventory')
+    SiteInventoryTotals = apps.get_model('ims', 'SiteInventoryTotals')
+    pieces = ExpressionWrapper(F('item__quantity') *
+                               F('information__quantityOfMeasure'),
+                               output_field=models.BigIntegerField())
+    value = ExpressionWrapper(F('item__quantity') *
+                              F('information__quantityOfMeasure') *
+                              F('information__costPerItem'),
+                              output_field=models.DecimalField(decimal_places=2,
+                                                               max_digits=14))
+    siteTotals = CurrentInventory.objects.filter(
+                        item__deleted=False).order_by().values('site').annotate(
+                        totalQuantity=Sum('item__quantity'),
+                        totalPieces=Sum(pieces),
+                        totalValue=Sum(value),
+                        productCount=Count('pk'))
+    siteTotals = dict((totals['site'], totals) for totals in siteTotals)
+    SiteInventoryTotals.objects.bulk_create(
+        [SiteInventoryTotals(site_id=siteId,
+                             totalQuantity=totals.get('totalQuantity') or 0,
+                             totalPieces=totals.get('totalPieces') or 0,
+                             totalValue=totals.get('totalValue') or 0,
+                             productCount=totals.get('productCount') or 0)
+         for siteId, totals in ((siteId, siteTotals.get(siteId, {}))
+                                for siteId in Site.objects.values_list('pk', flat=True))],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ims', '0016_inventorycheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteInventoryTotals',
+            fields=[
+                ('site', models.OneToOneField(help_text=b'The site these totals are for', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='totals', serialize=False, to='ims.Site')),
+                ('totalQuantity', models.IntegerField(default=0, help_text=b'Total number of inventory units (each, boxes, cases, ...) at the site')),
+                ('totalPieces', models.BigIntegerField(default=0, help_text=b'Total number of individual items at the site')),
+                ('totalValue', models.DecimalField(decimal_places=2, default=0, help_text=b'Total cost of the individual items at the site', max_digits=14)),
+                ('productCount', models.IntegerField(default=0, help_text=b"Number of products in the site's current inventory")),
+            ],
+        ),
+        migrations.RunPython(populate_site_inventory_totals,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ims', '0017_siteinventorytotals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryInventoryRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, help_text=b'the inventory totals are as of the end of this day')),
+                ('totalQuantity', models.IntegerField(default=0, help_text=b'Total number of inventory units (each, boxes, cases, ...)')),
+                ('totalPieces', models.BigIntegerField(default=0, help_text=b'Total number of individual items')),
+                ('totalValue', models.DecimalField(decimal_places=2, default=0, help_text=b'Total cost of the individual items', max_digits=14)),
+                ('productCount', models.IntegerField(default=0, help_text=b"Number of product and site pairs in this category's inventory")),
+                ('category', models.ForeignKey(blank=True, help_text=b'The category these totals are for', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='ims.ProductCategory')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductInventoryRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, help_text=b'the inventory totals are as of the end of this day')),
+                ('totalQuantity', models.IntegerField(default=0, help_text=b'Total number of inventory units (each, boxes, cases, ...)')),
+                ('totalPieces', models.BigIntegerField(default=0, help_text=b'Total number of individual items')),
+                ('totalValue', models.DecimalField(decimal_places=2, default=0, help_text=b'Total cost of the individual items', max_digits=14)),
+                ('siteCount', models.IntegerField(default=0, help_text=b'Number of sites holding this product')),
+                ('information', models.ForeignKey(help_text=b'The product these totals are for', on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='ims.ProductInformation')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SiteInventoryRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, help_text=b'the inventory totals are as of the end of this day')),
+                ('totalQuantity', models.IntegerField(default=0, help_text=b'Total number of inventory units (each, boxes, cases, ...)')),
+                ('totalPieces', models.BigIntegerField(default=0, help_text=b'Total number of individual items')),
+                ('totalValue', models.DecimalField(decimal_places=2, default=0, help_text=b'Total cost of the individual items', max_digits=14)),
+                ('productCount', models.IntegerField(default=0, help_text=b"Number of products in the site's inventory")),
+                ('site', models.ForeignKey(help_text=b'The site these totals are for', on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='ims.Site')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='categoryinventoryrollup',
+            unique_together=set([('date', 'category')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='productinventoryrollup',
+            unique_together=set([('date', 'information')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='siteinventoryrollup',
+            unique_together=set([('date', 'site')]),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ims', '0018_inventoryrollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestTiming',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, help_text=b'The instrumented function', max_length=100)),
+                ('started', models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text=b'When the call started')),
+                ('user', models.CharField(blank=True, default=b'', help_text=b'The user making the request', max_length=50)),
+                ('wallTime', models.FloatField(default=0, help_text=b'Elapsed time in seconds')),
+                ('queries', models.IntegerField(default=0, help_text=b'Number of SQL queries')),
+                ('sqlTime', models.FloatField(default=0, help_text=b'Total time of the SQL queries in seconds')),
+                ('rows', models.IntegerField(default=0, help_text=b'Number of model instances created')),
+                ('peakMemory', models.BigIntegerField(default=0, help_text=b'Peak memory use of the process in kilobytes')),
+            ],
+            options={
+                'ordering': ['-started'],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ims', '0019_requesttiming'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[(b'sites', b'sites'), (b'products', b'products'), (b'categories', b'categories'), (b'inventory', b'inventory')], help_text=b'What the spreadsheet imports', max_length=20)),
+                ('upload', models.FileField(help_text=b'The uploaded spreadsheet', max_length=256, upload_to=b'import_jobs/%Y/%m')),
+                ('fileName', models.CharField(blank=True, default=b'', help_text=b'Name of the file that was uploaded', max_length=256)),
+                ('modifier', models.CharField(blank=True, default=b'', help_text=b'user that queued the import', max_length=50)),
+                ('status', models.CharField(choices=[(b'queued', b'queued'), (b'running', b'running'), (b'done', b'done'), (b'failed', b'failed')], db_index=True, default=b'queued', help_text=b'Where the import is up to', max_length=10)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, help_text=b'When the import was queued')),
+                ('started', models.DateTimeField(blank=True, help_text=b'When the import started', null=True)),
+                ('finished', models.DateTimeField(blank=True, help_text=b'When the import finished', null=True)),
+                ('rowsTotal', models.IntegerField(default=0, help_text=b'Number of rows in the spreadsheet')),
+                ('rowsProcessed', models.IntegerField(default=0, help_text=b'Number of rows read so far')),
+                ('rowsSkipped', models.IntegerField(default=0, help_text=b"Number of rows read that weren't imported")),
+                ('warnings', models.TextField(blank=True, default=b'', help_text=b'Warnings from the import')),
+                ('errors', models.TextField(blank=True, default=b'', help_text=b'Why the import failed')),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+    ]
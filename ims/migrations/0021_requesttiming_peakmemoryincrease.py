@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ims', '0020_importjob'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='requesttiming',
+            old_name='peakMemory',
+            new_name='peakMemoryIncrease',
+        ),
+        migrations.AlterField(
+            model_name='requesttiming',
+            name='peakMemoryIncrease',
+            field=models.BigIntegerField(default=0, help_text=b'How much the call raised the peak memory use of the process, in kilobytes'),
+        ),
+    ]
@@ -1,17 +1,61 @@
-from django.db import models
+from django.db import models, transaction, connections
+from django.db.models import Sum, Min, Max, Q, F, Count, ExpressionWrapper
 from django.utils import timezone
 from django.core.exceptions import ValidationError
-from django.utils.dateparse import parse_datetime
 from django.conf import settings
 from xlrdutils import xlrdutils
+from .reportcache import bump_dataset_version
+from .importschema import (ImportSchema, ImportColumn, flag, integer,
+text, ascii_text, upper_text)
+from .importreaders import read_rows, ImportReaderError
+from itertools import islice
 import os
 import re
 import pytz
+import calendar
+from decimal import Decimal
+from datetime import timedelta, datetime, time
 from collections import OrderedDict
 from __builtin__ import classmethod
 
+try:
+    importBatchSize=settings.IMPORT_BATCH_SIZE
+except AttributeError:
+    importBatchSize=500
+
 # Create your models here.
 
+def epoch_microseconds(value):
+    """
+    microseconds since the epoch for a datetime.  This is stored in modifiedUs
+    so that records can be ordered by a single integer.
+    """
+    if timezone.is_aware(value):
+        value=value.astimezone(pytz.utc)
+    return calendar.timegm(value.timetuple()) * 1000000 + value.microsecond
+
+def import_rows(model, importFromXls, filename=None, file_contents=None,
+                upload=None, skipFields=(), converters=None):
+    """
+    the converted rows of a model's sheet and a warning message.  An upload,
+    a file path or file object, is streamed by the import readers, otherwise
+    filename or file_contents are read with importFromXls.  converters
+    replaces the schema's conversions of some fields.  The rows are None if
+    the sheet couldn't be read.
+    """
+    schema=model.importSchema
+    if upload is not None:
+        try:
+            headers, rows=read_rows(upload, sheet=schema.sheet,
+                                    headerKeys=schema.required)
+        except ImportReaderError as e:
+            return None, repr(e)
+        return schema.records(headers, rows, skipFields, converters), ''
+    data, workbook, warningMessage=importFromXls(filename=filename, file_contents=file_contents)
+    if data is None or workbook is None:
+        return None, warningMessage
+    return schema.rows(data, skipFields, converters), warningMessage
+
 ########################################################
 # these are the base models which other models reference
 ########################################################
@@ -44,25 +88,33 @@ class Site(models.Model):
                                   help_text='last modified on this date')
     modifiedMicroseconds=models.IntegerField(default=0,
                                              help_text='modification microsecond offset')
+    modifiedUs=models.BigIntegerField(default=0, db_index=True,
+                                      help_text='modification time in microseconds since the epoch')
     modifier=models.CharField(max_length=50, default="admin", blank=True,
                               help_text='user that last modified this record')
+    importSchema=ImportSchema('Sites', ('Site Number', 'Site Name'),
+        ImportColumn('Site Number', '^.*?site\s*number', 'number', integer),
+        ImportColumn('Site Name', '^.*?site\s*name', 'name', ascii_text),
+        ImportColumn('Site Address 1', '^.*?site\s*address\s*1', 'address1', ascii_text),
+        ImportColumn('Site Address 2', '^.*?site\s*address\s*2', 'address2', ascii_text),
+        ImportColumn('Site Address 3', '^.*?site\s*address\s*3', 'address3', ascii_text),
+        ImportColumn('County', '^\s*county\s*$', 'county', ascii_text),
+        ImportColumn('Site Contact Name', '^.*?site\s*contact\s*name', 'contactName', ascii_text),
+        ImportColumn('Site Phone', '^.*?site\s*phone', 'contactPhone', ascii_text),
+        ImportColumn('Site Notes', '^.*?site.*?notes', 'notes', ascii_text),
+        ImportColumn('Modified', '^\s*modified', 'modified'),
+        ImportColumn('Modifier', '^\s*modifier\s*$', 'modifier', ascii_text),
+    )
     
     @classmethod
     def recently_changed_inventory(cls, pageSize):
         """
         list of sites that had inventory changes recently.  Limit to numSites.
         """
-        recentInventory=InventoryItem.objects.all()
-        recentInventoryList=[]
-        for item in recentInventory:
-            recentInventoryList.append(item)
         # latest inventory changes to the top of the list
-        recentInventoryList.sort(reverse=True)
-        sitesList=[]
-        for inventoryItem in recentInventoryList:
-            if inventoryItem.site not in sitesList:
-                sitesList.append(inventoryItem.site)
-        return sitesList[:pageSize]
+        siteIds=InventoryItem.objects.recent_distinct('site', pageSize).keys()
+        sites=Site.objects.in_bulk(siteIds)
+        return [sites[siteId] for siteId in siteIds]
     
     @classmethod
     def import_sites_from_xls(cls,filename=None, file_contents=None):
@@ -76,10 +128,8 @@ class Site(models.Model):
             warningMessage=repr(e)
             return (data, workbook, warningMessage)
         try:
-            data=xlrdutils.read_lines(workbook, sheet="Sites", 
-                                      headerKeys=['Site Number',
-                                                  'Site Name',
-                                                  ], 
+            data=xlrdutils.read_lines(workbook, sheet=cls.importSchema.sheet, 
+                                      headerKeys=list(cls.importSchema.required), 
                                       zone=settings.TIME_ZONE)
         except (xlrdutils.XlrdutilsReadHeaderError,
                 xlrdutils.XlrdutilsDateParseError) as e:
@@ -88,32 +138,28 @@ class Site(models.Model):
     
     @classmethod
     def parse_sites_from_xls(cls,filename=None, file_contents=None, 
-                             modifier='', retainModDate=True, save=True):
+                             modifier='', retainModDate=True, save=True,
+                             upload=None, progress=None):
         """
-        read in an excel file containing site information and populate the Sites table
+        read in an excel file containing site information and populate the Sites table.
+        An upload is streamed from a CSV, XLSX or XLS file.  progress is called with the 
+        number of rows read and skipped so far.
         """
-        data, workbook, warningMessage=cls.import_sites_from_xls(filename=filename, file_contents=file_contents)
-        if data is None or workbook is None:
+        #modified comes back as UTC datetime
+        rows, warningMessage=import_rows(cls, cls.import_sites_from_xls,
+                                         filename=filename,
+                                         file_contents=file_contents,
+                                         upload=upload,
+                                         skipFields=() if retainModDate else ('modified',))
+        if rows is None:
             return None, warningMessage
-        keys=data.keys()
         sites=[]
         siteNumbers=[]
-        for indx in range(len(data[keys[0]])):
+        for rowsRead, values in enumerate(rows, 1):
             site=Site()
             site.modifier=modifier
-            for header in keys:
-                value=data[header][indx]
-                tableHeader=site.convert_header_name(header)
-                if tableHeader ==-1:
-                    continue
-                if value==0 or value:
-                    value=site.convert_value(tableHeader,value)
-                    if re.match('modified',tableHeader,re.IGNORECASE):
-                        #this comes back as UTC datetime
-                        if retainModDate:
-                            site.modified=value
-                    else:
-                        setattr(site,tableHeader,value)
+            for field, value in values:
+                setattr(site,field,value)
             if site.modified and not site.modified.tzinfo:
                 site.modified=pytz.utc.localize(site.modified)
             if save:
@@ -123,6 +169,8 @@ class Site(models.Model):
             sites.append(site)
             if len(sites) != len(siteNumbers):
                 warningMessage = 'Found duplicate site numbers'
+            if progress:
+                progress(rowsRead, 0)
         return sites, warningMessage
     
     def __unicode__(self):
@@ -133,13 +181,20 @@ class Site(models.Model):
         if not self.modified:
             self.modified=timezone.now()
         self.modifiedMicroseconds=self.modified.microsecond
+        self.modifiedUs=epoch_microseconds(self.modified)
         super(self.__class__,self).save(*args, **kwargs)
+        bump_dataset_version()
+    
+    def delete(self, *args, **kwargs):
+        super(self.__class__,self).delete(*args, **kwargs)
+        InventoryRollup.invalidate()
+        bump_dataset_version()
     
     def __lt__(self,other):
-        return self.timestamp() < other.timestamp()
+        return self.modifiedUs < other.modifiedUs
     
     def timestamp(self):
-        return parse_datetime(self.modified.strftime("%FT%H:%M:%S")+"." + '%06d' % self.modifiedMicroseconds+self.modified.strftime("%z"))
+        return self.modified.replace(microsecond=self.modifiedMicroseconds)
     
     def create_key(self):
         return str(self.pk)+'_'+self.name+'_'+self.county+'_'+self.address1+'_'+ \
@@ -165,64 +220,23 @@ class Site(models.Model):
         inventoryItem.save()
         return inventoryItem
     
-    def convert_header_name(self,name):
-        if re.match('^.*?site\s*name',name,re.IGNORECASE):
-            return 'name'
-        elif re.match('^.*?site\s*number',name,re.IGNORECASE):
-            return 'number'
-        elif re.match('^.*?site\s*address\s*1',name,re.IGNORECASE):
-            return 'address1'
-        elif re.match('^.*?site\s*address\s*2',name,re.IGNORECASE):
-            return 'address2'
-        elif re.match('^.*?site\s*address\s*3',name,re.IGNORECASE):
-            return 'address3'
-        elif re.match('^.*?site\s*contact\s*name',name,re.IGNORECASE):
-            return 'contactName'
-        elif re.match('^.*?site\s*phone',name,re.IGNORECASE):
-            return 'contactPhone'
-        elif re.match('^.*?site.*?notes',name,re.IGNORECASE):
-            return 'notes'
-        elif re.match('^\s*county\s*$',name,re.IGNORECASE):
-            return'county'
-        elif re.match('^\s*modified',name,re.IGNORECASE):
-            return 'modified'
-        elif re.match('^\s*modifier\s*$',name,re.IGNORECASE):
-            return 'modifier'
-        return -1
-
-    def convert_value(self,key,value):
-        if isinstance(getattr(self,key),bool):
-            return value==1
-        elif isinstance(getattr(self,key),int):
-            return int(value)
-        elif isinstance(getattr(self,key),long):
-            return long(value)
-        elif isinstance(getattr(self,key),str):
-            return str(unicode(value.strip().encode('ascii','replace')))
-        elif isinstance(getattr(self,key),unicode):
-            if key == 'contactPhone' and isinstance(value,float):
-                return unicode(int(value))
-            return unicode(value)
-        elif re.match('^.*date',key,re.IGNORECASE):
-            return value
-        elif re.match('^\s*modified\s*$',key,re.IGNORECASE):
-            return value
-        elif key=='number':
-            return long(value)
-        return -1
-    
     def total_inventory(self):
-        items = self.latest_inventory()
-        count=0
-        for item in items:
-            count += item.quantity
-        return count
+        return self.inventory_totals().totalQuantity
+    
+    def inventory_totals(self):
+        """
+        the SiteInventoryTotals for this site.  A site without any current
+        inventory has all zero totals.
+        """
+        totals=SiteInventoryTotals.objects.filter(site=self).first()
+        if totals is None:
+            totals=SiteInventoryTotals(site=self)
+        return totals
     
     def inventory_quantity(self,code):
-        items = self.latest_inventory()
-        for item in items:
-            if code == item.information.code:
-                return item.quantity
+        item=self.latest_inventory_for_product(code=code)
+        if item:
+            return item.quantity
         return 0
     
     def check_site(self):
@@ -247,36 +261,18 @@ class Site(models.Model):
                          stopDate=None, 
                          orderBy = {'information__name':'information__name'},
                          filterBy = {}):
-        # get the inventory entries associated with this site. These are records
-        # detailing the history of inventory states for products at this site.  Includes
-        # adjustments to inventory as well as deletions
-        siteInventory=self.inventoryitem_set.filter(**filterBy)
-        if stopDate:
-            # if we have a stop date, use it to filter the inventory, so we don't get
-            # anything after the stop date
-            siteInventory=siteInventory.filter(modified__lte=stopDate)
-        # get the unique set of product information associated with the inventory
-        # at this site
-        productInformation=siteInventory.values('information')
-        productInformation=productInformation.distinct()
-        latestInventoryIds=[]
-        # for each product information get the latest inventory entry for this product
-        for information in productInformation:
-            inventoryItems = siteInventory.filter(information=information['information'])
-            inventoryList=[]
-            for item in inventoryItems:
-                inventoryList.append(item)
-            inventoryList.sort(reverse=True)
-            latest = inventoryList[0]
-            # if the inventory for this product was not deleted as it's latest state,
-            # then add it to the latestInventory list
-            if not latest.deleted:
-                latestInventoryIds.append(latest.pk)
-        # now look through the site inventory and remove any inventory that was deleted
-        # as its last state.  We do this because we need a queryset, not a list
-        # because we are using it to generate a formset later
-        siteInventory=InventoryItem.objects.filter(pk__in=latestInventoryIds).order_by(*orderBy.values())
-        return siteInventory
+        if not stopDate:
+            # the current state of each product at this site is kept in the
+            # CurrentInventory table, so we don't need to replay the history
+            siteInventory=InventoryItem.objects.filter(current__site=self,
+                                                       deleted=False)
+            return siteInventory.filter(**filterBy).order_by(*orderBy.values())
+        # pick the latest change record for each product at this site as of
+        # the stop date, and drop the products whose latest state was deleted
+        siteInventory=InventoryItem.objects.filter(site=self).latest_per_product(
+                                                   stopDate=stopDate)
+        siteInventory=siteInventory.filter(deleted=False).filter(**filterBy)
+        return siteInventory.order_by(*orderBy.values())
     
     def inventory_history_for_product(self,code=None, stopDate=None):
         """
@@ -312,18 +308,14 @@ class Site(models.Model):
         last inventory change at the site with this product info.
         Don't include an item if it was deleted.
         """
-        lastInventory=InventoryItem.objects.filter(
-                           site=self).filter(
-                           information=code)
-        if lastInventory.count() == 0:
+        try:
+            current=CurrentInventory.objects.select_related('item').get(
+                                site=self, information=code)
+        except CurrentInventory.DoesNotExist:
             return None
-        inventoryList=[]
-        for item in lastInventory:
-            inventoryList.append(item)
-        inventoryList.sort(reverse=True)
-        if inventoryList[0].deleted:
+        if current.item.deleted:
             return None
-        return inventoryList[0]
+        return current.item
 
 class ProductCategory(models.Model):
     """
@@ -334,6 +326,19 @@ class ProductCategory(models.Model):
         ordering = ['category']
         
     category = models.CharField(max_length=100, unique=True, default="")
+    importSchema=ImportSchema('Categories', ('Category ID', 'Category'),
+        ImportColumn('Category ID', '^.*?category\s*id', 'pk', integer),
+        ImportColumn('Category', '^\s*category\s*$', 'category', ascii_text),
+    )
+    
+    def save(self, *args, **kwargs):
+        super(self.__class__,self).save(*args, **kwargs)
+        bump_dataset_version()
+    
+    def delete(self, *args, **kwargs):
+        super(self.__class__,self).delete(*args, **kwargs)
+        InventoryRollup.invalidate()
+        bump_dataset_version()
     
     @classmethod
     def import_categories_from_xls(cls,filename=None, file_contents=None):
@@ -347,10 +352,8 @@ class ProductCategory(models.Model):
             warningMessage=repr(e)
             return (data, workbook, warningMessage)
         try:
-            data=xlrdutils.read_lines(workbook, sheet="Categories", 
-                                      headerKeys=['Category ID',
-                                                  'Category',
-                                                  ], 
+            data=xlrdutils.read_lines(workbook, sheet=cls.importSchema.sheet, 
+                                      headerKeys=list(cls.importSchema.required), 
                                       zone=settings.TIME_ZONE)
         except (xlrdutils.XlrdutilsReadHeaderError,
                 xlrdutils.XlrdutilsDateParseError) as e:
@@ -359,26 +362,25 @@ class ProductCategory(models.Model):
     
     @classmethod
     def parse_product_categories_from_xls(cls,filename=None, file_contents=None, 
-                             modifier='', retainModDate=True, save=True):
+                             modifier='', retainModDate=True, save=True,
+                             upload=None, progress=None):
         """
-        read in an excel file containing product category information and populate the ProductCategory table
+        read in an excel file containing product category information and populate the ProductCategory table.
+        An upload is streamed from a CSV, XLSX or XLS file.  progress is called with the 
+        number of rows read and skipped so far.
         """
-        data, workbook, warningMessage=cls.import_categories_from_xls(filename=filename, file_contents=file_contents)
-        if data is None or workbook is None:
+        rows, warningMessage=import_rows(cls, cls.import_categories_from_xls,
+                                         filename=filename,
+                                         file_contents=file_contents,
+                                         upload=upload)
+        if rows is None:
             return None, warningMessage
-        keys=data.keys()
         categories=[]
         ids=[]
-        for indx in range(len(data[keys[0]])):
+        for rowsRead, values in enumerate(rows, 1):
             category=ProductCategory()
-            for header in keys:
-                value=data[header][indx]
-                tableHeader=category.convert_header_name(header)
-                if tableHeader ==-1:
-                    continue
-                if value==0 or value:
-                    value=category.convert_value(tableHeader,value)
-                    setattr(category,tableHeader,value)
+            for field, value in values:
+                setattr(category,field,value)
             if save:
                 category.save()
             if category.pk not in ids:
@@ -386,34 +388,21 @@ class ProductCategory(models.Model):
             categories.append(category)
             if len(categories) != len(ids):
                 warningMessage = 'Found duplicate categories'
+            if progress:
+                progress(rowsRead, 0)
         return categories, warningMessage
     
     def __unicode__(self):
         return self.category
     
-    def convert_header_name(self,name):
-        if re.match('^.*?category\s*id',name,re.IGNORECASE):
-            return 'pk'
-        elif re.match('^\s*category\s*$',name,re.IGNORECASE):
-            return 'category'
-        return -1
-
-    def convert_value(self,key,value):
-        if isinstance(getattr(self,key),bool):
-            return value==1
-        elif isinstance(getattr(self,key),int):
-            return int(value)
-        elif isinstance(getattr(self,key),long):
-            return long(value)
-        elif isinstance(getattr(self,key),float):
-            return float(value)
-        elif isinstance(getattr(self,key),str):
-            return str(unicode(value.strip().encode('ascii','replace')))
-        elif isinstance(getattr(self,key),unicode):
-            return unicode(value.strip())
-        elif re.match('pk',key,re.IGNORECASE):
-            return long(value)
-        return -1
+def category_named(name):
+    """
+    the category with this name, created if there isn't one
+    """
+    if name == '':
+        return None
+    category, __=ProductCategory.objects.get_or_create(category=name)
+    return category
 
 class ProductInformation(models.Model):
     """
@@ -487,8 +476,29 @@ class ProductInformation(models.Model):
                                   help_text='last modified on this date')
     modifiedMicroseconds=models.IntegerField(default=0,
                                              help_text='modification microsecond offset')
+    modifiedUs=models.BigIntegerField(default=0, db_index=True,
+                                      help_text='modification time in microseconds since the epoch')
     modifier=models.CharField(max_length=50, default="admin", blank=True,
                               help_text='user that last modified this record')
+    importSchema=ImportSchema('Products', ('Product Code', 'Product Name',
+                                           'Unit of Measure', 'Qty of Measure'),
+        ImportColumn('Product Code', '^.*?product\s*code', 'code', ascii_text),
+        ImportColumn('Product Name', '^.*?product\s*name', 'name', ascii_text),
+        ImportColumn('Product Category', '^.*?product\s*category', 'category', category_named),
+        ImportColumn('Expendable', '^.*expendable.*', 'expendable', flag),
+        ImportColumn('Unit of Measure', '^.*?unit\s*of\s*measure', 'unitOfMeasure', ascii_text),
+        ImportColumn('Qty of Measure', '^.*?qty\s*of\s*measure', 'quantityOfMeasure', integer),
+        ImportColumn('Cost Each', '^.*?cost\s*each', 'costPerItem', float),
+        ImportColumn('Cartons per Pallet', '^.*?cartons\s*per\s*pallet', 'cartonsPerPallet', integer),
+        ImportColumn('Double Stack Pallets', '^.*?double\s*stack\s*pallets', 'doubleStackPallets', flag),
+        ImportColumn('Warehouse Location', '^.*?warehouse\s*location', 'warehouseLocation', ascii_text),
+        ImportColumn('Expiration Date', '^.*?expiration\s*date', 'expirationDate'),
+        ImportColumn('Expiration Notes', '^.*?expiration\s*notes', 'expirationNotes', ascii_text),
+        ImportColumn('Modified', '^\s*modified', 'modified'),
+        ImportColumn('Modifier', '^\s*modifier\s*$', 'modifier', ascii_text),
+        ImportColumn('Picture', '^\s*picture\s*$', 'picture'),
+        ImportColumn('Original Picture Name', '^\s*original\s*picture\s*name\s*$', 'originalPictureName', text),
+    )
     
     @classmethod
     def import_product_information_from_xls(cls,filename=None, file_contents=None):
@@ -502,11 +512,8 @@ class ProductInformation(models.Model):
             warningMessage=repr(e)
             return (data, workbook, warningMessage)
         try:
-            data=xlrdutils.read_lines(workbook, sheet="Products", 
-                                      headerKeys=['Product Code',
-                                                  'Product Name',
-                                                  'Unit of Measure',
-                                                  'Qty of Measure'], 
+            data=xlrdutils.read_lines(workbook, sheet=cls.importSchema.sheet, 
+                                      headerKeys=list(cls.importSchema.required), 
                                       zone=settings.TIME_ZONE)
         except (xlrdutils.XlrdutilsReadHeaderError,
                 xlrdutils.XlrdutilsDateParseError) as e:
@@ -515,32 +522,28 @@ class ProductInformation(models.Model):
     
     @classmethod
     def parse_product_information_from_xls(cls,filename=None, file_contents=None, 
-                                           modifier='', retainModDate=True, save=True):
+                                           modifier='', retainModDate=True, save=True,
+                                           upload=None, progress=None):
         """
-        read in an excel file containing product information and populate the ProductInformation table
+        read in an excel file containing product information and populate the ProductInformation table.
+        An upload is streamed from a CSV, XLSX or XLS file.  progress is called with the 
+        number of rows read and skipped so far.
         """
-        data, workbook, warningMessage=cls.import_product_information_from_xls(filename=filename, file_contents=file_contents)
-        if data is None or workbook is None:
+        #modified comes back as UTC datetime
+        rows, warningMessage=import_rows(cls, cls.import_product_information_from_xls,
+                                         filename=filename,
+                                         file_contents=file_contents,
+                                         upload=upload,
+                                         skipFields=() if retainModDate else ('modified',))
+        if rows is None:
             return None, warningMessage
-        keys=data.keys()
         productCodes=[]
         products=[]
-        for indx in range(len(data[keys[0]])):
+        for rowsRead, values in enumerate(rows, 1):
             productInformation=ProductInformation()
             productInformation.modifier=modifier
-            for header in keys:
-                value=data[header][indx]
-                tableHeader=productInformation.convert_header_name(header)
-                if tableHeader ==-1:
-                    continue
-                if value==0 or value:
-                    value=productInformation.convert_value(tableHeader,value)
-                    if re.match('modified',tableHeader,re.IGNORECASE):
-                        #this comes back as UTC datetime
-                        if retainModDate:
-                            productInformation.modified=value
-                    else:
-                        setattr(productInformation,tableHeader,value)
+            for field, value in values:
+                setattr(productInformation,field,value)
             if productInformation.expirationDate != None and productInformation.expirationDate != '':
                 productInformation.canExpire=True
             else:
@@ -554,6 +557,8 @@ class ProductInformation(models.Model):
             products.append(productInformation)
             if len(products) != len(productCodes):
                 warningMessage = 'Found duplicate product codes'
+            if progress:
+                progress(rowsRead, 0)
         return products, warningMessage
     
     def __unicode__(self):
@@ -572,10 +577,27 @@ class ProductInformation(models.Model):
         if not self.modified:
             self.modified=timezone.now()
         self.modifiedMicroseconds=self.modified.microsecond
+        self.modifiedUs=epoch_microseconds(self.modified)
+        previous=ProductInformation.objects.filter(pk=self.pk).values_list(
+                            'quantityOfMeasure', 'costPerItem', 'category').first()
         super(self.__class__,self).save(*args, **kwargs)
+        if previous and previous[:2] != (self.quantityOfMeasure, self.costPerItem):
+            # the pieces and value of this product changed at every site
+            # holding it
+            SiteInventoryTotals.recompute(list(CurrentInventory.objects.filter(
+                            information=self.pk).values_list('site', flat=True)))
+        if previous and previous != (self.quantityOfMeasure, self.costPerItem,
+                                     self.category_id):
+            InventoryRollup.invalidate()
+        bump_dataset_version()
+    
+    def delete(self, *args, **kwargs):
+        super(self.__class__,self).delete(*args, **kwargs)
+        InventoryRollup.invalidate()
+        bump_dataset_version()
     
     def timestamp(self):
-        return parse_datetime(self.modified.strftime("%FT%H:%M:%S")+"." + '%06d' % self.modifiedMicroseconds+self.modified.strftime("%z"))
+        return self.modified.replace(microsecond=self.modifiedMicroseconds)
     
     def create_key(self):
         return str(self.pk)+'_'+self.name+'_'+ \
@@ -596,73 +618,12 @@ class ProductInformation(models.Model):
                 str(self.modified.strftime("%FT%H:%M:%S %z"))+'_'+self.modifier
     
     def __lt__(self,other):
-        return self.timestamp() < other.timestamp()
+        return self.modifiedUs < other.modifiedUs
     
     def code_is_uuid(self):
         return re.match('[0-9a-f]{8,8}-[0-9a-f]{4,4}-4[0-9a-f]{3,3}-[0-9a-f]{4,4}-[0-9a-f]{12,12}',
                         self.code,re.IGNORECASE) is not None
     
-    def convert_header_name(self,name):
-        if re.match('^.*?product\s*code',name,re.IGNORECASE):
-            return 'code'
-        elif re.match('^.*?product\s*name',name,re.IGNORECASE):
-            return 'name'
-        elif re.match('^.*?product\s*category',name,re.IGNORECASE):
-            return 'category'
-        elif re.match('^.*expendable.*',name,re.IGNORECASE):
-            return 'expendable'
-        elif re.match('^.*?unit\s*of\s*measure',name,re.IGNORECASE):
-            return 'unitOfMeasure'
-        elif re.match('^.*?qty\s*of\s*measure',name,re.IGNORECASE):
-            return 'quantityOfMeasure'
-        elif re.match('^.*?cost\s*each',name,re.IGNORECASE):
-            return 'costPerItem'
-        elif re.match('^.*?cartons\s*per\s*pallet',name,re.IGNORECASE):
-            return 'cartonsPerPallet'
-        elif re.match('^.*?double\s*stack\s*pallets',name,re.IGNORECASE):
-            return 'doubleStackPallets'
-        elif re.match('^.*?warehouse\s*location',name,re.IGNORECASE):
-            return 'warehouseLocation'
-        elif re.match('^.*?expiration\s*date',name,re.IGNORECASE):
-            return 'expirationDate'
-        elif re.match('^.*?expiration\s*notes',name,re.IGNORECASE):
-            return 'expirationNotes'
-        elif re.match('^\s*modified',name,re.IGNORECASE):
-            return 'modified'
-        elif re.match('^\s*modifier\s*$',name,re.IGNORECASE):
-            return 'modifier'
-        elif re.match('^\s*picture\s*$',name,re.IGNORECASE):
-            return 'picture'
-        elif re.match('^\s*original\s*picture\s*name\s*$',name,re.IGNORECASE):
-            return 'originalPictureName'
-        return -1
-
-    def convert_value(self,key,value):
-        if isinstance(getattr(self,key),bool):
-            return value==1
-        elif isinstance(getattr(self,key),int):
-            return int(value)
-        elif isinstance(getattr(self,key),float):
-            return float(value)
-        elif re.match('^category$',key,re.IGNORECASE):
-            if value == '':
-                    return None
-            newCategory, __= ProductCategory.objects.get_or_create(category=value)
-            return newCategory
-        elif re.match('^picture$', key, re.IGNORECASE):
-            return value
-        elif re.match('^originalpicturename$', key, re.IGNORECASE):
-            return value.strip()
-        elif isinstance(getattr(self,key),str):
-            return str(unicode(value.strip().encode('ascii','replace')))
-        elif isinstance(getattr(self,key),unicode):
-            return unicode(value.strip())
-        elif re.match('^.*date',key,re.IGNORECASE):
-            return value
-        elif re.match('^\s*modified\s*$',key,re.IGNORECASE):
-            return value
-        return -1
-    
     def check_product(self):
         """
         check to see if any required fields are empty
@@ -730,17 +691,263 @@ class ProductInformation(models.Model):
         """
         number of sites containing this product in current inventory
         """
-        sites = InventoryItem.objects.filter(information = self.pk, 
-                                             deleted = False).values('site').distinct()
-        siteIds = [site['site'] for site in sites]
-        sites = Site.objects.filter(pk__in = siteIds)
-        return len([site for site  in sites \
-                    if site.latest_inventory_for_product(code = self.code)])
+        return CurrentInventory.objects.filter(information=self.pk,
+                                               item__deleted=False).count()
+    
+    @classmethod
+    def sites_containing_counts(cls, codes):
+        """
+        number of sites containing each of the products in current inventory,
+        as a dict of code: number of sites, in a single query
+        """
+        counts=dict((code, 0) for code in codes)
+        current=CurrentInventory.objects.filter(information__in=counts.keys(),
+                                                item__deleted=False)
+        for product in current.order_by().values('information').annotate(
+                                                numSites=Count('site')):
+            counts[product['information']]=product['numSites']
+        return counts
 
 ###########################################################
 #  The below models have relations to the base models above
 ###########################################################
 
+def start_of_day(value):
+    return value.astimezone(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def start_of_week(value):
+    day=start_of_day(value)
+    return day - timedelta(days=day.weekday())
+
+def start_of_month(value):
+    return start_of_day(value).replace(day=1)
+
+# time series buckets, by name, to the start of the bucket holding a time
+SERIES_BUCKETS={None:None,
+                'day':start_of_day,
+                'week':start_of_week,
+                'month':start_of_month,}
+
+def extended_quantity(quantity='quantity'):
+    """
+    the number of individual items in quantity cartons, computed in the
+    database
+    """
+    return ExpressionWrapper(F(quantity) * F('information__quantityOfMeasure'),
+                             output_field=models.BigIntegerField())
+
+def extended_value(quantity='quantity'):
+    """
+    the cost of the individual items in quantity cartons, computed in the
+    database
+    """
+    return ExpressionWrapper(F(quantity) * 
+                             F('information__quantityOfMeasure') * 
+                             F('information__costPerItem'),
+                             output_field=models.DecimalField(decimal_places=2,
+                                                              max_digits=14))
+
+class InventoryItemQuerySet(models.QuerySet):
+    """
+    InventoryItem queries
+    """
+    
+    def latest_per_product(self, stopDate=None):
+        """
+        restrict to the latest change record for each product at each site, as
+        of stopDate if given.  A record is the latest if no other record for 
+        the same site and product is newer, ordered by modifiedUs and then pk.
+        This is a single statement with a correlated subquery, no matter how 
+        many sites and products there are.
+        """
+        connection=connections[self.db]
+        qn=connection.ops.quote_name
+        table=qn(self.model._meta.db_table)
+        params=[]
+        stopDateClause=''
+        inventory=self
+        if stopDate:
+            stopDateUs=epoch_microseconds(stopDate)
+            inventory=inventory.filter(modifiedUs__lte=stopDateUs)
+            checkpoint=InventoryCheckpoint.nearest(stopDate)
+            if checkpoint:
+                # only the records in the checkpoint and the changes made
+                # since it can be the latest as of stopDate
+                inventory=inventory.filter(
+                    Q(pk__in=InventoryCheckpoint.objects.filter(
+                                asOf=checkpoint).values('item')) |
+                    Q(modifiedUs__gt=epoch_microseconds(checkpoint)))
+            stopDateClause='AND newer.%s <= %%s ' % qn('modifiedUs')
+            params.append(stopDateUs)
+        columns={'table':table,
+                 'site':qn('site_id'),
+                 'information':qn('information_id'),
+                 'modifiedUs':qn('modifiedUs'),
+                 'id':qn('id'),
+                 'stopDate':stopDateClause}
+        newerExists=('NOT EXISTS (SELECT 1 FROM %(table)s newer '
+                     'WHERE newer.%(site)s = %(table)s.%(site)s '
+                     'AND newer.%(information)s = %(table)s.%(information)s '
+                     '%(stopDate)s'
+                     'AND (newer.%(modifiedUs)s > %(table)s.%(modifiedUs)s '
+                     'OR (newer.%(modifiedUs)s = %(table)s.%(modifiedUs)s '
+                     'AND newer.%(id)s > %(table)s.%(id)s)))' % columns)
+        return inventory.extra(where=[newerExists], params=params)
+    
+    def recent_distinct(self, field, limit):
+        """
+        the first limit distinct values of field, most recently changed first.
+        Returns an OrderedDict of value: pk of the newest record with that 
+        value.  The history is read newest first in growing batches, and 
+        reading stops as soon as there are enough values, so the cost depends
+        on how recent the activity is and not on the size of the history.
+        """
+        recentValues=OrderedDict()
+        recent=self.order_by('-modifiedUs', '-pk').values_list('pk', field)
+        start=0
+        batchSize=max(4 * limit, 100)
+        while len(recentValues) < limit:
+            batch=list(recent[start:start + batchSize])
+            for pk, value in batch:
+                if value not in recentValues:
+                    recentValues[value]=pk
+                    if len(recentValues) >= limit:
+                        break
+            if len(batch) < batchSize:
+                break
+            start += batchSize
+            batchSize *= 2
+        return recentValues
+    
+    def latest_state(self, stopDate=None):
+        """
+        restrict to the latest, non-deleted change record for each product at
+        each site, as of stopDate if given.  The current state is read from
+        the CurrentInventory table.
+        """
+        if stopDate:
+            inventory=self.latest_per_product(stopDate=stopDate)
+        else:
+            inventory=self.filter(current__isnull=False)
+        return inventory.filter(deleted=False)
+    
+    def quantity_series(self, startDate, stopDate, bucket=None, bySite=False):
+        """
+        the quantity over time, from startDate through stopDate, summed over 
+        the sites or, with bySite, for each site.  The history is read in a
+        single query ordered by time.  With bucket ('day', 'week' or 'month')
+        there is one point per bucket holding the last value in the bucket.
+        Returns an OrderedDict of site number, or None for the sum, to a list
+        of (time, quantity) points.  The first point is the quantity at 
+        startDate.
+        """
+        bucketStart=SERIES_BUCKETS[bucket]
+        startUs=epoch_microseconds(startDate)
+        firstTime=bucketStart(startDate) if bucketStart else startDate
+        quantities={}
+        total=0
+        series=OrderedDict()
+        if not bySite:
+            series[None]=[(firstTime, 0)]
+        history=self.filter(modifiedUs__lte=epoch_microseconds(stopDate)).order_by(
+                            'modifiedUs', 'pk').values_list('site', 'modified', 
+                                                            'modifiedUs', 'quantity', 
+                                                            'deleted')
+        for siteId, modified, modifiedUs, quantity, deleted in history.iterator():
+            quantity=0 if deleted else quantity
+            total+=quantity - quantities.get(siteId, 0)
+            quantities[siteId]=quantity
+            if bySite:
+                points=series.setdefault(siteId, [(firstTime, 0)])
+                value=quantity
+            else:
+                points=series[None]
+                value=total
+            if modifiedUs <= startUs:
+                # the state at startDate
+                points[0]=(firstTime, value)
+                continue
+            when=bucketStart(modified) if bucketStart else modified
+            if points[-1][0] == when:
+                # the last value in the bucket wins
+                points[-1]=(when, value)
+            else:
+                points.append((when, value))
+        return series
+    
+    def with_extended(self):
+        """
+        annotate each change record with extendedQuantity, the number of 
+        individual items, and extendedValue, their cost, computed in the
+        database
+        """
+        return self.annotate(extendedQuantity=extended_quantity(),
+                             extendedValue=extended_value())
+    
+    def product_totals(self):
+        """
+        the total quantity, pieces and value of each product, summed in the
+        database.  Returns a dict of product code: (quantity, pieces, value)
+        """
+        # Django 1.9 can't sum an annotation after values(), so the
+        # expressions are summed directly
+        totals=self.order_by().values('information').annotate(
+                            totalQuantity=Sum('quantity'),
+                            totalPieces=Sum(extended_quantity()),
+                            totalValue=Sum(extended_value()))
+        return dict((total['information'], (total['totalQuantity'] or 0,
+                                            total['totalPieces'] or 0,
+                                            total['totalValue'] or Decimal(0)))
+                    for total in totals)
+    
+    def changes_between(self, startDate, stopDate):
+        """
+        the change in inventory from startDate to stopDate, for each product
+        at each site.  Uses the latest state as of each date and a count of the
+        change records in between, grouped in the database.  Returns a dict of
+        (site number, product code): (quantity at startDate, quantity at 
+        stopDate, net change, number of change records)
+        """
+        startQuantities=dict(((siteId, code), quantity) for siteId, code, quantity in
+                             self.latest_state(stopDate=startDate).values_list(
+                                                'site', 'information', 'quantity'))
+        stopQuantities=dict(((siteId, code), quantity) for siteId, code, quantity in
+                            self.latest_state(stopDate=stopDate).values_list(
+                                                'site', 'information', 'quantity'))
+        changeCounts=dict(((counts['site'], counts['information']), counts['changes'])
+                          for counts in self.filter(
+                                modifiedUs__gt=epoch_microseconds(startDate),
+                                modifiedUs__lte=epoch_microseconds(stopDate)).order_by().values(
+                                'site', 'information').annotate(changes=Count('pk')))
+        changes={}
+        for key in set(startQuantities) | set(stopQuantities) | set(changeCounts):
+            startQuantity=startQuantities.get(key, 0)
+            stopQuantity=stopQuantities.get(key, 0)
+            changes[key]=(startQuantity, stopQuantity, stopQuantity - startQuantity,
+                          changeCounts.get(key, 0))
+        return changes
+    
+    def latest_for_sites(self,
+                         sites,
+                         stopDate=None,
+                         orderBy={'information__name':'information__name'}):
+        """
+        latest, non-deleted inventory at each of the sites, as of stopDate if
+        given.  All of the sites are fetched in a single query, with the product
+        information and category already joined.  Returns an OrderedDict of
+        site: list of inventory items, in the order the sites were given.
+        """
+        sitesList=OrderedDict((site.pk, site) for site in sites)
+        inventory=self.filter(site__in=sitesList.keys()).latest_state(
+                            stopDate=stopDate).with_extended().select_related(
+                            'information', 'information__category')
+        siteInventory=OrderedDict((site, []) for site in sitesList.values())
+        for item in inventory.order_by(*orderBy.values()):
+            site=sitesList[item.site_id]
+            item.site=site
+            siteInventory[site].append(item)
+        return siteInventory
+
 class InventoryItem(models.Model):
     """
     Red Cross Inventory InventoryItem
@@ -748,6 +955,12 @@ class InventoryItem(models.Model):
     
     class Meta():
         get_latest_by='modified'
+        # history lookups filter on site and product and then on the
+        # modification time, while the latest state lookups also check deleted
+        index_together = (('site', 'information', 'modified', 'modifiedMicroseconds'),
+                          ('site', 'information', 'modifiedUs'),
+                          ('information', 'deleted', 'site'),)
+    objects=InventoryItemQuerySet.as_manager()
     information=models.ForeignKey(ProductInformation,
                                   help_text="The detailed information about this product type")
     site=models.ForeignKey(Site,
@@ -759,25 +972,31 @@ class InventoryItem(models.Model):
                                   help_text='last modified on this date')
     modifiedMicroseconds=models.IntegerField(default=0,
                                              help_text='modification microsecond offset')
+    modifiedUs=models.BigIntegerField(default=0, db_index=True,
+                                      help_text='modification time in microseconds since the epoch')
     modifier=models.CharField(max_length=50, default="admin", blank=True,
                               help_text='user that last modified this record')
+    # the product code and prefix are only used to find the product
+    importSchema=ImportSchema('Inventory', ('Cartons', 'Site Number', 'Product Code'),
+        ImportColumn('Product Code', '^.*?product\s*code', 'code', upper_text),
+        ImportColumn('Product Name', '^.*?product\s*name'),
+        ImportColumn('Prefix', '^.*?prefix', 'prefix', upper_text),
+        ImportColumn('Site Number', '^.*?site\s*number', 'site_id', integer),
+        ImportColumn('Cartons', '^.*?cartons\s*$', 'quantity', integer),
+        ImportColumn('modified', 'modified', 'modified'),
+        ImportColumn('modifier', '^\s*modifier\s*$', 'modifier', ascii_text),
+        ImportColumn('deleted', '^\s*deleted\s*$', 'deleted', flag),
+    )
+    
     @classmethod
     def recently_changed(cls, pageSize):
         """
         list of recently changed inventory.
         """
-        recentInventory=InventoryItem.objects.all()
-        recentInventoryList=[]
-        for item in recentInventory:
-            recentInventoryList.append(item)
-        recentInventoryList.sort(reverse=True)
-        inventoryList=OrderedDict()
-        for inventoryItem in recentInventoryList:
-            if not inventoryList.has_key(inventoryItem.information):
-                inventoryList[inventoryItem.information]=inventoryItem
-            if len(inventoryList)>=pageSize:
-                break
-        return inventoryList.values()
+        itemIds=InventoryItem.objects.recent_distinct('information', pageSize).values()
+        inventoryItems=InventoryItem.objects.select_related(
+                            'information').in_bulk(itemIds)
+        return [inventoryItems[itemId] for itemId in itemIds]
     
     @classmethod
     def import_inventory_from_xls(cls,filename=None, file_contents=None):
@@ -791,10 +1010,8 @@ class InventoryItem(models.Model):
             warningMessage=repr(e)
             return (data, workbook, warningMessage)
         try:
-            data=xlrdutils.read_lines(workbook, sheet="Inventory", 
-                                      headerKeys=['Cartons',
-                                                  'Site Number',
-                                                  'Product Code'], 
+            data=xlrdutils.read_lines(workbook, sheet=cls.importSchema.sheet, 
+                                      headerKeys=list(cls.importSchema.required), 
                                       zone=settings.TIME_ZONE)
         except (xlrdutils.XlrdutilsReadHeaderError,
                 xlrdutils.XlrdutilsDateParseError) as e:
@@ -804,84 +1021,187 @@ class InventoryItem(models.Model):
     
     @classmethod
     def parse_inventory_from_xls(cls, filename=None, file_contents=None, 
-                                 modifier='', retainModDate=True, save=True):
+                                 modifier='', retainModDate=True, save=True,
+                                 batchSize=None, upload=None, progress=None):
         """
-        read in an excel file containing product inventory information and populate the InventoryItem table
+        read in an excel file containing product inventory information and populate the InventoryItem table.
+        An upload is streamed from a CSV, XLSX or XLS file.  Rows are read, checked and written 
+        batchSize at a time, settings.IMPORT_BATCH_SIZE by default.  After each batch progress is 
+        called with the number of rows read and skipped, as not inventory or unchanged, so far.
         """
-        data, workbook, warningMessage=cls.import_inventory_from_xls(filename=filename, file_contents=file_contents)
-        if data is None or workbook is None:
+        #modified comes back as UTC datetime
+        rows, warningMessage=import_rows(cls, cls.import_inventory_from_xls,
+                                         filename=filename,
+                                         file_contents=file_contents,
+                                         upload=upload,
+                                         skipFields=() if retainModDate else ('modified',))
+        if rows is None:
             return None, warningMessage
-        keys=data.keys()
+        if batchSize is None:
+            batchSize=importBatchSize
+        counts={'read':0, 'skipped':0}
+        def parsed_items():
+            for values in rows:
+                counts['read'] += 1
+                inventoryItem=InventoryItem()
+                inventoryItem.modifier=modifier
+                for field, value in values:
+                    setattr(inventoryItem,field,value)
+                # rows without a code or a product prefix aren't inventory
+                if (hasattr(inventoryItem, 'code') and 
+                    re.match('p',getattr(inventoryItem, 'prefix', ''),re.IGNORECASE)):
+                    yield inventoryItem
+                else:
+                    counts['skipped'] += 1
+        parsedItems=parsed_items()
         skipped = 0
-        inventoryItemKeys=[]
-        inventoryItems=[]
         skippedItems = []
-        for indx in range(len(data[keys[0]])):
-            inventoryItem=InventoryItem()
-            inventoryItem.modifier=modifier
-            for header in keys:
-                value=data[header][indx]
-                tableHeader=inventoryItem.convert_header_name(header)
-                if tableHeader == -1:
-                    if re.match('^.*?product\s*code',header,re.IGNORECASE):
-                        inventoryItem.code=value.strip().upper()
-                    elif re.match('^.*?prefix',header,re.IGNORECASE):
-                        inventoryItem.prefix=value.strip().upper()
-                    elif re.match('modified',header,re.IGNORECASE) and retainModDate:
-                        #this comes back as UTC datetime
-                        if value:
-                            inventoryItem.modified=value
-                    else:
-                        continue
-                else:
-                    if value==0 or value:
-                        if re.match('^.*?site',tableHeader):
-                            inventoryItem.site_id=value
-                        else:
-                            value=inventoryItem.convert_value(tableHeader,value)
-                            setattr(inventoryItem,tableHeader,value)
-            try:
-                if not re.match('p',inventoryItem.prefix,re.IGNORECASE):
-                    continue
-                if inventoryItem.linkToInformation() == -1 or inventoryItem.linkToSite() == -1:
-                    skipped += 1
-                    skippedItems.append('site %d, code %s'% (inventoryItem.site_id,inventoryItem.code))
+        inventoryItemKeys=set()
+        inventoryItems=[]
+        # keys of the records saved by this import
+        savedKeys=set()
+        since=None
+        siteIds=set()
+        with transaction.atomic():
+            while not skipped:
+                batch=list(islice(parsedItems, batchSize))
+                if not batch:
                     break
-            except AttributeError:
-                # no prefix was parsed from the Excel file
-                continue
-            site=Site.objects.get(pk=inventoryItem.site_id)
-            item = site.product_in_inventory_history(item=inventoryItem)
-            if item:
-                if save:
-                    # don't save inventory if there is no change
-                    continue
-                #inventoryItem=item
-            if save:
-                inventoryItem.save()
-            if inventoryItem.create_key_no_pk_no_modified() not in inventoryItemKeys:
-                inventoryItemKeys.append(inventoryItem.create_key_no_pk_no_modified())
-            inventoryItems.append(inventoryItem)
-            if len(inventoryItems) != len(inventoryItemKeys):
-                warningMessage = 'Found duplicate inventory items'
+                # look up the products and sites for the batch at once.  Product 
+                # codes are matched regardless of case, as the database does.
+                products=dict((code.upper(), product) for code, product in 
+                              ProductInformation.objects.in_bulk(
+                                    list(set(item.code for item in batch))).iteritems())
+                sites=Site.objects.in_bulk(list(set(item.site_id for item in batch 
+                                                    if item.site_id is not None)))
+                linkedItems=[]
+                for inventoryItem in batch:
+                    information=products.get(inventoryItem.code)
+                    site=sites.get(inventoryItem.site_id)
+                    if information is None or site is None:
+                        skipped += 1
+                        skippedItems.append('site %d, code %s'% (inventoryItem.site_id,inventoryItem.code))
+                        break
+                    inventoryItem.information=information
+                    inventoryItem.site=site
+                    linkedItems.append(inventoryItem)
+                # records that are already in the history aren't saved again.  
+                # Only rows with a modification date can match one.
+                existingKeys=set()
+                datedItems=[item for item in linkedItems if item.modified]
+                if save and datedItems:
+                    existingKeys.update(InventoryItem.objects.filter(
+                                    site__in=set(item.site_id for item in datedItems),
+                                    modified__range=(min(item.modified for item in datedItems),
+                                                     max(item.modified for item in datedItems))
+                                    ).values_list('site_id',
+                                                  'information_id',
+                                                  'quantity',
+                                                  'deleted',
+                                                  'modified').iterator())
+                newItems=[]
+                for inventoryItem in linkedItems:
+                    if save:
+                        dated=bool(inventoryItem.modified)
+                        inventoryItem.fill_in_modified()
+                        historyKey=inventoryItem.create_history_key()
+                        if historyKey in existingKeys or historyKey in savedKeys:
+                            # don't save inventory if there is no change
+                            counts['skipped'] += 1
+                            continue
+                        if dated:
+                            savedKeys.add(historyKey)
+                        newItems.append(inventoryItem)
+                    inventoryItemKeys.add(inventoryItem.create_key_no_pk_no_modified())
+                    inventoryItems.append(inventoryItem)
+                    if len(inventoryItems) != len(inventoryItemKeys):
+                        warningMessage = 'Found duplicate inventory items'
+                if newItems:
+                    cls.bulk_insert(newItems)
+                    batchSince=min(item.modified for item in newItems)
+                    if since is None or batchSince < since:
+                        since=batchSince
+                    siteIds.update(item.site_id for item in newItems)
+                if progress:
+                    progress(counts['read'], counts['skipped'])
+            if siteIds:
+                # bulk_create skips InventoryItem.save(), so bring everything
+                # that depends on the history up to date in one go
+                CurrentInventory.rebuild(list(siteIds))
+                InventoryCheckpoint.objects.filter(asOf__gte=since).delete()
+                InventoryRollup.invalidate(since)
+                bump_dataset_version()
         if skipped > 0:
             warningMessage = 'One or more inventory items referenced product codes or site numbers not found in the database.  Maybe you need to import products and/or sites first?' + repr(skippedItems)
         return inventoryItems, warningMessage
     
+    @classmethod
+    def bulk_insert(cls, items):
+        """
+        insert new inventory items in one statement and fill in their primary
+        keys.  The current inventory, checkpoints and rollups are left to the
+        caller.
+        """
+        lastPk=cls.objects.aggregate(Max('pk'))['pk__max'] or 0
+        cls.objects.bulk_create(items)
+        # MySQL doesn't return the primary keys of bulk inserted rows, so 
+        # match the new rows back to the items
+        created={}
+        for row in cls.objects.filter(pk__gt=lastPk).order_by('pk').values_list(
+                                'pk', 'site_id', 'information_id', 'quantity',
+                                'deleted', 'modifiedUs', 'modifier').iterator():
+            created.setdefault(row[1:], []).append(row[0])
+        for item in items:
+            pks=created.get((item.site_id, item.information_id, item.quantity,
+                             item.deleted, item.modifiedUs, item.modifier))
+            if pks:
+                item.pk=pks.pop(0)
+    
     def __unicode__(self):
         return self.information.name+"("+str(self.information.code)+"-"+str(self.quantity)+")"
     
-    def save(self, *args, **kwargs):
+    def fill_in_modified(self):
         # add in microseconds offset to make sure we can distinguish order of saves
         if not self.modified:
             self.modified=timezone.now()
         self.modifiedMicroseconds=self.modified.microsecond
+        self.modifiedUs=epoch_microseconds(self.modified)
         if self.deleted:
             self.quantity=0
-        super(self.__class__,self).save(*args, **kwargs)
+    
+    def save(self, *args, **kwargs):
+        self.fill_in_modified()
+        created=self.pk is None
+        since=self.modified
+        if not created:
+            previousModified=InventoryItem.objects.filter(pk=self.pk).values_list(
+                                        'modified', flat=True).first()
+            if previousModified and previousModified < since:
+                since=previousModified
+        # keep the current inventory table in step with the history
+        with transaction.atomic():
+            super(self.__class__,self).save(*args, **kwargs)
+            CurrentInventory.update_for_item(self, created=created)
+            InventoryCheckpoint.invalidate(self, created=created)
+            InventoryRollup.invalidate(since)
+            bump_dataset_version()
+    
+    def delete(self, *args, **kwargs):
+        siteId=self.site_id
+        informationId=self.information_id
+        wasCurrent=CurrentInventory.objects.filter(item=self.pk).exists()
+        with transaction.atomic():
+            # deleting the latest record also deletes its current inventory
+            # entry, so fall back to the next most recent record
+            InventoryCheckpoint.invalidate(self, created=False)
+            InventoryRollup.invalidate(self.modified)
+            super(self.__class__,self).delete(*args, **kwargs)
+            if wasCurrent:
+                CurrentInventory.refresh(siteId, informationId)
+            bump_dataset_version()
         
     def __lt__(self,other):
-        return self.timestamp() < other.timestamp()
+        return self.modifiedUs < other.modifiedUs
     
     def equal(self,other):
         #return self.create_key() == other.create_key()
@@ -894,7 +1214,7 @@ class InventoryItem(models.Model):
             (self.modified == other.modified)
             
     def timestamp(self):
-        return parse_datetime(self.modified.strftime("%FT%H:%M:%S")+"." + '%06d' % self.modifiedMicroseconds+self.modified.strftime("%z"))
+        return self.modified.replace(microsecond=self.modifiedMicroseconds)
     
     def create_key(self):
         return str(self.pk)+'_'+str(self.site_id)+'_'+ \
@@ -906,37 +1226,15 @@ class InventoryItem(models.Model):
                 self.information_id+'_'+str(bool(self.deleted))+'_'+ \
                 str(self.modified.strftime("%FT%H:%M:%S %z"))+'_'+self.modifier
     
+    def create_history_key(self):
+        return (self.site_id, self.information_id, self.quantity,
+                bool(self.deleted), self.modified)
+    
     def create_key_no_pk_no_modified(self):
         return str(self.site_id)+'_'+ \
                 self.information_id+'_'+str(bool(self.deleted))+'_'+ \
                 '_'+self.modifier
     
-    def convert_header_name(self,name):
-        if re.match('^.*?site\s*number',name,re.IGNORECASE):
-            return 'site'
-        elif re.match('^.*?cartons\s*$',name,re.IGNORECASE):
-            return 'quantity'
-        elif re.match('^\s*deleted\s*$',name,re.IGNORECASE):
-            return 'deleted'
-        elif re.match('^\s*modifier\s*$',name,re.IGNORECASE):
-            return 'modifier'
-        return -1
-
-    def convert_value(self,key,value):
-        if isinstance(getattr(self,key),bool):
-            return value==1
-        elif isinstance(getattr(self,key),int):
-            return int(value)
-        elif isinstance(getattr(self,key),str):
-            return str(value.strip())
-        elif isinstance(getattr(self,key),unicode):
-            return unicode(value)
-        elif re.match('^.*date',key,re.IGNORECASE):
-            return value
-        elif re.match('^.*site',key,re.IGNORECASE):
-            return value
-        return -1
-
     def linkToInformation(self):
         if hasattr(self, 'code'):
             info=ProductInformation.objects.filter(pk=self.code)
@@ -981,5 +1279,621 @@ class InventoryItem(models.Model):
         return newItem
     
     def pieces(self):
+        # computed in the database by InventoryItemQuerySet.with_extended()
+        if hasattr(self, 'extendedQuantity'):
+            return self.extendedQuantity
         return self.quantity * self.information.quantityOfMeasure
-    
\ No newline at end of file
+    
+
+class CurrentInventory(models.Model):
+    """
+    Latest inventory change record for each product at each site.  This is
+    maintained by InventoryItem.save() and InventoryItem.delete(), so the
+    current state of a site can be read without replaying its history.
+    """
+    
+    class Meta():
+        unique_together = (('site', 'information'),)
+    site=models.ForeignKey(Site,
+                           help_text="The site containing this inventory")
+    information=models.ForeignKey(ProductInformation,
+                                  help_text="The detailed information about this product type")
+    item=models.OneToOneField(InventoryItem, related_name='current',
+                              help_text="The latest inventory change record for this product at this site")
+    
+    @classmethod
+    def update_for_item(cls, item, created=True):
+        """
+        record item as the current state of its product at its site, if it is
+        at least as recent as the existing current state
+        """
+        if not created:
+            # an existing record was changed.  It may have moved to another
+            # site or product, or it may no longer be the latest record, so
+            # recalculate everything it touches from the history
+            pairs=set([(item.site_id, item.information_id)])
+            for stale in cls.objects.filter(item=item):
+                pairs.add((stale.site_id, stale.information_id))
+                stale.delete()
+            for siteId, informationId in pairs:
+                cls.refresh(siteId, informationId)
+            return
+        current=cls.objects.select_related('item').filter(
+                                site=item.site_id,
+                                information=item.information_id).first()
+        if current is None:
+            cls.objects.create(site_id=item.site_id,
+                               information_id=item.information_id,
+                               item=item)
+            SiteInventoryTotals.update_for_change(item.site_id, item)
+        elif not item < current.item:
+            # saved first, so that a site without totals is recomputed with
+            # the new item
+            replaced=current.item
+            current.item=item
+            current.save()
+            SiteInventoryTotals.update_for_change(item.site_id, item,
+                                                  replaced=replaced)
+    
+    @classmethod
+    def rebuild(cls, siteIds=None):
+        """
+        recalculate the current inventory from the history, for the given
+        sites or for all sites, along with their totals
+        """
+        latest=InventoryItem.objects.all()
+        existing=cls.objects.all()
+        if siteIds is not None:
+            latest=latest.filter(site__in=siteIds)
+            existing=existing.filter(site__in=siteIds)
+        latest=latest.latest_per_product().values_list('pk',
+                                                       'site_id',
+                                                       'information_id')
+        with transaction.atomic():
+            existing.delete()
+            cls.objects.bulk_create([cls(site_id=siteId,
+                                         information_id=informationId,
+                                         item_id=pk)
+                                     for pk, siteId, informationId in latest],
+                                    batch_size=500)
+            SiteInventoryTotals.recompute(siteIds)
+    
+    @classmethod
+    def refresh(cls, siteId, informationId):
+        """
+        recalculate the current state of a product at a site from its history
+        """
+        latest=InventoryItem.objects.filter(
+                            site=siteId,
+                            information=informationId).order_by(
+                            '-modifiedUs', '-pk').first()
+        cls.objects.filter(site=siteId, information=informationId).delete()
+        if latest:
+            cls.objects.create(site_id=siteId,
+                               information_id=informationId,
+                               item=latest)
+        SiteInventoryTotals.recompute([siteId])
+
+class SiteInventoryTotals(models.Model):
+    """
+    Totals of the current inventory at a site.  These are kept up to date by
+    the CurrentInventory updates, so the sites list and reports can show them
+    without going through the inventory.
+    """
+    
+    site=models.OneToOneField(Site, primary_key=True, related_name='totals',
+                              help_text="The site these totals are for")
+    totalQuantity=models.IntegerField(default=0,
+                                      help_text="Total number of inventory units (each, boxes, cases, ...) at the site")
+    totalPieces=models.BigIntegerField(default=0,
+                                       help_text="Total number of individual items at the site")
+    totalValue=models.DecimalField(default=0, decimal_places=2, max_digits=14,
+                                   help_text="Total cost of the individual items at the site")
+    productCount=models.IntegerField(default=0,
+                                     help_text="Number of products in the site's current inventory")
+    
+    @classmethod
+    def contribution(cls, item):
+        """
+        (quantity, pieces, value, count) that item adds to its site's totals
+        """
+        if item.deleted:
+            return 0, 0, Decimal(0), 0
+        pieces=item.quantity * item.information.quantityOfMeasure
+        value=pieces * Decimal(str(item.information.costPerItem or 0))
+        return item.quantity, pieces, value, 1
+    
+    @classmethod
+    def update_for_change(cls, siteId, item, replaced=None):
+        """
+        add item to the site's totals, in place of replaced if given
+        """
+        quantity, pieces, value, count=cls.contribution(item)
+        if replaced is not None:
+            # both records are for the same product
+            replaced.information=item.information
+            oldQuantity, oldPieces, oldValue, oldCount=cls.contribution(replaced)
+            quantity-=oldQuantity
+            pieces-=oldPieces
+            value-=oldValue
+            count-=oldCount
+        updated=cls.objects.filter(site=siteId).update(
+                            totalQuantity=F('totalQuantity') + quantity,
+                            totalPieces=F('totalPieces') + pieces,
+                            totalValue=F('totalValue') + value,
+                            productCount=F('productCount') + count)
+        if not updated:
+            # no totals yet, the current inventory already includes this change
+            cls.recompute([siteId])
+    
+    @classmethod
+    def recompute(cls, siteIds=None):
+        """
+        recalculate the totals from the current inventory, for the given sites
+        or for all sites.  Sites without any current inventory get all zero
+        totals.
+        """
+        current=CurrentInventory.objects.filter(item__deleted=False)
+        existing=cls.objects.all()
+        sites=Site.objects.all()
+        if siteIds is not None:
+            current=current.filter(site__in=siteIds)
+            existing=existing.filter(site__in=siteIds)
+            sites=sites.filter(pk__in=siteIds)
+        siteTotals=current.order_by().values('site').annotate(
+                            totalQuantity=Sum('item__quantity'),
+                            totalPieces=Sum(extended_quantity('item__quantity')),
+                            totalValue=Sum(extended_value('item__quantity')),
+                            productCount=Count('pk'))
+        with transaction.atomic():
+            siteTotals=dict((totals['site'], totals) for totals in siteTotals)
+            existing.delete()
+            newTotals=[]
+            for siteId in sites.values_list('pk', flat=True):
+                totals=siteTotals.get(siteId)
+                if totals is None:
+                    newTotals.append(cls(site_id=siteId))
+                else:
+                    newTotals.append(cls(site_id=siteId,
+                                         totalQuantity=totals['totalQuantity'] or 0,
+                                         totalPieces=totals['totalPieces'] or 0,
+                                         totalValue=totals['totalValue'] or 0,
+                                         productCount=totals['productCount']))
+            cls.objects.bulk_create(newTotals, batch_size=500)
+
+class InventoryCheckpoint(models.Model):
+    """
+    Snapshot of the latest inventory change record for each product at each
+    site as of a point in time.  Inventory as of a later date only needs the
+    checkpoint and the changes made after it, instead of the whole history.
+    Checkpoints are written by the create_inventory_checkpoints command and
+    dropped when a change to the history makes them stale.
+    """
+    
+    class Meta():
+        unique_together = (('asOf', 'site', 'information'),)
+    asOf=models.DateTimeField(db_index=True,
+                              help_text='the inventory state is as of this date')
+    site=models.ForeignKey(Site,
+                           help_text="The site containing this inventory")
+    information=models.ForeignKey(ProductInformation,
+                                  help_text="The detailed information about this product type")
+    item=models.ForeignKey(InventoryItem, related_name='checkpoints',
+                           help_text="The latest inventory change record for this product at this site as of this date")
+    
+    @classmethod
+    def nearest(cls, stopDate):
+        """
+        date of the latest checkpoint on or before stopDate, or None
+        """
+        return cls.objects.filter(asOf__lte=stopDate).aggregate(
+                                        Max('asOf'))['asOf__max']
+    
+    @classmethod
+    def create_checkpoint(cls, asOf):
+        """
+        record the latest inventory change record for each product at each
+        site as of asOf, replacing any existing checkpoint for that date.
+        Returns the number of records in the checkpoint.
+        """
+        with transaction.atomic():
+            cls.objects.filter(asOf=asOf).delete()
+            latest=InventoryItem.objects.latest_per_product(
+                                        stopDate=asOf).values_list('pk',
+                                                                   'site_id',
+                                                                   'information_id')
+            checkpoint=[cls(asOf=asOf,
+                            site_id=siteId,
+                            information_id=informationId,
+                            item_id=pk)
+                        for pk, siteId, informationId in latest.iterator()]
+            cls.objects.bulk_create(checkpoint, batch_size=500)
+        return len(checkpoint)
+    
+    @classmethod
+    def month_ends(cls, stopDate=None):
+        """
+        the last moment of each month, in the local time zone, from the first
+        inventory change up to stopDate
+        """
+        if not stopDate:
+            stopDate=timezone.now()
+        first=InventoryItem.objects.aggregate(Min('modified'))['modified__min']
+        monthEnds=[]
+        if not first:
+            return monthEnds
+        localZone=pytz.timezone(settings.TIME_ZONE)
+        month=first.astimezone(localZone).replace(tzinfo=None, day=1, hour=0,
+                                                  minute=0, second=0,
+                                                  microsecond=0)
+        while True:
+            nextMonth=(month + timedelta(days=32)).replace(day=1)
+            monthEnd=localZone.localize(nextMonth - timedelta(microseconds=1))
+            if monthEnd > stopDate:
+                break
+            monthEnds.append(monthEnd)
+            month=nextMonth
+        return monthEnds
+    
+    @classmethod
+    def invalidate(cls, item, created=True):
+        """
+        drop the checkpoints that a change to item may have made stale.  That
+        is every checkpoint from the item's modification date on, and, for an
+        existing item, every checkpoint that refers to it.
+        """
+        since=item.modified
+        if not created:
+            referenced=cls.objects.filter(item=item.pk).aggregate(
+                                        Min('asOf'))['asOf__min']
+            if referenced and referenced < since:
+                since=referenced
+        cls.objects.filter(asOf__gte=since).delete()
+
+class InventoryRollup(models.Model):
+    """
+    Base for the daily inventory rollups.  Each row holds totals of the
+    inventory as of the end of a day, 23:59 UTC, the same time the reports
+    use for a stop date.  Rollups are written by the rollup_inventory command
+    and dropped from the date of any change to the history on, so each run
+    only rebuilds the days changed since the last one.
+    """
+    
+    class Meta():
+        abstract = True
+    date=models.DateField(db_index=True,
+                          help_text='the inventory totals are as of the end of this day')
+    totalQuantity=models.IntegerField(default=0,
+                                      help_text="Total number of inventory units (each, boxes, cases, ...)")
+    totalPieces=models.BigIntegerField(default=0,
+                                       help_text="Total number of individual items")
+    totalValue=models.DecimalField(default=0, decimal_places=2, max_digits=14,
+                                   help_text="Total cost of the individual items")
+    
+    @staticmethod
+    def rollup_models():
+        return (ProductInventoryRollup, SiteInventoryRollup, CategoryInventoryRollup)
+    
+    @staticmethod
+    def as_of(date):
+        """
+        the time that the rollups for date are as of
+        """
+        return pytz.utc.localize(datetime.combine(date, time(23, 59)))
+    
+    @staticmethod
+    def first_date(modified):
+        """
+        the first day whose rollups include a change made at modified
+        """
+        modified=modified.astimezone(pytz.utc)
+        if modified > InventoryRollup.as_of(modified.date()):
+            return modified.date() + timedelta(days=1)
+        return modified.date()
+    
+    @staticmethod
+    def invalidate(since=None):
+        """
+        drop the rollups that a change made at since may have made stale, or
+        all of them if since is None
+        """
+        for model in InventoryRollup.rollup_models():
+            rollups=model.objects.all()
+            if since is not None:
+                rollups=rollups.filter(date__gte=InventoryRollup.first_date(since))
+            rollups.delete()
+    
+    @staticmethod
+    def build(date, copyFrom=None):
+        """
+        write the rollups for date, replacing any that exist.  If copyFrom is
+        the date of existing rollups, and the inventory did not change between
+        the two dates, those rollups are copied instead.
+        """
+        with transaction.atomic():
+            for model in InventoryRollup.rollup_models():
+                model.objects.filter(date=date).delete()
+            if copyFrom is not None:
+                for model in InventoryRollup.rollup_models():
+                    rollups=list(model.objects.filter(date=copyFrom))
+                    for rollup in rollups:
+                        rollup.pk=None
+                        rollup.date=date
+                    model.objects.bulk_create(rollups, batch_size=500)
+                return
+            products=dict((code, (quantityOfMeasure, Decimal(str(costPerItem or 0)), categoryId))
+                          for code, quantityOfMeasure, costPerItem, categoryId in 
+                          ProductInformation.objects.values_list('code',
+                                                                 'quantityOfMeasure',
+                                                                 'costPerItem',
+                                                                 'category'))
+            productTotals={}
+            siteTotals={}
+            categoryTotals={}
+            latest=InventoryItem.objects.latest_state(
+                            stopDate=InventoryRollup.as_of(date)).values_list(
+                                                    'site', 'information', 'quantity')
+            for siteId, code, quantity in latest.iterator():
+                quantityOfMeasure, costPerItem, categoryId=products[code]
+                pieces=quantity * quantityOfMeasure
+                value=pieces * costPerItem
+                for totals, key in ((productTotals, code),
+                                    (siteTotals, siteId),
+                                    (categoryTotals, categoryId)):
+                    total=totals.setdefault(key, [0, 0, Decimal(0), 0])
+                    total[0]+=quantity
+                    total[1]+=pieces
+                    total[2]+=value
+                    total[3]+=1
+            ProductInventoryRollup.objects.bulk_create(
+                [ProductInventoryRollup(date=date,
+                                        information_id=code,
+                                        totalQuantity=quantity,
+                                        totalPieces=pieces,
+                                        totalValue=value,
+                                        siteCount=count)
+                 for code, (quantity, pieces, value, count) in productTotals.iteritems()],
+                batch_size=500)
+            SiteInventoryRollup.objects.bulk_create(
+                [SiteInventoryRollup(date=date,
+                                     site_id=siteId,
+                                     totalQuantity=quantity,
+                                     totalPieces=pieces,
+                                     totalValue=value,
+                                     productCount=count)
+                 for siteId, (quantity, pieces, value, count) in siteTotals.iteritems()],
+                batch_size=500)
+            CategoryInventoryRollup.objects.bulk_create(
+                [CategoryInventoryRollup(date=date,
+                                         category_id=categoryId,
+                                         totalQuantity=quantity,
+                                         totalPieces=pieces,
+                                         totalValue=value,
+                                         productCount=count)
+                 for categoryId, (quantity, pieces, value, count) in categoryTotals.iteritems()],
+                batch_size=500)
+    
+    @staticmethod
+    def rollup(throughDate=None):
+        """
+        write the missing daily rollups, from the day of the first inventory
+        change through throughDate, by default yesterday.  A day without 
+        inventory changes is copied from the day before.  Returns the dates
+        written.
+        """
+        if throughDate is None:
+            throughDate=timezone.now().astimezone(pytz.utc).date() - timedelta(days=1)
+        first=InventoryItem.objects.aggregate(Min('modified'))['modified__min']
+        if not first:
+            return []
+        date=InventoryRollup.first_date(first)
+        built=set(ProductInventoryRollup.objects.filter(
+                            date__gte=date,
+                            date__lte=throughDate).values_list('date', flat=True).distinct())
+        missing=[date + timedelta(days=day) 
+                 for day in range((throughDate - date).days + 1)
+                 if date + timedelta(days=day) not in built]
+        if not missing:
+            return []
+        # days with inventory changes can't be copied from the day before
+        changed=set(InventoryRollup.first_date(modified) for modified in 
+                    InventoryItem.objects.filter(
+                            modified__gt=InventoryRollup.as_of(missing[0] - timedelta(days=1)),
+                            modified__lte=InventoryRollup.as_of(throughDate)).values_list(
+                                                    'modified', flat=True).iterator())
+        for date in missing:
+            previous=date - timedelta(days=1)
+            if previous in built and date not in changed:
+                InventoryRollup.build(date, copyFrom=previous)
+            else:
+                InventoryRollup.build(date)
+            built.add(date)
+        return missing
+
+class ProductInventoryRollup(InventoryRollup):
+    """
+    Daily totals of a product across all sites
+    """
+    
+    class Meta():
+        unique_together = (('date', 'information'),)
+    information=models.ForeignKey(ProductInformation, related_name='rollups',
+                                  help_text="The product these totals are for")
+    siteCount=models.IntegerField(default=0,
+                                  help_text="Number of sites holding this product")
+
+class SiteInventoryRollup(InventoryRollup):
+    """
+    Daily totals of the inventory at a site
+    """
+    
+    class Meta():
+        unique_together = (('date', 'site'),)
+    site=models.ForeignKey(Site, related_name='rollups',
+                           help_text="The site these totals are for")
+    productCount=models.IntegerField(default=0,
+                                     help_text="Number of products in the site's inventory")
+
+class CategoryInventoryRollup(InventoryRollup):
+    """
+    Daily totals of the products in a category across all sites.  Products
+    without a category are totaled with no category.
+    """
+    
+    class Meta():
+        unique_together = (('date', 'category'),)
+    category=models.ForeignKey(ProductCategory, related_name='rollups',
+                               blank=True, null=True,
+                               help_text="The category these totals are for")
+    productCount=models.IntegerField(default=0,
+                                     help_text="Number of product and site pairs in this category's inventory")
+
+class RequestTiming(models.Model):
+    """
+    Measurements of one call to an instrumented report, export or backup
+    function.  Saved when settings.RECORD_REPORT_TIMINGS is set, so they can
+    be reviewed in the admin.
+    """
+    
+    class Meta():
+        ordering = ['-started']
+    name=models.CharField(max_length=100, db_index=True,
+                          help_text="The instrumented function")
+    started=models.DateTimeField(default=timezone.now, db_index=True,
+                                 help_text="When the call started")
+    user=models.CharField(max_length=50, default="", blank=True,
+                          help_text="The user making the request")
+    wallTime=models.FloatField(default=0,
+                               help_text="Elapsed time in seconds")
+    queries=models.IntegerField(default=0,
+                                help_text="Number of SQL queries")
+    sqlTime=models.FloatField(default=0,
+                              help_text="Total time of the SQL queries in seconds")
+    rows=models.IntegerField(default=0,
+                             help_text="Number of model instances created")
+    peakMemoryIncrease=models.BigIntegerField(default=0,
+                                              help_text="How much the call raised the peak memory use of the process, in kilobytes")
+    
+    def __unicode__(self):
+        return ('timing %s: %.3fs, %d queries in %.3fs, %d rows, peak memory +%d KB' % 
+                (self.name, self.wallTime, self.queries, self.sqlTime, self.rows,
+                 self.peakMemoryIncrease))
+
+class ImportJob(models.Model):
+    """
+    A spreadsheet import queued by one of the import views and run by the
+    process_import_jobs command, so that a large file doesn't have to be
+    imported within a request.  The command records its progress as it
+    goes.
+    """
+    SITES = 'sites'
+    PRODUCTS = 'products'
+    CATEGORIES = 'categories'
+    INVENTORY = 'inventory'
+    kindChoices = (
+        (SITES, 'sites'),
+        (PRODUCTS, 'products'),
+        (CATEGORIES, 'categories'),
+        (INVENTORY, 'inventory'),
+    )
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    statusChoices = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    )
+    
+    class Meta():
+        ordering = ['-created']
+    kind=models.CharField(max_length=20, choices=kindChoices,
+                          help_text="What the spreadsheet imports")
+    upload=models.FileField(max_length=256, upload_to='import_jobs/%Y/%m',
+                            help_text="The uploaded spreadsheet")
+    fileName=models.CharField(max_length=256, default="", blank=True,
+                              help_text="Name of the file that was uploaded")
+    modifier=models.CharField(max_length=50, default="", blank=True,
+                              help_text='user that queued the import')
+    status=models.CharField(max_length=10, default=QUEUED, choices=statusChoices,
+                            db_index=True, help_text="Where the import is up to")
+    created=models.DateTimeField(default=timezone.now,
+                                 help_text="When the import was queued")
+    started=models.DateTimeField(blank=True, null=True,
+                                 help_text="When the import started")
+    finished=models.DateTimeField(blank=True, null=True,
+                                  help_text="When the import finished")
+    rowsTotal=models.IntegerField(default=0,
+                                  help_text="Number of rows in the spreadsheet")
+    rowsProcessed=models.IntegerField(default=0,
+                                      help_text="Number of rows read so far")
+    rowsSkipped=models.IntegerField(default=0,
+                                    help_text="Number of rows read that weren't imported")
+    warnings=models.TextField(default="", blank=True,
+                              help_text="Warnings from the import")
+    errors=models.TextField(default="", blank=True,
+                            help_text="Why the import failed")
+    
+    def __unicode__(self):
+        return 'import of %s from %s (%s)' % (self.kind, self.fileName, self.status)
+    
+    @classmethod
+    def kind_model(cls, kind):
+        return {cls.SITES:Site,
+                cls.PRODUCTS:ProductInformation,
+                cls.CATEGORIES:ProductCategory,
+                cls.INVENTORY:InventoryItem,}[kind]
+    
+    def model(self):
+        return self.kind_model(self.kind)
+    
+    def parse_method(self):
+        return {self.SITES:Site.parse_sites_from_xls,
+                self.PRODUCTS:ProductInformation.parse_product_information_from_xls,
+                self.CATEGORIES:ProductCategory.parse_product_categories_from_xls,
+                self.INVENTORY:InventoryItem.parse_inventory_from_xls,}[self.kind]
+    
+    @classmethod
+    def claim_next(cls):
+        """
+        mark the oldest queued job as running and return it, or None if there
+        are no queued jobs.  Safe with more than one worker.
+        """
+        with transaction.atomic():
+            job=cls.objects.select_for_update().filter(
+                            status=cls.QUEUED).order_by('created', 'pk').first()
+            if job is None:
+                return None
+            job.status=cls.RUNNING
+            job.started=timezone.now()
+            job.save()
+        return job
+    
+    def eta(self):
+        """
+        estimated seconds until a running job finishes, from its rate so far,
+        or None
+        """
+        if (self.status != self.RUNNING or not self.started or
+            not self.rowsProcessed or not self.rowsTotal):
+            return None
+        elapsed=(timezone.now() - self.started).total_seconds()
+        remaining=max(self.rowsTotal - self.rowsProcessed, 0)
+        return elapsed * remaining / self.rowsProcessed
+    
+    def progress(self):
+        """
+        the job's state for the status view
+        """
+        return OrderedDict((('id', self.pk),
+                            ('kind', self.kind),
+                            ('fileName', self.fileName),
+                            ('status', self.status),
+                            ('rowsTotal', self.rowsTotal),
+                            ('rowsProcessed', self.rowsProcessed),
+                            ('rowsSkipped', self.rowsSkipped),
+                            ('warnings', self.warnings),
+                            ('errors', self.errors),
+                            ('eta', self.eta()),))
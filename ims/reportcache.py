@@ -0,0 +1,140 @@
+"""
+Versioned cache of report results.  Cached results are keyed by the dataset
+version, which is bumped by every write to sites, products, categories or
+inventory, so a cached report is never served after the data under it
+changes.  The version is kept in the configured Django cache backend, which
+needs to be shared (memcached, database, ...) for the versions to be seen by
+every server process.  The reports themselves are kept in each process, in
+a bounded least recently used cache of reportCacheSize reports, so the
+reports of old versions are pushed out by newer ones without a shared index
+to keep in step.  Reports with a stop date in the past are kept until they
+are pushed out, others for reportCacheTimeout seconds.  With a process-local
+backend, such as the default local memory cache, one process can't see the
+writes of the others, so every report is only kept for
+reportCacheLocalTimeout seconds.
+"""
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.conf import settings
+from collections import OrderedDict
+import cPickle as pickle
+import hashlib
+import threading
+import time
+
+try:
+    reportCacheSize = settings.REPORT_CACHE_SIZE
+except AttributeError:
+    reportCacheSize = 100
+try:
+    reportCacheTimeout = settings.REPORT_CACHE_TIMEOUT
+except AttributeError:
+    reportCacheTimeout = 3600
+try:
+    reportCacheLocalTimeout = settings.REPORT_CACHE_LOCAL_TIMEOUT
+except AttributeError:
+    reportCacheLocalTimeout = 60
+
+DATASET_VERSION_KEY = 'ims:datasetVersion'
+REPORT_KEY_PREFIX = 'ims:report:'
+
+def new_dataset_version():
+    # start from the time in microseconds, so that a version key lost from
+    # the cache never restarts below a version that is still in use
+    return int(time.time() * 1000000)
+
+def dataset_version():
+    """
+    current version of the inventory data set
+    """
+    version = cache.get(DATASET_VERSION_KEY)
+    if version is None:
+        cache.add(DATASET_VERSION_KEY, new_dataset_version(), None)
+        version = cache.get(DATASET_VERSION_KEY, new_dataset_version())
+    return version
+
+def increment_dataset_version():
+    try:
+        cache.incr(DATASET_VERSION_KEY)
+    except ValueError:
+        # not in the cache
+        cache.set(DATASET_VERSION_KEY, new_dataset_version(), None)
+
+def bump_dataset_version():
+    """
+    invalidate all cached reports.  Called for every write to the data set.
+    The version is bumped again when the transaction commits, so that a report
+    computed from data that was not committed yet is never served afterwards.
+    """
+    increment_dataset_version()
+    transaction.on_commit(increment_dataset_version)
+
+class ReportCache(object):
+    """
+    least recently used cache of pickled reports, holding at most size
+    reports.  Each report is pickled, like the Django cache backends do, so
+    that every caller gets its own copy.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.reports = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.reports.pop(key, None)
+            if entry is None:
+                return None
+            pickled, expires = entry
+            if expires is not None and expires <= time.time():
+                return None
+            # most recently used last
+            self.reports[key] = entry
+        return pickle.loads(pickled)
+
+    def set(self, key, result, timeout=None):
+        entry = (pickle.dumps(result, pickle.HIGHEST_PROTOCOL),
+                 None if timeout is None else time.time() + timeout)
+        with self.lock:
+            self.reports.pop(key, None)
+            self.reports[key] = entry
+            while len(self.reports) > self.size:
+                self.reports.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.reports.clear()
+
+    def __contains__(self, key):
+        return key in self.reports
+
+reportCache = ReportCache(reportCacheSize)
+
+def report_cache_key(report, stopDate, orderBy, version):
+    key = repr((report, stopDate, tuple(orderBy.items()), version))
+    return REPORT_KEY_PREFIX + hashlib.md5(key).hexdigest()
+
+def report_timeout(isPast = False):
+    """
+    seconds to keep a cached report, or None to keep it until it is pushed
+    out.  Reports with a stop date in the past only change when their history
+    is edited, which bumps the dataset version, so they don't expire.
+    """
+    if isinstance(caches['default'], LocMemCache):
+        return reportCacheLocalTimeout
+    return None if isPast else reportCacheTimeout
+
+def cached_report(report, stopDate, orderBy, computeReport, isPast = False):
+    """
+    the cached result of computeReport() for this report, stop date and order,
+    computing and caching it if it isn't cached for the current data set.
+    """
+    if reportCache.size <= 0:
+        return computeReport()
+    key = report_cache_key(report, stopDate, orderBy, dataset_version())
+    result = reportCache.get(key)
+    if result is None:
+        result = computeReport()
+        reportCache.set(key, result, report_timeout(isPast))
+    return result
@@ -36,6 +36,10 @@ $(document).ready(function() {
             var basePath = $(this).attr("href").replace(/\?.*/,"");
             $(this).attr("href", basePath + query.slice(0,-1));
         });
+        $("[id$=-print-csv]").each(function(){
+            var basePath = $(this).attr("href").replace(/\?.*/,"");
+            $(this).attr("href", basePath + query + "format=csv");
+        });
     });
     $("#stopDate").change(function(){
     	$(this).val(validate_date($(this).val(), previousStopDate));
@@ -50,6 +54,10 @@ $(document).ready(function() {
             var basePath = $(this).attr("href").replace(/\?.*/,"");
             $(this).attr("href", basePath + query.slice(0,-1));
         });
+        $("[id$=-print-csv]").each(function(){
+            var basePath = $(this).attr("href").replace(/\?.*/,"");
+            $(this).attr("href", basePath + query + "format=csv");
+        });
     });
     var startDate = $('#startDate').val();
     var stopDate = $('#stopDate').val();
@@ -58,7 +66,7 @@ $(document).ready(function() {
     $('.datepicker').datepicker();
     $('.datepicker').datepicker("option", "dateFormat", "mm-dd-yy");
     $( '#startDate' ).val( startDate );
-    $( '#stopDate' ).val( startDate );
+    $( '#stopDate' ).val( stopDate );
     $( '#startDate' ).change();
     $( '#stopDate' ).change();
 });
\ No newline at end of file
@@ -12,6 +12,8 @@ urlpatterns = [
     url(r'^import_products$', views.import_products, name='import_products'),
     # import inventory
     url(r'^import_inventory$', views.import_inventory, name='import_inventory'),
+    # progress of a queued import
+    url(r'^imports/jobs/(?P<jobId>\d+)$', views.import_job_status, name='import_job_status'),
     # restore the database
     url(r'^restore$', views.restore, name='restore'),
     # this will display inventory history with no report without dates
@@ -26,8 +28,12 @@ urlpatterns = [
     url(r'^reports/inventory_detail_print$', views.inventory_detail_print, name='inventory_detail_print'),
     # this will display site inventory print report
     url(r'^reports/inventory_status_print$', views.inventory_status_print, name='inventory_status_print'),
+    # this will display the inventory change print report
+    url(r'^reports/inventory_change_print$', views.inventory_change_print, name='inventory_change_print'),
         # this will display reports page with no report without dates
     url(r'^reports$', views.reports, name='reports'),
+    # this will serve a pre-rendered report from the report store
+    url(r'^reports/saved/(?P<fileName>[\w\-]+\.(?:html|csv))$', views.report_artifact, name='report_artifact'),
     # this will display sites, paged from page 1
     url(r'^sites$', views.sites, name='sites'),
      # this will display details of a particular site with all inventory paged from page 1
@@ -46,6 +52,8 @@ urlpatterns = [
     url(r'^products$', views.products, name='products'),
     # this will display details of a particular product
     url(r'^products/product_detail/\s*(?P<code>[\w\d\_\-]+)\s*$', views.product_detail, name='product_detail'),
+    # this will return a product's quantity over time as json
+    url(r'^products/quantity_series/\s*(?P<code>[\w\d\_\-]+)\s*$', views.product_quantity_series, name='product_quantity_series'),
     # this is the add product page
     url(r'^products/product_add$', views.product_add, name='product_add'),
     # this is the page to select a site to add a product to
@@ -1,22 +1,32 @@
 from django.shortcuts import render, redirect
-from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse, Http404,\
+JsonResponse
 from django.core.urlresolvers import reverse
 from django.core.files import File
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.utils import timezone
+from django.utils.html import escape
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.cache import never_cache
 from django.forms.models import modelformset_factory
 from django.utils.dateparse import parse_datetime, parse_date, date_re
 from django.conf import settings
-from django.db import transaction
-from .models import Site, InventoryItem, ProductInformation, ProductCategory
+from django.db import transaction, connection, connections
+from django.db.models import Q
+from django.db.models.signals import post_init
+from .models import Site, InventoryItem, ProductInformation, ProductCategory,\
+CurrentInventory, SiteInventoryTotals, InventoryRollup, ProductInventoryRollup,\
+SERIES_BUCKETS, RequestTiming, ImportJob
+from .reportcache import cached_report, bump_dataset_version
+from .importdiff import diff_import
 from .forms import InventoryItemFormNoSite, InventoryItemFormAddSubtractNoSite,\
 ProductInformationForm, ProductInformationFormWithQuantity, SiteForm, \
 SiteFormReadOnly, SiteListForm,ProductListFormWithDelete, TitleErrorList, \
 ProductListFormWithAdd, UploadFileForm, ProductInformationFormReadOnly, \
 ProductListFormWithoutDelete
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from subprocess import check_call, check_output, CalledProcessError
 from urllib import urlencode
 from urlparse import urlparse
@@ -29,6 +39,12 @@ import xlwt
 import logging
 import StringIO
 import zipfile
+import tempfile
+import csv
+import time
+import resource
+import threading
+from functools import wraps
 from xlrdutils.xlrdutils import XlrdutilsError
 
 try:
@@ -51,6 +67,39 @@ try:
     tempDir = settings.TEMP_DIR
 except AttributeError:
     tempDir = '/tmp'
+try:
+    streamReports = settings.STREAM_REPORTS
+except AttributeError:
+    streamReports = False
+try:
+    reportChunkSize = settings.REPORT_CHUNK_SIZE
+except AttributeError:
+    reportChunkSize = 50
+try:
+    reportWorkers = settings.REPORT_WORKERS
+except AttributeError:
+    reportWorkers = 0
+try:
+    reportStoreDir = settings.REPORT_STORE_DIR
+except AttributeError:
+    reportStoreDir = os.path.join(settings.MEDIA_ROOT, 'reports')
+try:
+    showReportTimings = settings.SHOW_REPORT_TIMINGS
+except AttributeError:
+    showReportTimings = False
+try:
+    recordReportTimings = settings.RECORD_REPORT_TIMINGS
+except AttributeError:
+    recordReportTimings = False
+try:
+    instrumentReports = (settings.INSTRUMENT_REPORTS or showReportTimings or 
+                         recordReportTimings)
+except AttributeError:
+    instrumentReports = showReportTimings or recordReportTimings
+try:
+    backgroundImports = settings.BACKGROUND_IMPORTS
+except AttributeError:
+    backgroundImports = False
 
 #TODO: Utilize Red Cross SSO authentication
 
@@ -94,6 +143,111 @@ def log_actions(request = None,
                 request.session['errorMessage'] +=  str(IOError('Error writing status to log file:<br/>%s' % str(e)))
         pass
 
+instrumentationState = threading.local()
+# instrumented calls in progress in all threads, while the post_init
+# receiver counting model instances is connected
+rowCounting = {'calls':0}
+rowCountingLock = threading.Lock()
+
+def count_materialized_row(sender, **kwargs):
+    instrumentationState.rows = getattr(instrumentationState, 'rows', 0) + 1
+
+def start_counting_rows():
+    with rowCountingLock:
+        if rowCounting['calls'] == 0:
+            post_init.connect(count_materialized_row, 
+                              dispatch_uid = 'ims_count_materialized_row')
+        rowCounting['calls'] += 1
+
+def stop_counting_rows():
+    with rowCountingLock:
+        rowCounting['calls'] -= 1
+        if rowCounting['calls'] == 0:
+            post_init.disconnect(dispatch_uid = 'ims_count_materialized_row')
+
+class QueryCounter(object):
+    """
+    stands in for a connection's queries_log while a call is measured,
+    counting the queries and their time as they are logged and passing them
+    on to the log it replaces, which only keeps the latest queries
+    """
+    def __init__(self, queriesLog):
+        self.queriesLog = queriesLog
+        self.count = 0
+        self.time = 0.0
+
+    def append(self, query):
+        self.count += 1
+        self.time += float(query['time'])
+        self.queriesLog.append(query)
+
+    @property
+    def maxlen(self):
+        return self.queriesLog.maxlen
+
+    def clear(self):
+        self.queriesLog.clear()
+
+    def __iter__(self):
+        return iter(self.queriesLog)
+
+    def __len__(self):
+        return len(self.queriesLog)
+
+def instrumented(name):
+    """
+    decorate a function that takes the request first, to measure each call
+    when settings.INSTRUMENT_REPORTS is set: the wall time, the number and 
+    time of the SQL queries on the default connection, the model instances 
+    created and how much the call raised the peak memory of the process.
+    The measurements are logged with log_actions, saved as a RequestTiming
+    if settings.RECORD_REPORT_TIMINGS is set, and added to the bottom of
+    html pages if settings.SHOW_REPORT_TIMINGS is set.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(request, *args, **kwargs):
+            if not instrumentReports:
+                return func(request, *args, **kwargs)
+            start_counting_rows()
+            forceDebugCursor = connection.force_debug_cursor
+            connection.force_debug_cursor = True
+            queriesLog = connection.queries_log
+            queryCounter = QueryCounter(queriesLog)
+            connection.queries_log = queryCounter
+            rowsBefore = getattr(instrumentationState, 'rows', 0)
+            peakBefore = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            started = timezone.now()
+            start = time.time()
+            try:
+                result = func(request, *args, **kwargs)
+            finally:
+                connection.queries_log = queriesLog
+                connection.force_debug_cursor = forceDebugCursor
+                stop_counting_rows()
+            timing = RequestTiming(name = name,
+                                   started = started,
+                                   user = getattr(getattr(request, 'user', None), 
+                                                  'username', ''),
+                                   wallTime = time.time() - start,
+                                   queries = queryCounter.count,
+                                   sqlTime = queryCounter.time,
+                                   rows = getattr(instrumentationState, 'rows', 0) - rowsBefore,
+                                   peakMemoryIncrease = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - 
+                                                         peakBefore))
+            log_actions(request = request, modifier = timing.user or 'unknown',
+                        modificationMessage = unicode(timing))
+            if recordReportTimings:
+                timing.save()
+            if (showReportTimings and isinstance(result, HttpResponse) and 
+                'text/html' in result.get('Content-Type', '')):
+                footer = render_to_string('ims/report_timings.html', {'timing':timing})
+                result.content = result.content.replace('</body>', 
+                                                        footer.encode('utf-8') + '</body>', 1)
+            return result
+        return wrapper
+    return decorator
+
 def get_session_messages(request):
     if 'errorMessage' in request.session:
         errorMessage = request.session['errorMessage']
@@ -181,9 +335,21 @@ def update_session_page_info(request):
     request.session[parsedUrl.path] = pageDict
     return page, pageSize
 
-def create_paginator(request, items = None):
+class CountPaginator(Paginator):
+    """
+    paginator that only knows how many items there are, for pages that fetch
+    their own items
+    """
+    def __init__(self, count, per_page, **kwargs):
+        super(CountPaginator, self).__init__([], per_page, **kwargs)
+        self._count = count
+
+def create_paginator(request, items = None, count = None):
     page, pageSize = update_session_page_info(request)
-    paginator = Paginator(items, pageSize)
+    if count is None:
+        paginator = Paginator(items, pageSize)
+    else:
+        paginator = CountPaginator(count, pageSize)
     try:
         paginatorPage = paginator.page(page)
     except PageNotAnInteger:
@@ -218,8 +384,8 @@ def home(request):
     # display most recently edited sites and inventory
     errorMessage, warningMessage, infoMessage = get_session_messages(request)
     totalSites = Site.objects.all().count()
-    totalProducts = InventoryItem.objects.all().values('information').distinct().count()
-    paginatorPage = create_paginator(request, [None] * max(totalSites, totalProducts))
+    totalProducts = CurrentInventory.objects.all().values('information').distinct().count()
+    paginatorPage = create_paginator(request, count = max(totalSites, totalProducts))
     recentSites = Site.recently_changed_inventory(paginatorPage.paginator.per_page)
     recentInventory = InventoryItem.recently_changed(paginatorPage.paginator.per_page)
     recentSites = recentSites[:paginatorPage.paginator.per_page]
@@ -309,20 +475,18 @@ def imports(request):
                                                 'canDeleteSites':canDeleteSites and canDeleteInventory,
                                                 'canDeleteProducts':canDeleteProducts and canDeleteInventory,
                                                 'canDeleteInventory':canDeleteInventory,
+                                                'importJobs':visible_import_jobs(request)[:10],
                                                 'adminName':adminName,
                                                 'adminEmail':adminEmail,
                                                 'siteVersion':siteVersion,
                                                 'imsVersion':imsVersion,
                                                 })
 
+@instrumented('get_sorted_inventory')
 def get_sorted_inventory(request,
                          report = '', 
                          startDate = None, 
                          stopDate = None):
-    sitesList=None
-    inventoryList=None
-    includesCategories = False
-    includesMeaningfulCodes = False
     orderBy = OrderedDict()
     if report and startDate and stopDate:
         startDate = validate_date(startDate, '-')
@@ -331,74 +495,289 @@ def get_sorted_inventory(request,
         parsedStopDate = parse_datestr_tz(reorder_date_mdy_to_ymd(stopDate, '-'), 23, 59)
         if re.match('^site_', report):
             orderBy = update_order_by(request, ('name',))
-            sites = Site.objects.all().order_by(*orderBy.values())
-        else:
-            sites = Site.objects.all().order_by('name')
+        elif re.match('^inventory_', report):
+            orderBy = update_order_by(request,
+                                      ('information__name',
+                                       'information__code',))
+        # reports up to a day that is over can't change until the data set does
+        isPast = parsedStopDate.date() < timezone.localtime(timezone.now()).date()
+        return (orderBy,) + cached_report(report, 
+                                          stopDate, 
+                                          orderBy,
+                                          lambda: sort_inventory(report = report,
+                                                                 stopDate = parsedStopDate,
+                                                                 orderBy = orderBy),
+                                          isPast = isPast)
+    return orderBy, None, None, False, False
+
+def sort_by_fields(items, orderBy, keys):
+    """
+    sort items in place by each field in orderBy, most significant first.
+    keys maps each field to a key function, and a '-' in the orderBy value
+    sorts that field in descending order.
+    """
+    # Python's sort is stable, so sorting by the least significant field
+    # first leaves the items sorted by all of the fields
+    for field in reversed(orderBy.keys()):
+        items.sort(key = keys[field], reverse = '-' in orderBy[field])
+    return items
+
+productSortKeys = {'information__name':lambda information: information.name,
+                   'information__code':lambda information: information.code,}
+
+def pivot_inventory(inventory, products, sites):
+    """
+    product x site matrix of the inventory, built in one pass over 
+    (product code, site number, quantity, pieces) rows with the pieces 
+    computed in the database.  products and sites map primary keys to
+    instances.  Returns a dict of 
+    product: ([(site, quantity, pieces), ...], (total quantity, total pieces))
+    with the sites in name order.
+    """
+    matrix = {}
+    for code, siteId, quantity, pieces in inventory.with_extended().order_by(
+                                                'site__name', 'site').values_list(
+                                                'information', 'site', 'quantity', 
+                                                'extendedQuantity'):
+        product = products[code]
+        if product not in matrix:
+            matrix[product] = list(), [0, 0]
+        siteQuantityList, totals = matrix[product]
+        siteQuantityList.append((sites[siteId], quantity, pieces))
+        totals[0] += quantity
+        totals[1] += pieces
+    return dict((product, (siteQuantityList, tuple(totals))) 
+                for product, (siteQuantityList, totals) in matrix.iteritems())
+
+def call_with_own_connection(funcAndShard):
+    func, shard = funcAndShard
+    try:
+        return func(shard)
+    finally:
+        # each pool thread opened its own database connections
+        connections.close_all()
+
+def map_site_shards(func, sites):
+    """
+    call func on contiguous shards of the sites list, in a pool of 
+    settings.REPORT_WORKERS threads that each use their own database 
+    connection, and return the results in shard order.  Without a pool, or
+    inside a transaction whose changes the other connections can't see, func
+    is called once on all of the sites.
+    """
+    if reportWorkers <= 1 or len(sites) <= 1 or connection.in_atomic_block:
+        return [func(sites)]
+    shardSize = -(-len(sites) // reportWorkers)
+    shards = [sites[start:start + shardSize] for start in xrange(0, len(sites), shardSize)]
+    pool = ThreadPool(min(reportWorkers, len(shards)))
+    try:
+        return pool.map(call_with_own_connection, [(func, shard) for shard in shards])
+    finally:
+        pool.close()
+        pool.join()
+
+def merge_pivots(matrices):
+    """
+    merge product x site matrices for disjoint, ordered shards of the sites,
+    keeping each product's sites in shard order
+    """
+    merged = {}
+    for matrix in matrices:
+        for product, (siteQuantityList, (totalQuantity, totalPieces)) in matrix.iteritems():
+            if product in merged:
+                mergedList, (mergedQuantity, mergedPieces) = merged[product]
+                merged[product] = (mergedList + siteQuantityList, 
+                                   (mergedQuantity + totalQuantity, mergedPieces + totalPieces))
+            else:
+                merged[product] = (siteQuantityList, (totalQuantity, totalPieces))
+    return merged
+
+def sort_inventory(report = '',
+                   stopDate = None,
+                   orderBy = None):
+    """
+    sites and inventory for a report as of stopDate, sorted by orderBy.
+    Returns sitesList, inventoryList, includesCategories, includesMeaningfulCodes
+    """
+    includesCategories = False
+    includesMeaningfulCodes = False
+    sitesList = OrderedDict()
+    inventoryList = OrderedDict()
+    if re.match('^site_detail', report): 
+        # site detail reports don't contain inventory details, just get
+        # the site data and pass it to the template for rendering
+        sitesList = list(Site.objects.all().order_by(*orderBy.values()))
+    elif re.match('^site_', report):
+        # site reports list the inventory at each site
+        sites = list(Site.objects.all().order_by(*orderBy.values()))
         sitesList = OrderedDict()
-        inventoryList = OrderedDict()
-        if re.match('^site_detail', report): 
-            # site detail reports don't contain inventory details, just get
-            # the site data and pass it to the template for rendering
-            sitesList = sites
+        for shardList in map_site_shards(lambda shard: InventoryItem.objects.latest_for_sites(
+                                                                shard, 
+                                                                stopDate = stopDate), 
+                                         sites):
+            sitesList.update(shardList)
+        includesCategories = any(item.information.category_id is not None 
+                                 for siteInventory in sitesList.itervalues()
+                                 for item in siteInventory)
+    elif (re.match('^inventory_status', report) and stopDate is not None and
+          stopDate == InventoryRollup.as_of(stopDate.date()) and
+          ProductInventoryRollup.objects.filter(date = stopDate.date()).exists()):
+        # the status report only needs the totals for each product, which
+        # are in the daily rollups for past days
+        rollups = ProductInventoryRollup.objects.filter(date = stopDate.date()).select_related(
+                                                    'information', 'information__category')
+        matrix = dict((rollup.information, (list(), (rollup.totalQuantity, rollup.totalPieces)))
+                      for rollup in rollups)
+        inventoryList = OrderedDict((product, matrix[product]) for product in 
+                                    sort_by_fields(matrix.keys(), orderBy, productSortKeys))
+        includesCategories = any(product.category_id is not None for product in matrix)
+        includesMeaningfulCodes = any(not product.code_is_uuid() for product in matrix)
+        sitesList = list()
+    elif re.match('^inventory_status', report):
+        # the status report only needs the totals for each product, which 
+        # are summed in the database
+        products = dict((product.pk, product) for product in 
+                        ProductInformation.objects.select_related('category'))
+        productTotals = InventoryItem.objects.latest_state(stopDate = stopDate).product_totals()
+        matrix = dict((products[code], (list(), (totalQuantity, totalPieces))) 
+                      for code, (totalQuantity, totalPieces, __) in productTotals.iteritems())
+        inventoryList = OrderedDict((product, matrix[product]) for product in 
+                                    sort_by_fields(matrix.keys(), orderBy, productSortKeys))
+        includesCategories = any(product.category_id is not None for product in matrix)
+        includesMeaningfulCodes = any(not product.code_is_uuid() for product in matrix)
+        sitesList = list()
+    elif re.match('^inventory_', report):
+        # inventory reports list the sites holding each product
+        sitesByName = list(Site.objects.all().order_by('name', 'pk'))
+        sites = dict((site.pk, site) for site in sitesByName)
+        products = dict((product.pk, product) for product in 
+                        ProductInformation.objects.select_related('category'))
+        latestInventory = InventoryItem.objects.latest_state(stopDate = stopDate)
+        if reportWorkers > 1:
+            matrix = merge_pivots(map_site_shards(
+                        lambda shard: pivot_inventory(
+                                        latestInventory.filter(site__in = [site.pk for site in shard]),
+                                        products,
+                                        sites),
+                        sitesByName))
         else:
-            # other reports require information about the inventory at each site
-            for site in sites:
-                if re.match('^inventory_', report):
-                    orderBy = update_order_by(request,
-                                              ('information__name',
-                                               'information__code',))
-                    if orderBy:
-                        siteInventory=site.latest_inventory(stopDate = parsedStopDate,
-                                                            orderBy = orderBy)
-                    else:
-                        siteInventory=site.latest_inventory(stopDate = parsedStopDate,)
-                else:
-                    siteInventory=site.latest_inventory(stopDate = parsedStopDate,)
-                sitesList[site] = siteInventory
-                if not includesCategories:
-                    includesCategories = siteInventory.filter(information__category__isnull = False).count() > 0
-                if re.match('^inventory_', report):
-                    # these reports require details about each inventory item
-                    # contained at each site
-                    for item in siteInventory:
-                        if item.information not in inventoryList:
-                            # accumulation list
-                            inventoryList[item.information] = list(), (0, 0)
-                            if not includesMeaningfulCodes:
-                                includesMeaningfulCodes = not item.information.code_is_uuid()
-                        siteQuantityList = inventoryList[item.information][0]
-                        siteQuantityList.append((site, item.quantity, item.quantity * item.information.quantityOfMeasure))
-                        newSiteQuantity = inventoryList[item.information][1][0] + item.quantity, inventoryList[item.information][1][1] + item.quantity * item.information.quantityOfMeasure
-                        inventoryList[item.information] = siteQuantityList, newSiteQuantity
-            
-            sortedInventory = OrderedDict()
-            informationItems = inventoryList.keys()
-            if re.match('^inventory_', report):
-                if re.match('information__name',orderBy.keys()[0]):
-                    sortReverse = '-' in orderBy['information__name']
-                    sortedNames = [information.name for information in informationItems]
-                    sortedNames.sort(reverse=sortReverse)
-                    for name in sortedNames:
-                        thisInfo = [information for information in inventoryList.keys() if information.name == name]
-                        sortedInventory[thisInfo[0]] = inventoryList[thisInfo[0]] #sortProductByName
-                else:
-                    # sort by code
-                    sortReverse = '-' in orderBy['information__code']
-                    sortedCodes = [information.code for information in informationItems]
-                    sortedCodes.sort(reverse=sortReverse)
-                    for code in sortedCodes:
-                        thisInfo = [information for information in inventoryList.keys() if information.code == code]
-                        sortedInventory[thisInfo[0]] = inventoryList[thisInfo[0]]
-            else:
-                
-                sortedNames = [information.name for information in informationItems]
-                #sortedNames.sort(reverse=sortReverse)
-                for name in sortedNames:
-                    thisInfo = [information for information in inventoryList.keys() if information.name == name]
-                    sortedInventory[thisInfo[0]] = inventoryList[thisInfo[0]] #sortProductByName
-            
-            inventoryList = sortedInventory
-    return orderBy, sitesList, inventoryList, includesCategories, includesMeaningfulCodes
+            matrix = pivot_inventory(latestInventory, products, sites)
+        inventoryList = OrderedDict((product, matrix[product]) for product in 
+                                    sort_by_fields(matrix.keys(), orderBy, productSortKeys))
+        includesCategories = any(product.category_id is not None for product in matrix)
+        includesMeaningfulCodes = any(not product.code_is_uuid() for product in matrix)
+        sitesList = sorted(set(site for siteQuantityList, __ in matrix.itervalues()
+                               for site, __, __ in siteQuantityList),
+                           key = lambda site: site.name)
+    return sitesList, inventoryList, includesCategories, includesMeaningfulCodes
+
+# marks where the report rows go in a streamed print report page
+REPORT_ROWS_MARKER = '<!--ims-report-rows-->'
+
+def stream_report_requested(request):
+    return request.GET.get('stream', str(streamReports)) == 'True'
+
+def chunks(items, size):
+    for start in xrange(0, len(items), size):
+        yield items[start:start + size]
+
+def iter_site_details(siteIds):
+    for chunk in chunks(siteIds, reportChunkSize):
+        sites = Site.objects.in_bulk(chunk)
+        yield {'sitesList':[sites[siteId] for siteId in chunk]}
+
+def iter_site_inventory(siteIds, stopDate = None):
+    for chunk in chunks(siteIds, reportChunkSize):
+        sites = Site.objects.in_bulk(chunk)
+        yield {'sitesList':InventoryItem.objects.latest_for_sites(
+                                            [sites[siteId] for siteId in chunk],
+                                            stopDate = stopDate)}
+
+def iter_product_inventory(codes, stopDate = None):
+    sites = dict((site.pk, site) for site in Site.objects.all())
+    for chunk in chunks(codes, reportChunkSize):
+        products = ProductInformation.objects.select_related('category').in_bulk(chunk)
+        matrix = pivot_inventory(InventoryItem.objects.filter(information__in = chunk).latest_state(
+                                                                stopDate = stopDate),
+                                 products,
+                                 sites)
+        yield {'inventoryList':OrderedDict((products[code], matrix[products[code]]) 
+                                           for code in chunk)}
+
+def streaming_report_response(request,
+                              report = '',
+                              startDate = None,
+                              stopDate = None,
+                              errorMessage = '',
+                              warningMessage = '',
+                              infoMessage = ''):
+    """
+    render a print report a chunk of sites or products at a time, so that the 
+    browser can start drawing the report right away and the whole report is 
+    never held in memory.  The report page is rendered once around a marker, 
+    and the rows are rendered into its place with the report's _rows template.
+    """
+    parsedStopDate = parse_datestr_tz(reorder_date_mdy_to_ymd(stopDate, '-'), 23, 59)
+    latestInventory = InventoryItem.objects.latest_state(stopDate = parsedStopDate)
+    includesCategories = False
+    includesMeaningfulCodes = False
+    if re.match('^site_', report):
+        orderBy = update_order_by(request, ('name',))
+        siteIds = list(Site.objects.all().order_by(*orderBy.values()).values_list('pk', flat = True))
+        if not siteIds:
+            request.session['warningMessage'] = 'No sites found.'
+            return redirect(reverse('ims:reports') + 
+                            '?startDate=' + startDate +
+                            '&stopDate=' + stopDate)
+        if re.match('^site_detail', report):
+            rows = iter_site_details(siteIds)
+        else:
+            includesCategories = latestInventory.filter(information__category__isnull = False).exists()
+            rows = iter_site_inventory(siteIds, stopDate = parsedStopDate)
+    else:
+        orderBy = update_order_by(request, ('information__name',
+                                            'information__code',))
+        codes = set()
+        for code, category in latestInventory.values_list('information', 
+                                                          'information__category').distinct():
+            codes.add(code)
+            includesCategories = includesCategories or category is not None
+            includesMeaningfulCodes = (includesMeaningfulCodes or 
+                                       not ProductInformation(code = code).code_is_uuid())
+        if not codes:
+            request.session['warningMessage'] = 'No inventory found.'
+            return redirect(reverse('ims:reports') + 
+                            '?startDate=' + startDate +
+                            '&stopDate=' + stopDate)
+        products = [product for product in 
+                    ProductInformation.objects.only('code', 'name')
+                    if product.code in codes]
+        codes = [product.code for product in 
+                 sort_by_fields(products, orderBy, productSortKeys)]
+        rows = iter_product_inventory(codes, stopDate = parsedStopDate)
+    context = {'nav_reports':1,
+               'warningMessage':warningMessage,
+               'infoMessage':infoMessage,
+               'errorMessage':errorMessage,
+               'orderBy':orderBy,
+               'startDate':startDate,
+               'stopDate':stopDate,
+               'addCategory':includesCategories,
+               'addCode':includesMeaningfulCodes,
+               'adminName':adminName,
+               'adminEmail':adminEmail,
+               'siteVersion':siteVersion,
+               'imsVersion':imsVersion,
+               'streamRows':True,}
+    page = render_to_string('ims/%s.html' % report, context, request = request)
+    head, tail = page.split(REPORT_ROWS_MARKER, 1)
+    def content():
+        yield head
+        for rowContext in rows:
+            rowContext.update(context)
+            yield render_to_string('ims/%s_rows.html' % report, rowContext)
+        yield tail
+    return StreamingHttpResponse(content(), content_type = 'text/html; charset=utf-8')
 
 @login_required()
 @never_cache
@@ -416,6 +795,7 @@ def reports_dates(request,
                                                 'report':report,
                                                 'startDate':startDate,
                                                 'stopDate':stopDate,
+                                                'artifacts':report_artifacts(stopDate),
                                                 'adminName':adminName,
                                                 'adminEmail':adminEmail,
                                                 'siteVersion':siteVersion,
@@ -428,9 +808,157 @@ def reports(request):
     stopDate = request.GET.get('stopDate',timezone.now().strftime('%m-%d-%Y'))
     return reports_dates(request, startDate=startDate, stopDate=stopDate)
 
+PRINT_REPORTS = ('site_inventory_print',
+                 'site_detail_print',
+                 'inventory_detail_print',
+                 'inventory_status_print',)
+REPORT_ARTIFACT_RE = re.compile(r'^(%s)_\d{4}-\d{2}-\d{2}\.(html|csv)$' % '|'.join(PRINT_REPORTS))
+
+def report_artifact_name(report, stopDate, extension):
+    return '%s_%s.%s' % (report, reorder_date_mdy_to_ymd(stopDate, '-'), extension)
+
+def report_artifacts(stopDate):
+    """
+    the pre-rendered reports in the report store for stopDate, as a dict of
+    report: {extension: file name}.  Only looks at the file system.
+    """
+    artifacts = {}
+    if not stopDate or not re.match(r'^\d{2}-\d{2}-\d{4}$', stopDate):
+        return artifacts
+    for report in PRINT_REPORTS:
+        for extension in ('html', 'csv'):
+            fileName = report_artifact_name(report, stopDate, extension)
+            if os.path.isfile(os.path.join(reportStoreDir, fileName)):
+                artifacts.setdefault(report, {})[extension] = fileName
+    return artifacts
+
+def write_report_artifact(fileName, content):
+    """
+    write content to fileName in the report store.  The content is written
+    to a temporary file that is then renamed into place, so that nobody ever
+    opens a partly written report.
+    """
+    if not os.path.isdir(reportStoreDir):
+        os.makedirs(reportStoreDir)
+    handle, tempPath = tempfile.mkstemp(dir = reportStoreDir, prefix = '.' + fileName)
+    try:
+        with os.fdopen(handle, 'wb') as tempFile:
+            tempFile.write(content)
+        os.chmod(tempPath, 0644)
+        os.rename(tempPath, os.path.join(reportStoreDir, fileName))
+    except:
+        os.remove(tempPath)
+        raise
+
+def report_csv(report = '',
+               sitesList = None,
+               inventoryList = None):
+    """
+    the rows of a print report as csv
+    """
+    stream = StringIO.StringIO()
+    writer = csv.writer(stream)
+    encode = lambda row: [unicode(value if value is not None else '').encode('utf-8') 
+                          for value in row]
+    if report == 'site_detail_print':
+        writer.writerow(['site number', 'site', 'county', 'address 1', 'address 2',
+                         'address 3', 'contact', 'contact phone', 'notes'])
+        for site in sitesList:
+            writer.writerow(encode([site.number, site.name, site.county, site.address1,
+                                    site.address2, site.address3, site.contactName,
+                                    site.contactPhone, site.notes]))
+    elif report == 'site_inventory_print':
+        writer.writerow(['site', 'product', 'code', 'category', 'unit of measure',
+                         'quantity of measure', 'cost per item', 'quantity', 'pieces'])
+        for site, siteInventory in sitesList.iteritems():
+            for item in siteInventory:
+                writer.writerow(encode([site.name, item.information.name, item.information.code,
+                                        item.information.category, item.information.unitOfMeasure,
+                                        item.information.quantityOfMeasure,
+                                        item.information.costPerItem, item.quantity,
+                                        item.pieces()]))
+    elif report == 'inventory_detail_print':
+        writer.writerow(['product', 'code', 'category', 'site', 'quantity', 'pieces'])
+        for product, (siteQuantityList, __) in inventoryList.iteritems():
+            for site, quantity, pieces in siteQuantityList:
+                writer.writerow(encode([product.name, product.code, product.category,
+                                        site.name, quantity, pieces]))
+    elif report == 'inventory_status_print':
+        writer.writerow(['product', 'code', 'category', 'unit of measure',
+                         'quantity of measure', 'cost per item', 'quantity', 'pieces'])
+        for product, (__, (totalQuantity, totalPieces)) in inventoryList.iteritems():
+            writer.writerow(encode([product.name, product.code, product.category,
+                                    product.unitOfMeasure, product.quantityOfMeasure,
+                                    product.costPerItem, totalQuantity, totalPieces]))
+    return stream.getvalue()
+
+def create_report_csv_response(report, stopDate, sitesList, inventoryList):
+    response = HttpResponse(report_csv(report = report,
+                                       sitesList = sitesList,
+                                       inventoryList = inventoryList),
+                            content_type = 'text/csv')
+    response['Content-Disposition'] = ('attachment; filename=%s' % 
+                                       report_artifact_name(report, stopDate, 'csv'))
+    return response
+
+def create_report_artifacts(stopDate):
+    """
+    render each print report, and its csv equivalent, as of stopDate into
+    the report store, in the default order.  Returns the file names written.
+    """
+    parsedStopDate = parse_datestr_tz(reorder_date_mdy_to_ymd(stopDate, '-'), 23, 59)
+    fileNames = []
+    for report in PRINT_REPORTS:
+        if re.match('^site_', report):
+            orderBy = OrderedDict((('name', 'name'),))
+        else:
+            orderBy = OrderedDict((('information__name', 'information__name'),))
+        (sitesList,
+         inventoryList,
+         includesCategories,
+         includesMeaningfulCodes) = sort_inventory(report = report,
+                                                   stopDate = parsedStopDate,
+                                                   orderBy = orderBy)
+        page = render_to_string('ims/%s.html' % report, {'nav_reports':1,
+                                                'orderBy':orderBy,
+                                                'startDate':stopDate,
+                                                'stopDate':stopDate,
+                                                'sitesList':sitesList,
+                                                'inventoryList':inventoryList,
+                                                'addCategory':includesCategories,
+                                                'addCode':includesMeaningfulCodes,
+                                                'adminName':adminName,
+                                                'adminEmail':adminEmail,
+                                                'siteVersion':siteVersion,
+                                                'imsVersion':imsVersion,})
+        for extension, content in (('html', page.encode('utf-8')),
+                                   ('csv', report_csv(report = report,
+                                                      sitesList = sitesList,
+                                                      inventoryList = inventoryList))):
+            fileName = report_artifact_name(report, stopDate, extension)
+            write_report_artifact(fileName, content)
+            fileNames.append(fileName)
+    return fileNames
+
+@login_required()
+def report_artifact(request, fileName = None):
+    """
+    serve a pre-rendered report from the report store
+    """
+    filePath = os.path.join(reportStoreDir, fileName)
+    if not REPORT_ARTIFACT_RE.match(fileName) or not os.path.isfile(filePath):
+        raise Http404('No saved report %s' % fileName)
+    if fileName.endswith('.csv'):
+        response = FileResponse(open(filePath, 'rb'), content_type = 'text/csv')
+        response['Content-Disposition'] = 'attachment; filename=%s' % fileName
+    else:
+        response = FileResponse(open(filePath, 'rb'), content_type = 'text/html; charset=utf-8')
+    return response
+
 
 @login_required()
 @never_cache
+@instrumented('site_inventory_print')
 def site_inventory_print(request):
     errorMessage, warningMessage, infoMessage = get_session_messages(request)
     startDate = validate_date(request.GET.get('startDate',
@@ -439,6 +967,14 @@ def site_inventory_print(request):
     stopDate = validate_date(request.GET.get('stopDate',
                                               timezone.now().strftime('%m-%d-%Y')), 
                               '-')
+    if stream_report_requested(request):
+        return streaming_report_response(request,
+                                         report = 'site_inventory_print',
+                                         startDate = startDate,
+                                         stopDate = stopDate,
+                                         errorMessage = errorMessage,
+                                         warningMessage = warningMessage,
+                                         infoMessage = infoMessage)
     (orderBy,
      sitesList, 
      inventoryList, 
@@ -451,7 +987,9 @@ def site_inventory_print(request):
         request.session['warningMessage'] = 'No sites found.'
         return redirect(reverse('ims:reports') + 
                         '?startDate=' + startDate +
-                        '&stopDate' + stopDate)
+                        '&stopDate=' + stopDate)
+    if request.GET.get('format') == 'csv':
+        return create_report_csv_response('site_inventory_print', stopDate, sitesList, inventoryList)
     return render(request,'ims/site_inventory_print.html', {'nav_reports':1,
                                                 'warningMessage':warningMessage,
                                                 'infoMessage':infoMessage,
@@ -469,6 +1007,7 @@ def site_inventory_print(request):
 
 @login_required()
 @never_cache
+@instrumented('site_detail_print')
 def site_detail_print(request):
     errorMessage, warningMessage, infoMessage = get_session_messages(request)
     startDate = validate_date(request.GET.get('startDate',
@@ -477,6 +1016,14 @@ def site_detail_print(request):
     stopDate = validate_date(request.GET.get('stopDate',
                                               timezone.now().strftime('%m-%d-%Y')), 
                               '-')
+    if stream_report_requested(request):
+        return streaming_report_response(request,
+                                         report = 'site_detail_print',
+                                         startDate = startDate,
+                                         stopDate = stopDate,
+                                         errorMessage = errorMessage,
+                                         warningMessage = warningMessage,
+                                         infoMessage = infoMessage)
     (orderBy,
      sitesList, 
      inventoryList, 
@@ -489,7 +1036,9 @@ def site_detail_print(request):
         request.session['warningMessage'] = 'No sites found.'
         return redirect(reverse('ims:reports') + 
                         '?startDate=' + startDate +
-                        '&stopDate' + stopDate)
+                        '&stopDate=' + stopDate)
+    if request.GET.get('format') == 'csv':
+        return create_report_csv_response('site_detail_print', stopDate, sitesList, inventoryList)
     return render(request,'ims/site_detail_print.html', {'nav_reports':1,
                                                 'warningMessage':warningMessage,
                                                 'infoMessage':infoMessage,
@@ -507,6 +1056,7 @@ def site_detail_print(request):
 
 @login_required()
 @never_cache
+@instrumented('inventory_detail_print')
 def inventory_detail_print(request):
     errorMessage, warningMessage, infoMessage = get_session_messages(request)
     startDate = validate_date(request.GET.get('startDate',
@@ -515,6 +1065,14 @@ def inventory_detail_print(request):
     stopDate = validate_date(request.GET.get('stopDate',
                                               timezone.now().strftime('%m-%d-%Y')), 
                               '-')
+    if stream_report_requested(request):
+        return streaming_report_response(request,
+                                         report = 'inventory_detail_print',
+                                         startDate = startDate,
+                                         stopDate = stopDate,
+                                         errorMessage = errorMessage,
+                                         warningMessage = warningMessage,
+                                         infoMessage = infoMessage)
     (orderBy,
      sitesList, 
      inventoryList, 
@@ -527,7 +1085,9 @@ def inventory_detail_print(request):
         request.session['warningMessage'] = 'No inventory found.'
         return redirect(reverse('ims:reports') + 
                         '?startDate=' + startDate +
-                        '&stopDate' + stopDate)
+                        '&stopDate=' + stopDate)
+    if request.GET.get('format') == 'csv':
+        return create_report_csv_response('inventory_detail_print', stopDate, sitesList, inventoryList)
     return render(request,'ims/inventory_detail_print.html', {'nav_reports':1,
                                                 'warningMessage':warningMessage,
                                                 'infoMessage':infoMessage,
@@ -544,8 +1104,59 @@ def inventory_detail_print(request):
                                                 'siteVersion':siteVersion,
                                                 'imsVersion':imsVersion,})
 
+def get_inventory_changes(startDate = None, stopDate = None):
+    """
+    the change in inventory between the start of startDate and the end of
+    stopDate, as an OrderedDict of site: [(product, quantity at start, 
+    quantity at end, net change, number of changes), ...] with the sites and
+    products in name order
+    """
+    parsedStartDate = parse_datestr_tz(reorder_date_mdy_to_ymd(startDate, '-'), 0, 0)
+    parsedStopDate = parse_datestr_tz(reorder_date_mdy_to_ymd(stopDate, '-'), 23, 59)
+    changes = InventoryItem.objects.changes_between(parsedStartDate, parsedStopDate)
+    sites = dict((site.pk, site) for site in Site.objects.all())
+    products = dict((product.pk, product) for product in 
+                    ProductInformation.objects.select_related('category'))
+    siteChanges = {}
+    for (siteId, code), change in changes.iteritems():
+        siteChanges.setdefault(sites[siteId], []).append((products[code],) + change)
+    return OrderedDict((site, sorted(siteChanges[site], 
+                                     key = lambda row: (row[0].name, row[0].code)))
+                       for site in sorted(siteChanges, 
+                                          key = lambda site: (site.name, site.pk)))
+
 @login_required()
 @never_cache
+@instrumented('inventory_change_print')
+def inventory_change_print(request):
+    errorMessage, warningMessage, infoMessage = get_session_messages(request)
+    startDate = validate_date(request.GET.get('startDate',
+                                              timezone.now().strftime('%m-%d-%Y')), 
+                              '-')
+    stopDate = validate_date(request.GET.get('stopDate',
+                                              timezone.now().strftime('%m-%d-%Y')), 
+                              '-')
+    sitesList = get_inventory_changes(startDate = startDate, stopDate = stopDate)
+    if not sitesList:
+        request.session['warningMessage'] = 'No inventory found.'
+        return redirect(reverse('ims:reports') + 
+                        '?startDate=' + startDate +
+                        '&stopDate=' + stopDate)
+    return render(request,'ims/inventory_change_print.html', {'nav_reports':1,
+                                                'warningMessage':warningMessage,
+                                                'infoMessage':infoMessage,
+                                                'errorMessage':errorMessage,
+                                                'startDate':startDate,
+                                                'stopDate':stopDate,
+                                                'sitesList':sitesList,
+                                                'adminName':adminName,
+                                                'adminEmail':adminEmail,
+                                                'siteVersion':siteVersion,
+                                                'imsVersion':imsVersion,})
+
+@login_required()
+@never_cache
+@instrumented('inventory_status_print')
 def inventory_status_print(request):
     errorMessage, warningMessage, infoMessage = get_session_messages(request)
     startDate = validate_date(request.GET.get('startDate',
@@ -554,6 +1165,14 @@ def inventory_status_print(request):
     stopDate = validate_date(request.GET.get('stopDate',
                                               timezone.now().strftime('%m-%d-%Y')), 
                               '-')
+    if stream_report_requested(request):
+        return streaming_report_response(request,
+                                         report = 'inventory_status_print',
+                                         startDate = startDate,
+                                         stopDate = stopDate,
+                                         errorMessage = errorMessage,
+                                         warningMessage = warningMessage,
+                                         infoMessage = infoMessage)
     (orderBy,
      sitesList, 
      inventoryList, 
@@ -566,7 +1185,9 @@ def inventory_status_print(request):
         request.session['warningMessage'] = 'No inventory found.'
         return redirect(reverse('ims:reports') + 
                         '?startDate=' + startDate +
-                        '&stopDate' + stopDate)
+                        '&stopDate=' + stopDate)
+    if request.GET.get('format') == 'csv':
+        return create_report_csv_response('inventory_status_print', stopDate, sitesList, inventoryList)
     return render(request,'ims/inventory_status_print.html', {'nav_reports':1,
                                                 'warningMessage':warningMessage,
                                                 'infoMessage':infoMessage,
@@ -606,17 +1227,10 @@ def inventory_history_dates(request, siteId=None, code=None, startDate=None, sto
     stopDate = validate_date(stopDate, '-')
     #parsedStartDate=parse_datestr_tz(reorder_date_mdy_to_ymd(startDate,'-'),0,0)
     parsedStopDate=parse_datestr_tz(reorder_date_mdy_to_ymd(stopDate,'-'),23,59)
-    inventoryList=site.inventory_history_for_product(code=product.code, stopDate=parsedStopDate)
+    inventoryList=site.inventory_history_for_product(code=product.code, 
+                    stopDate=parsedStopDate).order_by('-modifiedUs', '-pk')
     paginatorPage = create_paginator(request, items = inventoryList)
-    inventoryIds=[]
-    for item in paginatorPage.object_list:
-        inventoryIds.append(item.pk)
-    siteInventory=InventoryItem.objects.filter(pk__in=inventoryIds)
-    inventoryItems=[]
-    for item in siteInventory:
-        inventoryItems.append(item)
-    inventoryItems.sort(reverse=True)
-    siteInventory = inventoryItems
+    siteInventory = list(paginatorPage.object_list)
     return render(request, 'ims/inventory_history_dates.html',{
                   'site':site,
                   'product':product,
@@ -633,6 +1247,55 @@ def inventory_history_dates(request, siteId=None, code=None, startDate=None, sto
                   'siteVersion':siteVersion,
                   'imsVersion':imsVersion,})
     
+@login_required()
+@never_cache
+def product_quantity_series(request, code=None):
+    """
+    json time series of a product's quantity, summed over the sites, for one
+    site (site=<site number>) or for each site (bySite=True), between the
+    startDate and stopDate, optionally bucketed by day, week or month
+    """
+    try:
+        product=ProductInformation.objects.get(pk=code)
+    except ProductInformation.DoesNotExist:
+        return JsonResponse({'error':'Product %s does not exist.' % code}, status=404)
+    bucket=request.GET.get('bucket') or None
+    if bucket not in SERIES_BUCKETS:
+        return JsonResponse({'error':'Unknown bucket %s, expected one of day, week or month.' % 
+                             bucket}, status=400)
+    today=timezone.now().strftime('%m-%d-%Y')
+    startDate=validate_date(request.GET.get('startDate', today), '-')
+    stopDate=validate_date(request.GET.get('stopDate', today), '-')
+    try:
+        parsedStartDate=parse_datestr_tz(reorder_date_mdy_to_ymd(startDate,'-'),0,0)
+        parsedStopDate=parse_datestr_tz(reorder_date_mdy_to_ymd(stopDate,'-'),23,59)
+    except (AttributeError, TypeError, ValueError):
+        return JsonResponse({'error':'Invalid dates %s to %s, expected mm-dd-yyyy.' % 
+                             (startDate, stopDate)}, status=400)
+    history=InventoryItem.objects.filter(information=product)
+    siteId=request.GET.get('site')
+    if siteId:
+        if not siteId.isdigit():
+            return JsonResponse({'error':'Invalid site %s.' % siteId}, status=400)
+        history=history.filter(site=siteId)
+    bySite=request.GET.get('bySite', 'False') == 'True'
+    series=history.quantity_series(parsedStartDate,
+                                   parsedStopDate,
+                                   bucket=bucket,
+                                   bySite=bySite or bool(siteId))
+    siteNames=dict(Site.objects.filter(pk__in=[key for key in series if key]).values_list(
+                                                                    'pk', 'name'))
+    return JsonResponse({'product':product.code,
+                         'name':product.name,
+                         'startDate':startDate,
+                         'stopDate':stopDate,
+                         'bucket':bucket,
+                         'series':[{'site':key,
+                                    'siteName':siteNames.get(key),
+                                    'points':[(when.isoformat(), quantity) 
+                                              for when, quantity in points]}
+                                   for key, points in series.iteritems()]})
+
 @login_required()
 @never_cache
 def inventory_history(request, siteId=None, code=None,):
@@ -680,6 +1343,12 @@ def sites(request):
             else:
                 errorMessage='You don''t have permission to add sites'
     paginatedForms=SiteFormset(queryset=paginatorPage.object_list, error_class=TitleErrorList)
+    # the totals of the page's sites, in one query rather than one per site
+    siteTotals=SiteInventoryTotals.objects.in_bulk([siteForm.instance.pk
+                                                     for siteForm in paginatedForms])
+    for siteForm in paginatedForms:
+        totals=siteTotals.get(siteForm.instance.pk)
+        siteForm.productCount=totals.productCount if totals else 0
     if Site.objects.all().count() == 0:
         warningMessage += 'No sites found'
     return render(request,'ims/sites.html', {'nav_sites':1,
@@ -985,14 +1654,17 @@ def site_delete(request):
             if canDelete:
                 deleteNumbers = request.POST.getlist('sites', [])
                 if deleteNumbers:
-                    sitesToDelete = Site.objects.filter(pk__in = deleteNumbers)
+                    sitesToDelete = list(Site.objects.filter(pk__in = deleteNumbers))
+                    with transaction.atomic():
+                        # delete the histories in bulk.  The current inventory,
+                        # totals and checkpoints of the sites go with them.
+                        InventoryItem.objects.filter(site__in = sitesToDelete).delete()
+                        Site.objects.filter(pk__in = [site.pk for site in sitesToDelete]).delete()
+                        InventoryRollup.invalidate()
+                        bump_dataset_version()
                     for  site in sitesToDelete:
                         name = site.name
                         number = site.number
-                        siteInventory=site.inventoryitem_set.all()
-                        for item in siteInventory:
-                            item.delete()
-                        site.delete()
                         infoMessage += 'Successfully deleted site %s<br />' % name
                         log_actions(request = request, modifier=request.user.username,
                                     modificationMessage='deleted site and all associated inventory for site number ' + 
@@ -1061,6 +1733,8 @@ def site_delete_all(request):
                 inventoryItems=InventoryItem.objects.all()
                 sites.delete()
                 inventoryItems.delete()
+                InventoryRollup.invalidate()
+                bump_dataset_version()
                 log_actions(request = request, modifier=request.user.username,
                             modificationMessage='deleted all sites and inventory')
                 request.session['infoMessage'] = 'Successfully deleted all sites'
@@ -1207,10 +1881,9 @@ def product_detail(request, code='-1',):
     if inventorySites.count() > 0:
         for siteNumber in paginatorPage.object_list:
             site = Site.objects.get(pk=siteNumber['site'])
-            inventoryQuantity = site.inventory_quantity(code)
-            productCodesInSite = [inventoryItem.information.code for inventoryItem in site.latest_inventory()]
-            if code in productCodesInSite:
-                sitesList.append((site, inventoryQuantity))
+            latestItem = site.latest_inventory_for_product(code = code)
+            if latestItem:
+                sitesList.append((site, latestItem.quantity))
     if request.method == "POST":
         if 'SavePicture' in request.POST and 'rotation' in request.POST and canChange:
             if canChange:
@@ -1517,15 +2190,23 @@ def product_delete(request, productsToDelete={}):
                 infoMessage = ''
                 deleteCodes = request.POST.getlist('products', [])
                 if deleteCodes:
-                    productsToDelete = ProductInformation.objects.filter(pk__in = 
-                                                                         deleteCodes)
+                    productsToDelete = list(ProductInformation.objects.filter(pk__in = 
+                                                                              deleteCodes))
+                    with transaction.atomic():
+                        siteIds = list(CurrentInventory.objects.filter(
+                                            information__in = productsToDelete).values_list(
+                                            'site', flat = True).distinct())
+                        # delete the histories in bulk, then bring the sites
+                        # that held the products up to date once
+                        InventoryItem.objects.filter(information__in = productsToDelete).delete()
+                        ProductInformation.objects.filter(pk__in = [product.pk for product in 
+                                                                    productsToDelete]).delete()
+                        CurrentInventory.rebuild(siteIds)
+                        InventoryRollup.invalidate()
+                        bump_dataset_version()
                     for  product in productsToDelete:
                         meaningfulCode = product.meaningful_code()
                         name=product.name
-                        productInventory=product.inventoryitem_set.all()
-                        for item in productInventory:
-                            item.delete()
-                        product.delete()
                         infoMessage += 'Successfully deleted product and associated inventory for product code %s with name "%s"<br/>' % (meaningfulCode, name)
                         log_actions(request = request, modifier=request.user.username,
                                     modificationMessage=infoMessage)
@@ -1554,7 +2235,9 @@ def product_delete(request, productsToDelete={}):
             if not re.match(r'[\w\d\_\-]+', code):
                 codes.remove(code)
         productsToDelete = ProductInformation.objects.filter(pk__in = codes)
-        if len([product for product in productsToDelete if product.num_sites_containing() > 0]) > 0:
+        sitesContaining = ProductInformation.sites_containing_counts(
+                                [product.pk for product in productsToDelete])
+        if len([code for code in sitesContaining if sitesContaining[code] > 0]) > 0:
             warningMessage='One or more products contain inventory.  Deleting the products will delete all inventory in all sites containing this product as well. Delete anyway?'
         else:
             warningMessage='Are you sure?'
@@ -1591,6 +2274,9 @@ def product_delete_all(request):
                 inventoryItems=InventoryItem.objects.all()
                 inventoryItems.delete()
                 products.delete()
+                SiteInventoryTotals.recompute()
+                InventoryRollup.invalidate()
+                bump_dataset_version()
                 request.session['infoMessage'] = 'Successfully deleted all products'
                 log_actions(request = request, modifier=request.user.username,
                             modificationMessage=request.session['infoMessage'])
@@ -1635,6 +2321,9 @@ def inventory_delete_all(request):
         if 'Delete All Inventory' in request.POST:
             if request.user.has_perm('ims.delete_inventoryitem'):
                 inventory.delete()
+                SiteInventoryTotals.recompute()
+                InventoryRollup.invalidate()
+                bump_dataset_version()
                 request.session['infoMessage'] = 'Successfully deleted all inventory'
                 log_actions(request = request, modifier=request.user.username,
                             modificationMessage=request.session['infoMessage'])
@@ -1743,6 +2432,7 @@ def zip_pictures(request,zipHandle):
                 zipHandle.write(thumbFile, trim_path(rootPath = settings.MEDIA_ROOT,
                                                      dirPath = thumbFile))
                 
+@instrumented('create_backup_archive_response')
 def create_backup_archive_response(request):
     errorMessage, __, __ = get_session_messages(request)
     try:
@@ -1794,6 +2484,7 @@ def create_backup_archive_response(request):
     response['Content-Disposition'] = 'attachment; filename=Backup_Export' + dateStamp + '.zip'
     return response
     
+@instrumented('create_inventory_export_xls_response')
 def create_inventory_export_xls_response(request, exportType='All'):
     errorMessage, __, __ = get_session_messages(request)
     try:
@@ -1819,6 +2510,9 @@ def create_inventory_sheet(xls=None, exportType='All'):
     sites=Site.objects.all().order_by('name')
     sheet1=create_inventory_export_header(sheet=sheet1)
     rowIndex=1
+    if exportType != 'All':
+        # latest inventory only
+        latestInventory=InventoryItem.objects.latest_for_sites(sites)
     for site in sites:
         if exportType == 'All':
             allProducts=site.inventoryitem_set. values('information').distinct()
@@ -1831,8 +2525,8 @@ def create_inventory_sheet(xls=None, exportType='All'):
                                             information__in=productIdList
                                             ).order_by(
                                             'information')
-        else: # latest inventory only
-            inventory=site.latest_inventory()
+        else:
+            inventory=latestInventory[site]
         for item in inventory:
             sheet1.write(rowIndex,0,item.information.code)
             sheet1.write(rowIndex,1,item.information.name)
@@ -1850,6 +2544,7 @@ def create_inventory_sheet(xls=None, exportType='All'):
             rowIndex += 1
     return xls
 
+@instrumented('create_site_export_xls_response')
 def create_site_export_xls_response(request):
     errorMessage, __, __ = get_session_messages(request)
     try:
@@ -1895,6 +2590,7 @@ def create_site_export_sheet(xls=None):
         rowIndex += 1
     return xls
 
+@instrumented('create_product_export_xls_response')
 def create_product_export_xls_response(request):
     errorMessage, __, __ = get_session_messages(request)
     try:
@@ -1962,65 +2658,153 @@ def create_category_export_sheet(xls=None):
     
 def create_site_export_header(sheet=None):
     if sheet:
-        sheet.write(0, 0, "Site Number")
-        sheet.write(0, 1, "Site Name")
-        sheet.write(0, 2, "Site Address 1")
-        sheet.write(0, 3, "Site Address 2")
-        sheet.write(0, 4, "Site Address 3")
-        sheet.write(0, 5, "County")
-        sheet.write(0, 6, "Site Contact Name")
-        sheet.write(0, 7, "Site Phone")
-        sheet.write(0, 8, "Site Notes")
-        sheet.write(0, 9, "Modified")
-        sheet.write(0, 10, "Modifier")
+        for column, title in enumerate(Site.importSchema.titles()):
+            sheet.write(0, column, title)
     else:
         return None
     return sheet
 
 def create_product_export_header(sheet=None):
     if sheet:
-        sheet.write(0, 0, "Product Code")
-        sheet.write(0, 1, "Product Name")
-        sheet.write(0, 2, "Product Category")
-        sheet.write(0, 3, "Expendable")
-        sheet.write(0, 4, "Unit of Measure")
-        sheet.write(0, 5, "Qty of Measure")
-        sheet.write(0, 6, "Cost Each")
-        sheet.write(0, 7, "Cartons per Pallet")
-        sheet.write(0, 8, "Double Stack Pallets")
-        sheet.write(0, 9, "Warehouse Location")
-        sheet.write(0, 10, "Expiration Date")
-        sheet.write(0, 11, "Expiration Notes")
-        sheet.write(0, 12, "Modified")
-        sheet.write(0, 13, "Modifier")
-        sheet.write(0, 14, "Picture")
-        sheet.write(0, 15, "Original Picture Name")
+        for column, title in enumerate(ProductInformation.importSchema.titles()):
+            sheet.write(0, column, title)
     else:
         return None
     return sheet
 
 def create_inventory_export_header(sheet=None):
     if sheet:
-        sheet.write(0, 0, "Product Code")
-        sheet.write(0, 1, "Product Name")
-        sheet.write(0, 2, "Prefix")
-        sheet.write(0, 3, "Site Number")
-        sheet.write(0, 4, "Cartons")
-        sheet.write(0, 5, "modified")
-        sheet.write(0, 6, "modifier")
-        sheet.write(0, 7,"deleted")
+        for column, title in enumerate(InventoryItem.importSchema.titles()):
+            sheet.write(0, column, title)
     else:
         return None
     return sheet
 
 def create_category_export_header(sheet=None):
     if sheet:
-        sheet.write(0, 0, "Category ID")
-        sheet.write(0, 1, "Category")
+        for column, title in enumerate(ProductCategory.importSchema.titles()):
+            sheet.write(0, column, title)
     else:
         return None
     return sheet
 
+def queue_import_job(request, kind, fileRequest):
+    """
+    save the upload as an import job for the process_import_jobs command and
+    go back to the imports page, which follows the job's progress
+    """
+    job=ImportJob(kind=kind,
+                  fileName=fileRequest.name,
+                  modifier=request.user.username)
+    job.upload.save(fileRequest.name, fileRequest, save=True)
+    log_actions(request = request, 
+                modifier=request.user.username,
+                modificationMessage='queued bulk import of %s using "%s"' % 
+                (kind, fileRequest.name))
+    request.session['infoMessage'] = ('Import of %s using "%s" has been queued' 
+                                      % (kind, escape(fileRequest.name)))
+    return redirect(reverse('ims:imports'))
+
+def discard_previewed_upload(request):
+    preview=request.session.pop('importPreview', None)
+    if preview:
+        try:
+            os.remove(preview['path'])
+        except OSError:
+            pass
+    return preview
+
+def preview_import(request, kind, fileRequest):
+    """
+    show what importing fileRequest would change, without changing anything.
+    The file is kept in tempDir until it is imported from the preview or
+    another file is previewed.
+    """
+    discard_previewed_upload(request)
+    handle, path=tempfile.mkstemp(suffix=os.path.splitext(fileRequest.name)[1].lower(),
+                                  prefix='import_preview_',
+                                  dir=tempDir)
+    with os.fdopen(handle, 'wb') as previewFile:
+        for chunk in fileRequest.chunks():
+            previewFile.write(chunk)
+    diff, msg=diff_import(ImportJob.kind_model(kind), upload=path)
+    if diff is None:
+        os.remove(path)
+        request.session['errorMessage'] = ('Error while trying to preview the import of %s from spreadsheet:<br/>"%s".<br/><br/>Error Message:<br/> %s<br/>' 
+                                           % (kind, fileRequest.name, msg))
+        return redirect(reverse('ims:imports'))
+    previewId=os.path.basename(path)
+    request.session['importPreview']={'id':previewId,
+                                      'kind':kind,
+                                      'path':path,
+                                      'fileName':fileRequest.name}
+    warningMessage=msg
+    if diff.unknown or diff.duplicates:
+        warningMessage=('Importing "%s" will fail, it has rows for unknown sites or products or duplicate rows' 
+                        % fileRequest.name)
+    return render(request,
+                  'ims/import_preview.html',
+                  {'nav_imports':1,
+                   'warningMessage':warningMessage,
+                   'infoMessage':'Preview of the import of %s using "%s"' % (kind, fileRequest.name),
+                   'errorMessage':'',
+                   'diff':diff,
+                   'previewId':previewId,
+                   'importUrl':request.path,
+                   'fileName':fileRequest.name,
+                   'adminName':adminName,
+                   'adminEmail':adminEmail,
+                   'siteVersion':siteVersion,
+                   'imsVersion':imsVersion,
+                   })
+
+def import_upload(request, kind):
+    """
+    the uploaded file to import, or the file kept by preview_import when it is
+    imported from the preview
+    """
+    if 'file' in request.FILES:
+        return request.FILES['file']
+    preview=request.session.get('importPreview')
+    if (not preview or preview['kind'] != kind or 
+        preview['id'] != request.POST.get('previewId')):
+        raise Http404('The previewed file is no longer available, please upload it again')
+    try:
+        previewFile=File(open(preview['path'], 'rb'), name=preview['fileName'])
+    except IOError:
+        raise Http404('The previewed file is no longer available, please upload it again')
+    # the file stays readable while it's open, and is only imported once
+    discard_previewed_upload(request)
+    return previewFile
+
+# the permissions needed to import each kind of spreadsheet
+IMPORT_PERMISSIONS = {ImportJob.SITES:('ims.add_site', 'ims.change_site'),
+                      ImportJob.PRODUCTS:('ims.add_productinformation', 
+                                          'ims.change_productinformation'),
+                      ImportJob.CATEGORIES:('ims.add_productcategory', 
+                                            'ims.change_productcategory'),
+                      ImportJob.INVENTORY:('ims.add_inventoryitem',),}
+
+def visible_import_jobs(request):
+    """
+    the import jobs the user queued, and those of the kinds the user may
+    import
+    """
+    perms=request.user.get_all_permissions()
+    kinds=[kind for kind, kindPerms in IMPORT_PERMISSIONS.iteritems()
+           if all(perm in perms for perm in kindPerms)]
+    return ImportJob.objects.filter(Q(modifier=request.user.username) | 
+                                    Q(kind__in=kinds))
+
+@login_required()
+@never_cache
+def import_job_status(request, jobId):
+    try:
+        job=visible_import_jobs(request).get(pk=jobId)
+    except ImportJob.DoesNotExist:
+        raise Http404('Import job %s does not exist' % jobId)
+    return JsonResponse(job.progress())
+
 @login_required()
 @never_cache
 def import_sites(request):
@@ -2031,18 +2815,24 @@ def import_sites(request):
     if request.method == 'POST':
         if 'Cancel' in request.POST:
             return redirect(reverse('ims:imports'))
-        if canAddSites and canChangeSites and 'Import' in request.POST:
+        if canAddSites and canChangeSites and 'Preview' in request.POST:
             if 'file' in request.FILES:
+                return preview_import(request, ImportJob.SITES, request.FILES['file'])
+            warningMessage = 'No file selected'
+        if canAddSites and canChangeSites and 'Import' in request.POST:
+            if 'file' in request.FILES or 'previewId' in request.POST:
                 fileSelectForm = UploadFileForm(request.POST, request.FILES)
-                if fileSelectForm.is_valid():
-                    fileRequest=request.FILES['file']
+                if 'previewId' in request.POST or fileSelectForm.is_valid():
+                    fileRequest=import_upload(request, ImportJob.SITES)
+                    if backgroundImports:
+                        return queue_import_job(request, ImportJob.SITES, fileRequest)
                     try:
                         # make sure the database changes are atomic, in case 
                         # there is some error that occurs.  In the case of an 
                         # error in the import, we want to roll back to the 
                         # initial state
                         with transaction.atomic():
-                            __,msg=Site.parse_sites_from_xls(file_contents=fileRequest.file.read(),
+                            __,msg=Site.parse_sites_from_xls(upload=fileRequest,
                                                                  modifier=request.user.username,
                                                                  retainModDate=False)
                             if len(msg) > 0:
@@ -2105,11 +2895,17 @@ def import_products(request):
     if request.method == 'POST':
         if 'Cancel' in request.POST:
             return redirect(reverse('ims:imports'))
-        if canAddProducts and canChangeProducts and 'Import' in request.POST:
+        if canAddProducts and canChangeProducts and 'Preview' in request.POST:
             if 'file' in request.FILES:
+                return preview_import(request, ImportJob.PRODUCTS, request.FILES['file'])
+            warningMessage = 'No file selected'
+        if canAddProducts and canChangeProducts and 'Import' in request.POST:
+            if 'file' in request.FILES or 'previewId' in request.POST:
                 fileSelectForm = UploadFileForm(request.POST, request.FILES)
-                if fileSelectForm.is_valid():
-                    fileRequest=request.FILES['file']
+                if 'previewId' in request.POST or fileSelectForm.is_valid():
+                    fileRequest=import_upload(request, ImportJob.PRODUCTS)
+                    if backgroundImports:
+                        return queue_import_job(request, ImportJob.PRODUCTS, fileRequest)
                     try:
                         # make sure the database changes are atomic, in case 
                         # there is some error that occurs.  In the case of an 
@@ -2117,7 +2913,7 @@ def import_products(request):
                         # initial state
                         with transaction.atomic():
                             __,msg=ProductInformation.parse_product_information_from_xls(
-                                       file_contents=fileRequest.file.read(),
+                                       upload=fileRequest,
                                        modifier=request.user.username,
                                        retainModDate=False)
                             if len(msg) > 0:
@@ -2178,11 +2974,17 @@ def import_categories(request):
     if request.method == 'POST':
         if 'Cancel' in request.POST:
             return redirect(reverse('ims:imports'))
-        if canAddCategories and canChangeCategories and 'Import' in request.POST:
+        if canAddCategories and canChangeCategories and 'Preview' in request.POST:
             if 'file' in request.FILES:
+                return preview_import(request, ImportJob.CATEGORIES, request.FILES['file'])
+            warningMessage = 'No file selected'
+        if canAddCategories and canChangeCategories and 'Import' in request.POST:
+            if 'file' in request.FILES or 'previewId' in request.POST:
                 fileSelectForm = UploadFileForm(request.POST, request.FILES)
-                if fileSelectForm.is_valid():
-                    fileRequest=request.FILES['file']
+                if 'previewId' in request.POST or fileSelectForm.is_valid():
+                    fileRequest=import_upload(request, ImportJob.CATEGORIES)
+                    if backgroundImports:
+                        return queue_import_job(request, ImportJob.CATEGORIES, fileRequest)
                     try:
                         # make sure the database changes are atomic, in case 
                         # there is some error that occurs.  In the case of an 
@@ -2190,7 +2992,7 @@ def import_categories(request):
                         # initial state
                         with transaction.atomic():
                             __,msg=ProductCategory.parse_product_categories_from_xls(
-                                       file_contents=fileRequest.file.read(),
+                                       upload=fileRequest,
                                        modifier=request.user.username,
                                        retainModDate=False)
                             if len(msg) > 0:
@@ -2250,11 +3052,17 @@ def import_inventory(request):
     if request.method == 'POST':
         if 'Cancel' in request.POST:
             return redirect(reverse('ims:imports'))
-        if canAddInventory and 'Import' in request.POST:
+        if canAddInventory and 'Preview' in request.POST:
             if 'file' in request.FILES:
+                return preview_import(request, ImportJob.INVENTORY, request.FILES['file'])
+            warningMessage = 'No file selected'
+        if canAddInventory and 'Import' in request.POST:
+            if 'file' in request.FILES or 'previewId' in request.POST:
                 fileSelectForm = UploadFileForm(request.POST, request.FILES)
-                if fileSelectForm.is_valid():
-                    fileRequest=request.FILES['file']
+                if 'previewId' in request.POST or fileSelectForm.is_valid():
+                    fileRequest=import_upload(request, ImportJob.INVENTORY)
+                    if backgroundImports:
+                        return queue_import_job(request, ImportJob.INVENTORY, fileRequest)
                     try:
                         # make sure the database changes are atomic, in case 
                         # there is some error that occurs.  In the case of an 
@@ -2262,7 +3070,7 @@ def import_inventory(request):
                         # initial state
                         with transaction.atomic():
                             __,msg=InventoryItem.parse_inventory_from_xls(
-                                       file_contents=fileRequest.file.read(),
+                                       upload=fileRequest,
                                        modifier=request.user.username,
                                        retainModDate=False)
                             if len(msg) > 0:
@@ -2323,6 +3131,7 @@ def restore_pictures(zipArchive, pictures):
     zipArchive.extractall(settings.MEDIA_ROOT ,pictures)
     return errorMessage
 
+@instrumented('import_backup_from_archive')
 def import_backup_from_archive(request,
                           modifier='',
                           perms=[]):
@@ -2371,6 +3180,8 @@ def import_backup_from_archive(request,
                 sites.delete()
                 products.delete()
                 categories.delete()
+                InventoryRollup.invalidate()
+                bump_dataset_version()
                 __, msg=Site.parse_sites_from_xls(file_contents=file_contents,
                                         modifier=modifier)
                 if len(msg) > 0:
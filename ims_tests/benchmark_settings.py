@@ -0,0 +1,74 @@
+"""
+settings for generating a benchmark dataset and running the benchmarks on a
+local SQLite database, e.g.
+
+django-admin migrate --settings=ims_tests.benchmark_settings
+django-admin generate_benchmark_dataset --settings=ims_tests.benchmark_settings
+django-admin run_benchmarks --output=results.json --settings=ims_tests.benchmark_settings
+
+from the top of the repository
+"""
+import os
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+PAGE_SIZE = 20
+
+SECRET_KEY = os.environ.get('IMS_SECRET', 'ims-benchmark-only')
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'ims_tests',
+    'ims',
+]
+
+MIDDLEWARE_CLASSES = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+)
+
+ROOT_URLCONF = 'ims_tests.urls'
+STATIC_URL = '/static/'
+USE_TZ = True
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('IMS_BENCHMARK_DB',
+                               os.path.join(BASE_DIR, 'ims_benchmark.sqlite3')),
+    }
+}
+
+MEDIA_ROOT = os.path.join(tempfile.gettempdir(), 'ims_benchmark_media')
+TEMP_DIR = tempfile.gettempdir()
+LOG_FILE = os.path.join(tempfile.gettempdir(), 'ims_benchmark.log')
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [os.path.join(BASE_DIR, 'ims_tests/templates'),
+                 'ims/templates',
+        ],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.contrib.auth.context_processors.auth',
+                'django.template.context_processors.debug',
+                'django.template.context_processors.i18n',
+                'django.template.context_processors.media',
+                'django.template.context_processors.static',
+                'django.template.context_processors.tz',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
@@ -3,20 +3,42 @@ from unittest import skip
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User, Permission
 from django.contrib.sessions.middleware import SessionMiddleware
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from urllib import urlencode
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta
+from decimal import Decimal
 import os 
+import pytz
 import StringIO
+import csv
+import json
+import shutil
+import tempfile
 import re
 import logging
-from ims.models import Site, ProductInformation, InventoryItem, ProductCategory
+from ims.models import Site, ProductInformation, InventoryItem, ProductCategory,\
+CurrentInventory, InventoryCheckpoint, epoch_microseconds, InventoryRollup,\
+ProductInventoryRollup, SiteInventoryRollup, CategoryInventoryRollup, RequestTiming,\
+ImportJob, SiteInventoryTotals
 from ims.views import (inventory_delete_all, site_delete_all, product_delete_all,
 site_delete, product_delete, product_add, site_add, site_detail, 
 site_add_inventory, products_add_to_site_inventory, product_detail,
-product_select_add_site)
+product_select_add_site, get_sorted_inventory, sort_inventory, merge_pivots,
+create_report_artifacts, report_artifact_name)
+import ims.views
 from ims.settings import PAGE_SIZE, APP_DIR
+from ims.benchmarks import (create_synthetic_history, legacy_latest_inventory,
+benchmark_request)
+from ims.reportcache import (cached_report, dataset_version, report_cache_key,
+reportCache, reportCacheSize, ReportCache)
+from ims.importjobs import process_import_jobs, run_import_job
+from ims.importschema import ImportSchema
+from ims.importdiff import diff_import
+from ims.importreaders import read_rows
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files import File
 import zipfile
 logging.disable(logging.CRITICAL)
 
@@ -291,7 +313,62 @@ class SiteMethodTests(TestCase):
         self.assertEqual(
          latestInventory.get(information_id=createdProducts[0].pk).information.category.pk,
          createdCategories.pop().pk)
-    
+
+    def test_latest_inventory_with_stop_date(self):
+        """
+        site.latest_inventory with a stopDate should return the latest change
+        made on or before that date, and ignore later changes
+        """
+        print 'running SiteMethodTests.test_latest_inventory_with_stop_date... '
+        site=Site(name='test site 1')
+        site.save()
+        product=ProductInformation(name='test product 1', code='pdt1')
+        product.save()
+        otherProduct=ProductInformation(name='test product 2', code='pdt2')
+        otherProduct.save()
+        now=timezone.now()
+        items=[]
+        for (information, quantity, deleted, daysAgo) in ((product, 1, False, 10),
+                                                          (product, 2, False, 5),
+                                                          (otherProduct, 3, False, 4),
+                                                          (product, 0, True, 2),
+                                                          (otherProduct, 4, False, 1)):
+            item=InventoryItem(site=site,
+                               information=information,
+                               quantity=quantity,
+                               deleted=deleted,
+                               modified=now - timedelta(days=daysAgo))
+            item.save()
+            items.append(item)
+        latestInventory=site.latest_inventory(stopDate=now - timedelta(days=3))
+        self.assertEqual(
+            sorted([item.pk for item in latestInventory]),
+            sorted([items[1].pk, items[2].pk]))
+        latestInventory=site.latest_inventory(stopDate=now)
+        # product was deleted two days ago
+        self.assertEqual([item.pk for item in latestInventory], [items[4].pk])
+
+    def test_latest_inventory_with_stop_date_matches_legacy(self):
+        """
+        site.latest_inventory with or without a stopDate should pick the same
+        records as the original per-product algorithm on a random history
+        """
+        print 'running SiteMethodTests.test_latest_inventory_with_stop_date_matches_legacy... '
+        (sites,
+         __,
+         (startDate, stopDate))=create_synthetic_history(numSites=2,
+                                                         numProducts=5,
+                                                         numChanges=4,
+                                                         seed=1)
+        midDate=startDate + (stopDate - startDate) / 2
+        for site in sites:
+            # no stop date reads the current inventory table, which the
+            # synthetic history rebuilds after its bulk insert
+            for date in (midDate, stopDate, None):
+                self.assertEqual(
+                    sorted(site.latest_inventory(stopDate=date).values_list('pk', flat=True)),
+                    sorted(legacy_latest_inventory(site, stopDate=date)))
+
     def test_parse_sites_from_xls_initial(self):
         """
         import 3 sites from Excel
@@ -419,7 +496,28 @@ class ProductInformationMethodTests(TestCase):
                                 numItems=2)
         product = createdProducts[0]
         self.assertEqual(product.num_sites_containing(), 3)
-        
+
+    def test_sites_containing_counts(self):
+        print 'running ProductInformationMethodTests.test_sites_containing_counts... '
+        (createdSites,
+         createdProducts,
+         __,
+         __)=create_products_with_inventory_items_for_sites(
+                                numSites=3,
+                                numProducts=2,
+                                numItems=1)
+        create_inventory_item_for_site(site=createdSites[0],
+                                       product=createdProducts[1],
+                                       deleted=1)
+        product = ProductInformation(name='test product 3', code='pdt3')
+        product.save()
+        counts = ProductInformation.sites_containing_counts(
+                        [createdProducts[0].code, createdProducts[1].code, 'pdt3'])
+        self.assertEqual(counts, {createdProducts[0].code:3,
+                                  createdProducts[1].code:2,
+                                  'pdt3':0})
+        self.assertEqual(createdProducts[1].num_sites_containing(), 2)
+
     def test_parse_product_information_from_xls_initial(self):
         """
         import 3 products from Excel
@@ -675,6 +773,68 @@ class InventoryItemMethodTests(TestCase):
             queriedInventory.count(), 10,
             'You didn''t store all all the inventory items')
         
+    def test_parse_inventory_from_upload(self):
+        """
+        inventory uploads are streamed from XLS and CSV files, in batches
+        """
+        print 'running InventoryItemMethodTests.test_parse_inventory_from_upload... '
+        for number in range(3):
+            Site(name='test site %d' % (number + 1),
+                 number=number + 1,
+                 modifier='none').save()
+            ProductInformation(name='test product %d' % (number + 1),
+                               code='pdt%d' % (number + 1),
+                               modifier='none').save()
+        filename=os.path.join(
+                 APP_DIR,
+                 'testData/inventory_add_10_to_site1_site2_site3_prod1_prod2_prod3.xls')
+        (importedInventoryItems,
+         inventoryMessage)=InventoryItem.parse_inventory_from_xls(
+                           upload=filename,
+                           modifier='none',
+                           batchSize=2)
+        self.assertEqual(inventoryMessage, '')
+        self.assertEqual(len(importedInventoryItems), 9)
+        self.assertEqual(InventoryItem.objects.count(), 9)
+        upload=SimpleUploadedFile('inventory.csv',
+                                  'Product Code,Prefix,Site Number,Cartons,deleted\n'
+                                  'pdt1,P,1,20,0\n'
+                                  'pdt2,P,2,0,1\n')
+        (importedInventoryItems,
+         inventoryMessage)=InventoryItem.parse_inventory_from_xls(
+                           upload=upload,
+                           modifier='none')
+        self.assertEqual(inventoryMessage, '')
+        self.assertEqual(len(importedInventoryItems), 2)
+        self.assertEqual(Site.objects.get(pk=1).latest_inventory_for_product('pdt1').quantity,
+                         20)
+        self.assertEqual(Site.objects.get(pk=2).latest_inventory_for_product('pdt2'),
+                         None)
+        (__,
+         inventoryMessage)=InventoryItem.parse_inventory_from_xls(
+                           upload=SimpleUploadedFile('inventory.txt', 'Cartons\n'),
+                           modifier='none')
+        self.assertIn('ImportReaderError', inventoryMessage)
+        
+    def test_read_rows_of_xls_file_on_disk(self):
+        """
+        an XLS file object backed by a file on disk is mapped, not read into
+        memory
+        """
+        print 'running InventoryItemMethodTests.test_read_rows_of_xls_file_on_disk... '
+        filename=os.path.join(
+                 APP_DIR,
+                 'testData/inventory_add_10_to_site1_site2_site3_prod1_prod2_prod3.xls')
+        headers, rows=read_rows(filename, sheet='Inventory')
+        class UnreadFile(File):
+            def read(self, *args):
+                raise AssertionError('read_rows read an XLS file on disk into memory')
+        with open(filename, 'rb') as fp:
+            upload=UnreadFile(fp, name='inventory.xls')
+            uploadHeaders, uploadRows=read_rows(upload, sheet='Inventory')
+            self.assertEqual(uploadHeaders, headers)
+            self.assertEqual(list(uploadRows), list(rows))
+        
     def test_parse_inventory_from_xls_with_bad_header(self):
         """
         import 3 inventory items to 3 sites from Excel file with a bad header
@@ -707,7 +867,884 @@ class InventoryItemMethodTests(TestCase):
         self.assert_('Xlrdutils' in inventoryMessage,
                      ('Failure to recognize a file with bad date format.\nInventoryItem.parse_inventory_from_xl returned: %s'
                       % inventoryMessage))
+
+    def test_modified_us_orders_by_timestamp(self):
+        """
+        modifiedUs should order inventory the same way timestamp() does
+        """
+        print 'running InventoryItemMethodTests.test_modified_us_orders_by_timestamp... '
+        (__,
+         __,
+         createdInventoryItems,
+         __)=create_products_with_inventory_items_for_sites(
+                                numSites=1,
+                                numProducts=2,
+                                numItems=3)
+        for item in createdInventoryItems:
+            self.assertEqual(item.modifiedUs,
+                             epoch_microseconds(item.timestamp()))
+        byTimestamp=sorted(createdInventoryItems,
+                           key=lambda item: item.timestamp())
+        self.assertListEqual([item.pk for item in sorted(createdInventoryItems)],
+                             [item.pk for item in byTimestamp])
+        self.assertEqual(InventoryItem.recently_changed(1)[0].pk,
+                         byTimestamp[-1].pk)
+
+    def test_latest_for_sites(self):
+        """
+        InventoryItem.objects.latest_for_sites should match site.latest_inventory
+        for every site, with or without a stop date
+        """
+        print 'running InventoryItemMethodTests.test_latest_for_sites... '
+        (createdSites,
+         createdProducts,
+         __,
+         __)=create_products_with_inventory_items_for_sites(
+                                numSites=3,
+                                numProducts=3,
+                                numItems=2)
+        create_inventory_item_for_site(site=createdSites[1],
+                                       product=createdProducts[0],
+                                       deleted=1)
+        for stopDate in (None, timezone.now()):
+            latestInventory=InventoryItem.objects.latest_for_sites(createdSites,
+                                                               stopDate=stopDate)
+            self.assertListEqual(latestInventory.keys(), createdSites)
+            for site in createdSites:
+                self.assertListEqual(
+                    [item.create_key() for item in latestInventory[site]],
+                    [item.create_key() for item in site.latest_inventory(stopDate=stopDate)])
+        self.assertEqual(len(latestInventory[createdSites[1]]), 2)
+
+    def test_recently_changed_feeds(self):
+        """
+        the recent activity feeds should list each site and product once,
+        most recently changed first
+        """
+        print 'running InventoryItemMethodTests.test_recently_changed_feeds... '
+        (createdSites,
+         createdProducts,
+         __,
+         __)=create_products_with_inventory_items_for_sites(
+                                numSites=3,
+                                numProducts=2,
+                                numItems=2)
+        (__,
+         __,
+         lastItem)=create_inventory_item_for_site(site=createdSites[0],
+                                                  product=createdProducts[1],
+                                                  quantity=9)
+        self.assertListEqual(Site.recently_changed_inventory(10),
+                             [createdSites[0], createdSites[2], createdSites[1]])
+        self.assertListEqual(Site.recently_changed_inventory(1),
+                             [createdSites[0]])
+        recentInventory=InventoryItem.recently_changed(10)
+        self.assertListEqual([item.pk for item in recentInventory],
+                             [lastItem.pk,
+                              createdSites[2].latest_inventory_for_product(
+                                        code=createdProducts[0].pk).pk])
+
+    def test_quantity_series(self):
+        """
+        quantity_series should carry the state at the start date and keep
+        the last value in each bucket
+        """
+        print 'running InventoryItemMethodTests.test_quantity_series... '
+        site1=Site(name='test site 1')
+        site1.save()
+        site2=Site(name='test site 2')
+        site2.save()
+        product=ProductInformation(name='test product', code='pdt1')
+        product.save()
+        at=lambda month, day, hour: datetime(2016, month, day, hour, tzinfo=pytz.utc)
+        for site, quantity, deleted, modified in ((site1, 5, False, at(12, 30, 8) - timedelta(days=366)),
+                                                  (site2, 2, False, at(1, 3, 10)),
+                                                  (site1, 7, False, at(1, 3, 12)),
+                                                  (site1, 0, True, at(1, 10, 9))):
+            InventoryItem(site=site, information=product, quantity=quantity,
+                          deleted=deleted, modified=modified).save()
+        history=InventoryItem.objects.filter(information=product)
+        startDate=at(1, 1, 0)
+        stopDate=at(1, 31, 23)
+        self.assertEqual(history.quantity_series(startDate, stopDate)[None],
+                         [(startDate, 5), (at(1, 3, 10), 7), (at(1, 3, 12), 9),
+                          (at(1, 10, 9), 2)])
+        self.assertEqual(history.quantity_series(startDate, stopDate, bucket='day')[None],
+                         [(at(1, 1, 0), 5), (at(1, 3, 0), 9), (at(1, 10, 0), 2)])
+        self.assertEqual(history.quantity_series(startDate, stopDate, bucket='month')[None],
+                         [(at(1, 1, 0), 2)])
+        series=history.quantity_series(startDate, stopDate, bySite=True)
+        self.assertEqual(series[site1.pk],
+                         [(startDate, 5), (at(1, 3, 12), 7), (at(1, 10, 9), 0)])
+        self.assertEqual(series[site2.pk],
+                         [(startDate, 0), (at(1, 3, 10), 2)])
+
+    def test_product_totals(self):
+        """
+        product_totals and with_extended should compute pieces and value in
+        the database
+        """
+        print 'running InventoryItemMethodTests.test_product_totals... '
+        product=ProductInformation(name='test product', code='pdt1',
+                                   quantityOfMeasure=3, costPerItem='2.50')
+        product.save()
+        for siteName, quantity in (('test site 1', 2), ('test site 2', 5)):
+            site=Site(name=siteName)
+            site.save()
+            site.add_inventory(product=product, quantity=quantity)
+        latest=InventoryItem.objects.latest_state()
+        self.assertEqual(latest.product_totals(),
+                         {'pdt1':(7, 21, Decimal('52.50'))})
+        item=latest.with_extended().get(quantity=5)
+        self.assertEqual((item.pieces(), item.extendedValue), (15, Decimal('37.50')))
+
+    def test_changes_between(self):
+        """
+        changes_between should give the quantities at both dates, the net 
+        change and the number of changes in between
+        """
+        print 'running InventoryItemMethodTests.test_changes_between... '
+        site=Site(name='test site')
+        site.save()
+        products=[]
+        for code in ('pdt1', 'pdt2', 'pdt3'):
+            product=ProductInformation(name='test product ' + code, code=code)
+            product.save()
+            products.append(product)
+        at=lambda day: datetime(2016, 1, day, 12, tzinfo=pytz.utc)
+        for product, quantity, deleted, day in ((products[0], 10, False, 1),
+                                                (products[2], 5, False, 2),
+                                                (products[0], 6, False, 6),
+                                                (products[0], 4, False, 7),
+                                                (products[1], 3, False, 8),
+                                                (products[2], 0, True, 9),
+                                                (products[1], 8, False, 12)):
+            InventoryItem(site=site, information=product, quantity=quantity,
+                          deleted=deleted, modified=at(day)).save()
+        changes=InventoryItem.objects.changes_between(datetime(2016, 1, 5, tzinfo=pytz.utc),
+                                                      datetime(2016, 1, 10, 23, 59, tzinfo=pytz.utc))
+        self.assertEqual(changes, {(site.pk, 'pdt1'):(10, 4, -6, 2),
+                                   (site.pk, 'pdt2'):(0, 3, 3, 1),
+                                   (site.pk, 'pdt3'):(5, 0, -5, 1)})
+
+class CurrentInventoryMethodTests(TestCase):
+    """
+    CurrentInventory class method ims_tests
+    """
+    
+    def test_current_inventory_after_3_changes(self):
+        """
+        there should be one CurrentInventory entry per site and product, 
+        pointing at the latest change
+        """
+        print 'running CurrentInventoryMethodTests.test_current_inventory_after_3_changes... '
+        (createdSites,
+         createdProducts,
+         createdInventoryItems,
+         __)=create_products_with_inventory_items_for_sites(
+                                numSites=2,
+                                numProducts=2,
+                                numItems=3)
+        self.assertEqual(CurrentInventory.objects.count(), 2*2)
+        for site in createdSites:
+            for product in createdProducts:
+                current=CurrentInventory.objects.get(site=site,
+                                                     information=product)
+                history=[item for item in createdInventoryItems 
+                         if item.site == site and item.information == product]
+                self.assertEqual(current.item.create_key(),
+                                 history[-1].create_key())
     
+    def test_current_inventory_after_deleting_latest_change(self):
+        """
+        deleting the latest change record should make the previous change
+        record current
+        """
+        print 'running CurrentInventoryMethodTests.test_current_inventory_after_deleting_latest_change... '
+        (createdSites,
+         createdProducts,
+         createdInventoryItems,
+         __)=create_products_with_inventory_items_for_sites(
+                                numSites=1,
+                                numProducts=1,
+                                numItems=3)
+        createdInventoryItems[-1].delete()
+        current=CurrentInventory.objects.get(site=createdSites[0],
+                                             information=createdProducts[0])
+        self.assertEqual(current.item.create_key(),
+                         createdInventoryItems[-2].create_key())
+        self.assertEqual(createdSites[0].inventory_quantity(createdProducts[0].code), 2)
+        
+    def test_current_inventory_ignores_older_change(self):
+        """
+        a change record saved with an older modification date should not 
+        replace the current state
+        """
+        print 'running CurrentInventoryMethodTests.test_current_inventory_ignores_older_change... '
+        (createdSites,
+         createdProducts,
+         createdInventoryItems,
+         __)=create_products_with_inventory_items_for_sites(
+                                numSites=1,
+                                numProducts=1,
+                                numItems=2)
+        olderItem=InventoryItem(site=createdSites[0],
+                                information=createdProducts[0],
+                                quantity=50,
+                                modified=timezone.now() - timedelta(days=1))
+        olderItem.save()
+        self.assertEqual(createdSites[0].latest_inventory_for_product(
+                         code=createdProducts[0].pk).create_key(),
+                         createdInventoryItems[-1].create_key())
+        self.assertEqual(createdSites[0].total_inventory(), 2)
+
+class InventoryCheckpointMethodTests(TestCase):
+    """
+    InventoryCheckpoint class method ims_tests
+    """
+
+    def test_latest_inventory_from_checkpoint(self):
+        """
+        site.latest_inventory with a stopDate after a checkpoint should return
+        the same records as replaying the whole history
+        """
+        print 'running InventoryCheckpointMethodTests.test_latest_inventory_from_checkpoint... '
+        (sites,
+         __,
+         (startDate, stopDate))=create_synthetic_history(numSites=2,
+                                                         numProducts=5,
+                                                         numChanges=4,
+                                                         seed=2)
+        checkpointDate=startDate + (stopDate - startDate) / 3
+        laterDate=startDate + 2 * (stopDate - startDate) / 3
+        self.assertGreater(InventoryCheckpoint.create_checkpoint(checkpointDate), 0)
+        self.assertEqual(InventoryCheckpoint.nearest(laterDate), checkpointDate)
+        for site in sites:
+            for date in (checkpointDate, laterDate, stopDate):
+                self.assertEqual(
+                    sorted(site.latest_inventory(stopDate=date).values_list('pk', flat=True)),
+                    sorted(legacy_latest_inventory(site, stopDate=date)))
+
+    def test_backdated_change_invalidates_checkpoint(self):
+        """
+        saving a change dated before a checkpoint should drop the checkpoint,
+        and the change should show up in inventory as of a later date
+        """
+        print 'running InventoryCheckpointMethodTests.test_backdated_change_invalidates_checkpoint... '
+        (createdSites,
+         createdProducts,
+         __,
+         __)=create_products_with_inventory_items_for_sites(
+                                numSites=1,
+                                numProducts=1,
+                                numItems=1)
+        product=ProductInformation(name='test product 2', code='pdt2')
+        product.save()
+        checkpointDate=timezone.now()
+        InventoryCheckpoint.create_checkpoint(checkpointDate)
+        backdatedItem=InventoryItem(site=createdSites[0],
+                                    information=product,
+                                    quantity=7,
+                                    modified=checkpointDate - timedelta(days=1))
+        backdatedItem.save()
+        self.assertEqual(InventoryCheckpoint.objects.filter(
+                         asOf=checkpointDate).count(), 0)
+        latestInventory=createdSites[0].latest_inventory(
+                            stopDate=checkpointDate + timedelta(seconds=1))
+        self.assertEqual(latestInventory.get(information=product).pk,
+                         backdatedItem.pk)
+        InventoryCheckpoint.create_checkpoint(checkpointDate)
+        backdatedItem.delete()
+        self.assertEqual(InventoryCheckpoint.objects.count(), 0)
+
+class SiteInventoryTotalsMethodTests(TestCase):
+    """
+    SiteInventoryTotals class method ims_tests
+    """
+
+    def assert_totals(self, site, totalQuantity, totalPieces, totalValue, productCount):
+        totals=site.inventory_totals()
+        self.assertEqual((totals.totalQuantity,
+                          totals.totalPieces,
+                          totals.totalValue,
+                          totals.productCount),
+                         (totalQuantity, totalPieces, Decimal(totalValue), productCount))
+
+    def test_totals_follow_inventory_changes(self):
+        """
+        site totals should follow additions, changes and deletions of inventory
+        """
+        print 'running SiteInventoryTotalsMethodTests.test_totals_follow_inventory_changes... '
+        site=Site(name='test site 1')
+        site.save()
+        product1=ProductInformation(name='test product 1', code='pdt1',
+                                    quantityOfMeasure=12, costPerItem='1.50')
+        product1.save()
+        product2=ProductInformation(name='test product 2', code='pdt2',
+                                    quantityOfMeasure=1, costPerItem='10.00')
+        product2.save()
+        self.assert_totals(site, 0, 0, '0', 0)
+        site.add_inventory(product=product1, quantity=2)
+        site.add_inventory(product=product2, quantity=3)
+        self.assert_totals(site, 5, 27, '66.00', 2)
+        lastItem=site.add_inventory(product=product1, quantity=1)
+        self.assert_totals(site, 4, 15, '48.00', 2)
+        site.add_inventory(product=product2, deleted=1)
+        self.assert_totals(site, 1, 12, '18.00', 1)
+        lastItem.delete()
+        self.assert_totals(site, 2, 24, '36.00', 1)
+        self.assertEqual(site.total_inventory(), 2)
+
+    def test_totals_follow_product_changes(self):
+        """
+        site totals should be recalculated when the pieces or cost of a product
+        changes
+        """
+        print 'running SiteInventoryTotalsMethodTests.test_totals_follow_product_changes... '
+        site=Site(name='test site 1')
+        site.save()
+        product=ProductInformation(name='test product 1', code='pdt1',
+                                   quantityOfMeasure=12, costPerItem='1.50')
+        product.save()
+        site.add_inventory(product=product, quantity=2)
+        self.assert_totals(site, 2, 24, '36.00', 1)
+        product=ProductInformation.objects.get(pk='pdt1')
+        product.quantityOfMeasure=6
+        product.costPerItem=Decimal('2.00')
+        product.save()
+        self.assert_totals(site, 2, 12, '24.00', 1)
+
+    def test_totals_follow_inventory_added_after_deletion(self):
+        """
+        site totals should count inventory added back after all of the site's
+        inventory was deleted, even when the site has no totals yet
+        """
+        print 'running SiteInventoryTotalsMethodTests.test_totals_follow_inventory_added_after_deletion... '
+        site=Site(name='test site 1')
+        site.save()
+        product=ProductInformation(name='test product 1', code='pdt1',
+                                   quantityOfMeasure=1, costPerItem='1.00')
+        product.save()
+        site.add_inventory(product=product, quantity=5)
+        site.add_inventory(product=product, deleted=1)
+        product=ProductInformation.objects.get(pk='pdt1')
+        product.costPerItem=Decimal('2.00')
+        product.save()
+        self.assertTrue(SiteInventoryTotals.objects.filter(site=site).exists(),
+                        'sites without current inventory should have zero totals')
+        self.assert_totals(site, 0, 0, '0', 0)
+        site.add_inventory(product=product, quantity=7)
+        self.assert_totals(site, 7, 7, '14.00', 1)
+        # as left by a site that had only deleted inventory when the totals
+        # were first populated
+        site.add_inventory(product=product, deleted=1)
+        SiteInventoryTotals.objects.filter(site=site).delete()
+        site.add_inventory(product=product, quantity=3)
+        self.assert_totals(site, 3, 3, '6.00', 1)
+
+class InventoryRollupMethodTests(TestCase):
+    """
+    InventoryRollup class method tests
+    """
+    def create_history(self):
+        category=ProductCategory(category='test category')
+        category.save()
+        site=Site(name='test site')
+        site.save()
+        product1=ProductInformation(name='test product 1', code='pdt1',
+                                    quantityOfMeasure=2, costPerItem='1.50',
+                                    category=category)
+        product1.save()
+        product2=ProductInformation(name='test product 2', code='pdt2',
+                                    quantityOfMeasure=1, costPerItem='3.00')
+        product2.save()
+        today=timezone.now().astimezone(pytz.utc).replace(hour=12, minute=0,
+                                                          second=0, microsecond=0)
+        for product, quantity, daysAgo in ((product1, 3, 4),
+                                           (product2, 5, 4),
+                                           (product1, 4, 2)):
+            InventoryItem(site=site, information=product, quantity=quantity,
+                          modified=today - timedelta(days=daysAgo)).save()
+        return site, product1, product2, today
+        
+    def test_rollup(self):
+        print 'running InventoryRollupMethodTests.test_rollup... '
+        site, product1, product2, noon=self.create_history()
+        today=noon.date()
+        dates=InventoryRollup.rollup()
+        self.assertEqual(dates, [today - timedelta(days=days) for days in (4, 3, 2, 1)])
+        rollup=ProductInventoryRollup.objects.get(date=today - timedelta(days=3),
+                                                  information=product1)
+        self.assertEqual((rollup.totalQuantity, rollup.totalPieces, rollup.totalValue,
+                          rollup.siteCount),
+                         (3, 6, Decimal('9.00'), 1))
+        rollup=ProductInventoryRollup.objects.get(date=today - timedelta(days=1),
+                                                  information=product1)
+        self.assertEqual((rollup.totalQuantity, rollup.totalPieces), (4, 8))
+        rollup=SiteInventoryRollup.objects.get(date=today - timedelta(days=1),
+                                               site=site)
+        self.assertEqual((rollup.totalQuantity, rollup.totalPieces, rollup.totalValue,
+                          rollup.productCount),
+                         (9, 13, Decimal('27.00'), 2))
+        rollup=CategoryInventoryRollup.objects.get(date=today - timedelta(days=1),
+                                                   category=product1.category)
+        self.assertEqual(rollup.totalPieces, 8)
+        rollup=CategoryInventoryRollup.objects.get(date=today - timedelta(days=1),
+                                                   category=None)
+        self.assertEqual(rollup.totalPieces, 5)
+        self.assertEqual(InventoryRollup.rollup(), [],
+                         'InventoryRollup.rollup rewrote rollups that were up to date')
+        
+    def test_rollup_after_history_change(self):
+        print 'running InventoryRollupMethodTests.test_rollup_after_history_change... '
+        site, product1, product2, noon=self.create_history()
+        today=noon.date()
+        InventoryRollup.rollup()
+        InventoryItem(site=site, information=product2, quantity=7,
+                      modified=noon - timedelta(days=3)).save()
+        self.assertFalse(ProductInventoryRollup.objects.filter(
+                                    date__gte=today - timedelta(days=3)).exists(),
+                         'InventoryItem.save didn''t drop the rollups it made stale')
+        self.assertEqual(InventoryRollup.rollup(), 
+                         [today - timedelta(days=days) for days in (3, 2, 1)])
+        rollup=ProductInventoryRollup.objects.get(date=today - timedelta(days=1),
+                                                  information=product2)
+        self.assertEqual(rollup.totalQuantity, 7)
+
+class ImportSchemaTests(TestCase):
+    """
+    ims_tests for the spreadsheet column schemas
+    """
+    def test_export_headers_resolve_to_fields(self):
+        """
+        the exported headers of each model should import into the fields of
+        the same columns
+        """
+        print 'running ImportSchemaTests.test_export_headers_resolve_to_fields... '
+        for model in (Site, ProductCategory, ProductInformation, InventoryItem):
+            schema=model.importSchema
+            self.assertEqual([field for __, field, __ in schema.resolve(schema.titles())],
+                             [column.field for column in schema.columns if column.field],
+                             '%s export headers don''t resolve to its fields' % model.__name__)
+    
+    def test_rows(self):
+        print 'running ImportSchemaTests.test_rows... '
+        data=OrderedDict((('Site Number', [1.0, 2.0]),
+                          ('Cartons', [10.0, 0]),
+                          ('deleted', [0, 1]),
+                          ('Prefix', [u' p', u'P']),
+                          ('Product Code', [u'pdt1 ', u'']),
+                          ('unknown', [u'x', u'y'])))
+        rows=list(InventoryItem.importSchema.rows(data))
+        self.assertEqual(rows, [[('site_id', 1.0), ('quantity', 10),
+                                 ('deleted', False), ('prefix', 'P'),
+                                 ('code', 'PDT1')],
+                                [('site_id', 2.0), ('quantity', 0),
+                                 ('deleted', True), ('prefix', 'P')]])
+        self.assertEqual(list(ImportSchema('Sheet', ()).rows({})), [])
+        
+class ImportDiffTests(TestCase):
+    """
+    ims_tests for dry runs of the spreadsheet imports
+    """
+    def test_diff_sites(self):
+        """
+        a dry run of a site import finds the inserted, updated and unchanged
+        sites without changing any
+        """
+        print 'running ImportDiffTests.test_diff_sites... '
+        filename=os.path.join(APP_DIR,
+                              'testData/sites_add_site1_site2_site3.xls')
+        Site.parse_sites_from_xls(filename=filename,  
+                                  modifier='none',
+                                  save=True)
+        Site.objects.filter(pk=1).update(name='changed')
+        Site.objects.filter(pk=3).delete()
+        diff, msg=diff_import(Site, upload=filename, batchSize=2)
+        self.assertEqual(msg, '')
+        self.assertEqual(diff.rowsRead, 3)
+        self.assertEqual(diff.updates, [(1, [('name', 'changed', 'test site 1')])])
+        self.assertEqual([key for key, __ in diff.inserts], [3])
+        self.assertEqual(diff.unchanged, [2])
+        self.assertEqual(Site.objects.count(), 2)
+        self.assertEqual(Site.objects.get(pk=1).name, 'changed')
+        diff, msg=diff_import(Site, upload=SimpleUploadedFile('sites.txt', ''))
+        self.assertEqual(diff, None)
+        self.assertIn('ImportReaderError', msg)
+        
+    def test_diff_products_does_not_create_categories(self):
+        print 'running ImportDiffTests.test_diff_products_does_not_create_categories... '
+        filename=os.path.join(APP_DIR,
+                              'testData/products_add_prod1_prod2_prod3.xls')
+        ProductInformation.parse_product_information_from_xls(filename=filename, 
+                                                              modifier='none',
+                                                              save=True)
+        diff, msg=diff_import(ProductInformation,
+                              upload=SimpleUploadedFile('products.csv',
+                                    'Product Code,Product Name,Unit of Measure,Qty of Measure,Product Category\n'
+                                    'pdt1,product name 1,EACH,1,new category\n'
+                                    'pdt4,product name 4,EACH,1,\n'))
+        self.assertEqual(msg, '')
+        self.assertEqual([key for key, __ in diff.updates], ['pdt1'])
+        self.assertIn(('category', '', 'new category'), diff.updates[0][1])
+        self.assertEqual([key for key, __ in diff.inserts], ['pdt4'])
+        self.assertEqual(ProductCategory.objects.count(), 0)
+        self.assertEqual(ProductInformation.objects.count(), 3)
+        
+    def test_diff_inventory(self):
+        """
+        a dry run of an inventory import compares the rows with the current
+        inventory and finds the rows for unknown sites and products
+        """
+        print 'running ImportDiffTests.test_diff_inventory... '
+        for number in range(3):
+            Site(name='test site %d' % (number + 1),
+                 number=number + 1,
+                 modifier='none').save()
+            ProductInformation(name='test product %d' % (number + 1),
+                               code='pdt%d' % (number + 1),
+                               modifier='none').save()
+        InventoryItem(site=Site.objects.get(pk=2),
+                      information=ProductInformation.objects.get(pk='pdt2'),
+                      quantity=5,
+                      modifier='none').save()
+        InventoryItem(site=Site.objects.get(pk=1),
+                      information=ProductInformation.objects.get(pk='pdt3'),
+                      quantity=1,
+                      modifier='none').save()
+        diff, msg=diff_import(InventoryItem,
+                              upload=SimpleUploadedFile('inventory.csv',
+                                    'Product Code,Prefix,Site Number,Cartons,deleted\n'
+                                    'pdt1,P,1,20,0\n'
+                                    'pdt2,P,2,5,0\n'
+                                    'pdt3,P,1,7,0\n'
+                                    'pdt9,P,1,7,0\n'
+                                    'pdt1,P,9,7,0\n'
+                                    'pdt1,X,1,7,0\n'
+                                    'pdt3,P,1,7,1\n'),
+                              batchSize=3)
+        self.assertEqual(msg, '')
+        self.assertEqual(diff.rowsRead, 7)
+        self.assertEqual(diff.rowsSkipped, 1)
+        self.assertEqual(diff.inserts, [('1, PDT1', OrderedDict((('quantity', 20),)))])
+        self.assertEqual(diff.unchanged, ['2, PDT2'])
+        self.assertEqual(diff.updates, [('1, PDT3', [('quantity', 1, 7)]),
+                                        ('1, PDT3', [('deleted', False, True)])])
+        self.assertEqual(diff.duplicates, ['1, PDT3'])
+        self.assertEqual(diff.unknown, [('1, PDT9', 'unknown product'),
+                                        ('9, PDT1', 'unknown site')])
+        self.assertEqual(InventoryItem.objects.count(), 2)
+    
+class ReportCacheTests(TestCase):
+    """
+    ims_tests for the versioned report cache
+    """
+    def setUp(self):
+        cache.clear()
+        reportCache.clear()
+        
+    def test_cached_report_invalidated_by_writes(self):
+        print 'running ReportCacheTests.test_cached_report_invalidated_by_writes... '
+        computed=[]
+        def compute():
+            computed.append(1)
+            return (len(computed),)
+        self.assertEqual(cached_report('report', '01-01-2016', OrderedDict(), compute),
+                         (1,))
+        self.assertEqual(cached_report('report', '01-01-2016', OrderedDict(), compute),
+                         (1,),
+                         'cached_report recomputed a cached report')
+        site=Site(name='test site')
+        site.save()
+        self.assertEqual(cached_report('report', '01-01-2016', OrderedDict(), compute),
+                         (2,),
+                         'cached_report didn''t recompute the report after a site was saved')
+        
+    def test_cached_report_least_recently_used_evicted(self):
+        print 'running ReportCacheTests.test_cached_report_least_recently_used_evicted... '
+        version=dataset_version()
+        for indx in range(reportCacheSize + 1):
+            cached_report('report %d' % indx, '01-01-2016', OrderedDict(), 
+                          lambda: ('result',))
+            if indx == 1:
+                # keep the first report in use
+                cached_report('report 0', '01-01-2016', OrderedDict(), 
+                              lambda: ('result',))
+        self.assertIn(report_cache_key('report 0', '01-01-2016',
+                                       OrderedDict(), version), reportCache)
+        self.assertNotIn(report_cache_key('report 1', '01-01-2016',
+                                          OrderedDict(), version), reportCache,
+                         'cached_report didn''t evict the least recently used report')
+        self.assertEqual(len(reportCache.reports), reportCacheSize)
+        
+    def test_report_cache_timeouts(self):
+        """
+        reports without a timeout are kept until they are pushed out, and each
+        caller gets its own copy of a report
+        """
+        print 'running ReportCacheTests.test_report_cache_timeouts... '
+        reports=ReportCache(2)
+        reports.set('past', ['result'], None)
+        reports.set('expired', ['result'], 0)
+        self.assertIsNone(reports.get('expired'))
+        result=reports.get('past')
+        self.assertEqual(result, ['result'])
+        result.append('changed')
+        self.assertEqual(reports.get('past'), ['result'],
+                         'ReportCache returned a shared copy of a report')
+        
+    def test_get_sorted_inventory_after_inventory_change(self):
+        print 'running ReportCacheTests.test_get_sorted_inventory_after_inventory_change... '
+        user=User.objects.create_user(username='testUser', password='12345678')
+        site, product, __=create_inventory_item_for_site(quantity=1)
+        today=timezone.now().strftime('%m-%d-%Y')
+        sitesList=get_sorted_inventory(benchmark_request(user),
+                                       report='site_inventory_print',
+                                       startDate=today,
+                                       stopDate=today)[1]
+        self.assertEqual([item.quantity for item in sitesList.values()[0]], [1])
+        site.add_inventory(product=product, quantity=5)
+        sitesList=get_sorted_inventory(benchmark_request(user),
+                                       report='site_inventory_print',
+                                       startDate=today,
+                                       stopDate=today)[1]
+        self.assertEqual([item.quantity for item in sitesList.values()[0]], [5],
+                         'get_sorted_inventory returned a stale cached report')
+
+class SortInventoryTests(TestCase):
+    """
+    ims_tests for the inventory report pivot and sort
+    """
+    def test_sort_inventory_products_with_same_name(self):
+        print 'running SortInventoryTests.test_sort_inventory_products_with_same_name... '
+        site1=Site(name='site b')
+        site1.save()
+        site2=Site(name='site a')
+        site2.save()
+        products=[]
+        for code, name in (('pdt3', 'same name'),
+                           ('pdt1', 'same name'),
+                           ('pdt2', 'another name')):
+            product=ProductInformation(name=name, code=code, quantityOfMeasure=2)
+            product.save()
+            products.append(product)
+            site1.add_inventory(product=product, quantity=1)
+            site2.add_inventory(product=product, quantity=3)
+        orderBy=OrderedDict((('information__name', 'information__name'),
+                             ('information__code', '-information__code')))
+        __, inventoryList, __, __=sort_inventory(report='inventory_detail_print',
+                                                 orderBy=orderBy)
+        self.assertEqual([product.code for product in inventoryList.keys()],
+                         ['pdt2', 'pdt3', 'pdt1'],
+                         'sort_inventory didn''t sort by name then descending code')
+        for siteQuantityList, totals in inventoryList.values():
+            self.assertEqual([(site.name, quantity, pieces) 
+                              for site, quantity, pieces in siteQuantityList],
+                             [('site a', 3, 6), ('site b', 1, 2)])
+            self.assertEqual(totals, (4, 8))
+        __, inventoryList, __, __=sort_inventory(report='inventory_status_print',
+                                                 orderBy=orderBy)
+        self.assertEqual([(product.code, totals) 
+                          for product, (__, totals) in inventoryList.iteritems()],
+                         [('pdt2', (4, 8)), ('pdt3', (4, 8)), ('pdt1', (4, 8))],
+                         'sort_inventory didn''t total the products in the database')
+
+    def test_sort_inventory_status_without_stop_date(self):
+        """
+        the status report without a stop date totals the current inventory
+        """
+        print 'running SortInventoryTests.test_sort_inventory_status_without_stop_date... '
+        site=Site(name='site a')
+        site.save()
+        product=ProductInformation(name='product', code='pdt1', quantityOfMeasure=3)
+        product.save()
+        site.add_inventory(product=product, quantity=2)
+        orderBy=OrderedDict((('information__name', 'information__name'),))
+        for report in ('inventory_status', 'inventory_status_print'):
+            __, inventoryList, __, __=sort_inventory(report=report,
+                                                     orderBy=orderBy)
+            self.assertEqual([(product.code, totals) 
+                              for product, (__, totals) in inventoryList.iteritems()],
+                             [('pdt1', (2, 6))])
+
+    def test_merge_pivots(self):
+        print 'running SortInventoryTests.test_merge_pivots... '
+        product1=ProductInformation(name='test product 1', code='pdt1')
+        product2=ProductInformation(name='test product 2', code='pdt2')
+        site1=Site(name='site a')
+        site2=Site(name='site b')
+        merged=merge_pivots([{product1:([(site1, 1, 2)], (1, 2))},
+                             {product1:([(site2, 3, 6)], (3, 6)),
+                              product2:([(site2, 5, 5)], (5, 5))}])
+        self.assertEqual(merged[product1], ([(site1, 1, 2), (site2, 3, 6)], (4, 8)),
+                         'merge_pivots didn''t keep the sites in shard order')
+        self.assertEqual(merged[product2], ([(site2, 5, 5)], (5, 5)))
+
+class ReportPrintViewTests(TestCase):
+    """
+    ims_tests for the print report views
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testUser', password='12345678')
+        
+    def test_print_reports_streamed(self):
+        print 'running ReportPrintViewTests.test_print_reports_streamed... '
+        self.client.login(username='testUser', password='12345678')
+        (createdSites,
+         createdProducts,
+         __,
+         __)=create_products_with_inventory_items_for_sites(
+                                                numSites=3,
+                                                numProducts=3,
+                                                numItems=1)
+        for report in ('site_inventory_print',
+                       'site_detail_print',
+                       'inventory_detail_print',
+                       'inventory_status_print'):
+            response=self.client.get(reverse('ims:%s' % report) + '?stream=True')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming,
+                            'IMS %s view didn''t stream the report' % report)
+            content=''.join(response.streaming_content)
+            self.assertNotIn('<!--ims-report-rows-->', content,
+                             'IMS %s view didn''t replace the rows marker' % report)
+            if report == 'site_detail_print':
+                expected=[site.name for site in createdSites]
+            else:
+                expected=[product.name for product in createdProducts]
+            for name in expected:
+                self.assertIn(name, content,
+                              'IMS %s view didn''t include %s in the report' %
+                              (report, name))
+    
+    def test_report_artifacts(self):
+        print 'running ReportPrintViewTests.test_report_artifacts... '
+        self.client.login(username='testUser', password='12345678')
+        (__,
+         createdProducts,
+         __,
+         __)=create_products_with_inventory_items_for_sites(
+                                                numSites=2,
+                                                numProducts=2,
+                                                numItems=1)
+        today=timezone.now().strftime('%m-%d-%Y')
+        storeDir=tempfile.mkdtemp()
+        savedStoreDir=ims.views.reportStoreDir
+        ims.views.reportStoreDir=storeDir
+        try:
+            fileNames=create_report_artifacts(today)
+            self.assertEqual(len(fileNames), 8)
+            self.assertEqual(sorted(os.listdir(storeDir)), sorted(fileNames),
+                             'create_report_artifacts left temporary files in the report store')
+            response=self.client.get(reverse('ims:reports') + '?stopDate=' + today)
+            fileName=report_artifact_name('inventory_status_print', today, 'html')
+            self.assertIn(reverse('ims:report_artifact', kwargs={'fileName':fileName}),
+                          response.content,
+                          'IMS reports view didn''t offer the saved report')
+            response=self.client.get(reverse('ims:report_artifact',
+                                             kwargs={'fileName':fileName}))
+            self.assertEqual(response.status_code, 200)
+            content=''.join(response.streaming_content)
+            for product in createdProducts:
+                self.assertIn(product.name, content)
+            response=self.client.get(reverse('ims:report_artifact',
+                                             kwargs={'fileName':'inventory_status_print_2000-01-01.csv'}))
+            self.assertEqual(response.status_code, 404)
+        finally:
+            ims.views.reportStoreDir=savedStoreDir
+            shutil.rmtree(storeDir)
+    
+    def test_print_report_csv(self):
+        print 'running ReportPrintViewTests.test_print_report_csv... '
+        self.client.login(username='testUser', password='12345678')
+        (__,
+         createdProducts,
+         __,
+         __)=create_products_with_inventory_items_for_sites(
+                                                numSites=2,
+                                                numProducts=2,
+                                                numItems=1)
+        response=self.client.get(reverse('ims:inventory_status_print') + '?format=csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows=list(csv.reader(StringIO.StringIO(response.content)))
+        self.assertEqual(sorted(row[0] for row in rows[1:]),
+                         sorted(product.name for product in createdProducts))
+    
+    def test_print_report_timings(self):
+        print 'running ReportPrintViewTests.test_print_report_timings... '
+        self.client.login(username='testUser', password='12345678')
+        create_products_with_inventory_items_for_sites(numSites=2,
+                                                       numProducts=2,
+                                                       numItems=1)
+        settingsBefore=(ims.views.instrumentReports, 
+                        ims.views.showReportTimings,
+                        ims.views.recordReportTimings)
+        (ims.views.instrumentReports,
+         ims.views.showReportTimings,
+         ims.views.recordReportTimings)=(True, True, True)
+        try:
+            response=self.client.get(reverse('ims:inventory_detail_print'))
+        finally:
+            (ims.views.instrumentReports,
+             ims.views.showReportTimings,
+             ims.views.recordReportTimings)=settingsBefore
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('id="report-timings"', response.content,
+                      'IMS inventory_detail_print view didn''t show the timings footer')
+        timings=dict((timing.name, timing) for timing in RequestTiming.objects.all())
+        self.assertItemsEqual(timings.keys(), ['inventory_detail_print',
+                                               'get_sorted_inventory'])
+        self.assertGreater(timings['inventory_detail_print'].queries, 0)
+        self.assertGreaterEqual(timings['inventory_detail_print'].queries,
+                                timings['get_sorted_inventory'].queries)
+        self.assertEqual(ims.views.rowCounting['calls'], 0,
+                         'the model instance counter was left connected')
+    
+    def test_query_counter_counts_past_the_queries_log_limit(self):
+        print 'running ReportPrintViewTests.test_query_counter_counts_past_the_queries_log_limit... '
+        queryCounter=ims.views.QueryCounter(deque(maxlen=2))
+        for __ in range(5):
+            queryCounter.append({'sql':'select 1', 'time':'0.010'})
+        self.assertEqual(queryCounter.count, 5)
+        self.assertAlmostEqual(queryCounter.time, 0.05)
+        self.assertEqual(len(queryCounter), 2)
+    
+    def test_inventory_change_print(self):
+        print 'running ReportPrintViewTests.test_inventory_change_print... '
+        self.client.login(username='testUser', password='12345678')
+        (__,
+         createdProducts,
+         __,
+         __)=create_products_with_inventory_items_for_sites(numSites=2,
+                                                            numProducts=2,
+                                                            numItems=1)
+        today=timezone.now().strftime('%m-%d-%Y')
+        response=self.client.get(reverse('ims:inventory_change_print') +
+                                 '?startDate=%s&stopDate=%s' % (today, today))
+        self.assertEqual(response.status_code, 200)
+        sitesList=response.context['sitesList']
+        self.assertEqual(len(sitesList), 2)
+        for site, changes in sitesList.iteritems():
+            self.assertEqual([product for product, __, __, __, __ in changes],
+                             sorted(createdProducts, key=lambda product: product.name))
+            for product, startQuantity, stopQuantity, change, numChanges in changes:
+                self.assertEqual(startQuantity, 0)
+                self.assertEqual(change, stopQuantity)
+                self.assertGreater(numChanges, 0)
+    
+    def test_print_reports_streamed_with_no_inventory(self):
+        print 'running ReportPrintViewTests.test_print_reports_streamed_with_no_inventory... '
+        self.client.login(username='testUser', password='12345678')
+        for query in ('?stream=True', ''):
+            response=self.client.get(reverse('ims:inventory_status_print') + query,
+                                     follow=False)
+            self.assertRedirects(response, reverse('ims:reports') + 
+                                 '?startDate=' + timezone.now().strftime('%m-%d-%Y') + 
+                                 '&stopDate=' + timezone.now().strftime('%m-%d-%Y'),
+                                 fetch_redirect_response=False)
+
 @skip('No longer using IMS page view')
 class HomeViewTests(TestCase):
     """
@@ -901,6 +1938,32 @@ class InventoryHistoryViewTests(TestCase):
                          'IMS inventory_history view generated info with a valid request.\nactual message = %s' %
                           resultInfo)
 
+    def test_product_quantity_series(self):
+        print 'running InventoryHistoryViewTests.test_product_quantity_series... '
+        self.client.login(username='testUser', password='12345678')
+        (createdSites,
+         createdProducts,
+         __,
+         __)=create_products_with_inventory_items_for_sites(
+                                                numSites=2,
+                                                numProducts=1,
+                                                numItems=1)
+        today=timezone.now().strftime('%m-%d-%Y')
+        response=self.client.get(reverse('ims:product_quantity_series',
+                                         kwargs={'code':createdProducts[0].code}) +
+                                 '?startDate=%s&stopDate=%s&bucket=day' % (today, today))
+        self.assertEqual(response.status_code, 200)
+        result=json.loads(response.content)
+        self.assertEqual(len(result['series']), 1)
+        self.assertEqual(result['series'][0]['points'][-1][1],
+                         sum(site.latest_inventory_for_product(
+                                code=createdProducts[0].code).quantity 
+                             for site in createdSites))
+        response=self.client.get(reverse('ims:product_quantity_series',
+                                         kwargs={'code':createdProducts[0].code}) +
+                                 '?bucket=year')
+        self.assertEqual(response.status_code, 400)
+
 class SitesViewTests(TestCase):
     """
     ims_tests for sites view
@@ -947,7 +2010,29 @@ class SitesViewTests(TestCase):
         resultWarning = get_announcement_from_response(response=response,
                                                        cls="warningnote")
         self.assertEqual('', resultWarning)
-        
+
+    def test_sites_get_shows_product_counts(self):
+        print 'running SitesViewTests.test_sites_get_shows_product_counts... '
+        self.client.login(username='testUser', password='12345678')
+        (createdSites,
+         __,
+         __,
+         __)=create_products_with_inventory_items_for_sites(
+                                numSites=3,
+                                numProducts=2,
+                                numItems=1)
+        emptySite = Site(name='empty site',)
+        emptySite.save()
+        response=self.client.get(reverse('ims:sites',),
+                                 follow = False,)
+        self.assertEqual(response.status_code, 200)
+        productCounts = dict((siteForm.instance.pk, siteForm.productCount)
+                             for siteForm in response.context['paginatedItems'])
+        for site in createdSites:
+            self.assertEqual(productCounts[site.pk], 2,
+                             'IMS sites view didn''t show the product count of each site')
+        self.assertEqual(productCounts[emptySite.pk], 0)
+
     def test_sites_get_with_filter(self):
         print 'running SitesViewTests.test_sites_get_with_filter... '
         self.client.login(username='testUser', password='12345678')
@@ -1293,6 +2378,10 @@ class ProductDeleteViewTests(TestCase):
         self.assertEqual(ProductInformation.objects.all().count(), 
                          0,
                          'Product still in database after deleting.')
+        self.assertEqual(InventoryItem.objects.count(), 0)
+        self.assertEqual(CurrentInventory.objects.count(), 0)
+        self.assertFalse(SiteInventoryTotals.objects.filter(productCount__gt = 0).exists(),
+                         'product_delete didn''t update the site totals')
 
     def test_product_delete_post_without_delete_productinformation_perm(self):
         print 'running ProductDeleteViewTests.test_product_delete_post_without_delete_productinformation_perm... '
@@ -3511,6 +4600,35 @@ class ImportSitesViewTests(TestCase):
                          'import_sites view generated a warning with a valid file and user.\nactual warning message = %s' 
                          % resultWarning)
 
+    def test_import_sites_from_preview(self):
+        """
+        previewing an import changes nothing, and importing from the preview
+        imports the previewed file once
+        """
+        print 'running ImportSitesViewTests.test_import_sites_from_preview... '
+        perms = ['add_site', 'change_site']
+        permissions = Permission.objects.filter(codename__in = perms)
+        self.user.user_permissions=permissions
+        self.client.login(username='testUser', password='12345678')
+        with open(os.path.join(
+                  APP_DIR,
+                  'testData/sites_add_site1_site2_site3.xls'))as fp:
+            response=self.client.post(reverse('ims:import_sites'),
+                                      {'Preview':'Preview','file':fp})
+        self.assertEqual(Site.objects.count(), 0)
+        diff=response.context['diff']
+        self.assertEqual([key for key, __ in diff.inserts], [1, 2, 3])
+        previewId=response.context['previewId']
+        response=self.client.post(reverse('ims:import_sites'),
+                                  {'Import':'Import','previewId':previewId},
+                                  follow=True)
+        self.assertEqual(Site.objects.count(), 3)
+        self.assertEqual(get_announcement_from_response(response=response,
+                                                        cls="errornote"), '')
+        response=self.client.post(reverse('ims:import_sites'),
+                                  {'Import':'Import','previewId':previewId})
+        self.assertEqual(response.status_code, 404)
+        
     def test_import_sites_warning_file_with_dups(self):
         print 'running ImportSitesViewTests.test_import_sites_warning_file_with_dups... '
         perms = ['add_site', 'change_site']
@@ -3838,6 +4956,98 @@ class ImportInventoryViewTests(TestCase):
                          % (warning, resultWarning))
         
         
+class ImportJobTests(TestCase):
+    """
+    ims_tests for imports queued as ImportJobs and run by process_import_jobs
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testUser', password='12345678')
+        perms = ['add_inventoryitem', 'change_inventoryitem']
+        permissions = Permission.objects.filter(codename__in = perms)
+        self.user.user_permissions=permissions
+        self.client.login(username='testUser', password='12345678')
+        self.mediaRoot = tempfile.mkdtemp()
+        self.backgroundImports = ims.views.backgroundImports
+        ims.views.backgroundImports = True
+        for number in range(3):
+            Site(name='test site %d' % (number + 1),
+                 number=number + 1,
+                 modifier='none').save()
+            ProductInformation(name='test product %d' % (number + 1),
+                               code='pdt%d' % (number + 1),
+                               modifier='none').save()
+        
+    def tearDown(self):
+        ims.views.backgroundImports = self.backgroundImports
+        shutil.rmtree(self.mediaRoot, ignore_errors=True)
+        
+    def test_queued_inventory_import(self):
+        """
+        an upload is queued and imported by the worker, and its progress is
+        reported by the status view
+        """
+        print 'running ImportJobTests.test_queued_inventory_import... '
+        with self.settings(MEDIA_ROOT=self.mediaRoot):
+            with open(os.path.join(
+                      APP_DIR,
+                      'testData/inventory_add_10_to_site1_site2_site3_prod1_prod2_prod3.xls')) as fp:
+                response=self.client.post(reverse('ims:import_inventory'),
+                                          {'Import':'Import','file':fp},
+                                          follow=True)
+            self.assertIn('has been queued', 
+                          get_announcement_from_response(response=response,
+                                                         cls="infonote"))
+            self.assertEqual(InventoryItem.objects.count(), 0)
+            job=ImportJob.objects.get()
+            self.assertEqual(job.status, ImportJob.QUEUED)
+            self.assertEqual(job.modifier, 'testUser')
+            self.assertEqual(process_import_jobs(once=True, inThread=False), 1)
+            job=ImportJob.objects.get()
+            self.assertEqual(job.status, ImportJob.DONE, job.errors)
+            self.assertEqual(job.errors, '')
+            self.assertEqual(InventoryItem.objects.count(), 9)
+            self.assertEqual(job.rowsProcessed, job.rowsTotal)
+            response=self.client.get(reverse('ims:import_job_status',
+                                             kwargs={'jobId':job.pk}))
+            status=json.loads(response.content)
+            self.assertEqual(status['status'], ImportJob.DONE)
+            self.assertEqual(status['rowsProcessed'], job.rowsProcessed)
+            self.assertEqual(status['eta'], None)
+            response=self.client.get(reverse('ims:import_job_status',
+                                             kwargs={'jobId':job.pk + 1}))
+            self.assertEqual(response.status_code, 404)
+            User.objects.create_user(username='otherUser', password='12345678')
+            self.client.login(username='otherUser', password='12345678')
+            response=self.client.get(reverse('ims:import_job_status',
+                                             kwargs={'jobId':job.pk}))
+            self.assertEqual(response.status_code, 404,
+                             'import_job_status showed a job to a user who can''t import it')
+        
+    def test_failed_import_is_rolled_back(self):
+        """
+        a job whose import reports a problem fails without changing the
+        database
+        """
+        print 'running ImportJobTests.test_failed_import_is_rolled_back... '
+        with self.settings(MEDIA_ROOT=self.mediaRoot):
+            job=ImportJob(kind=ImportJob.INVENTORY,
+                          fileName='inventory.csv',
+                          modifier='testUser')
+            job.upload.save('inventory.csv',
+                            SimpleUploadedFile('inventory.csv',
+                                               'Product Code,Prefix,Site Number,Cartons\n'
+                                               'pdt1,P,1,20\n'
+                                               'pdt1,P,1,20\n'
+                                               'pdt9,P,1,20\n'))
+            job=run_import_job(ImportJob.claim_next(), inThread=False)
+            self.assertEqual(job.status, ImportJob.FAILED)
+            self.assertEqual(job.rowsTotal, 3)
+            self.assertIn('Changes to the database have been cancelled', job.errors)
+            self.assertNotIn('<br', job.errors)
+            self.assertEqual(InventoryItem.objects.count(), 0)
+            self.assertEqual(ImportJob.claim_next(), None)
+    
 class SiteDeleteAllViewTests(TestCase):
     """
     ims_tests for site_delete_all view
@@ -4387,6 +5597,44 @@ class ImportsViewTests(TestCase):
                              sortedCreatedInventory,
                              'Inventory exported to Excel doesn''t match the inventory in the database')
         
+    def test_reimport_exported_inventory(self):
+        """
+        importing an export of the inventory history without the modification
+        dates adds a new change for every record, in batches
+        """
+        print 'running ImportsViewTests.test_reimport_exported_inventory... '
+        (__,
+         __,
+         __,
+         __)=create_products_with_inventory_items_for_sites(
+                                numSites=3,
+                                numProducts=5,
+                                numItems=3,
+                                modifier='testUser')
+        self.client.login(username='testUser', password='12345678')
+        response=self.client.post(reverse('ims:imports'),
+                                  {'Export All Inventory':'All'},
+                                  follow=True)
+        numItems=InventoryItem.objects.count()
+        (importedInventory,
+         __)=InventoryItem.parse_inventory_from_xls(
+                           file_contents=response.content,
+                           modifier='testUser',
+                           retainModDate=False,
+                           batchSize=4)
+        self.assertEqual(len(importedInventory), numItems)
+        self.assertEqual(InventoryItem.objects.count(), 2 * numItems)
+        self.assertEqual(sorted(item.create_key() for item in importedInventory),
+                         sorted(item.create_key() for item in 
+                                InventoryItem.objects.filter(
+                                    pk__in=[item.pk for item in importedInventory])))
+        # the current inventory is up to date with the imported records
+        currentItems=sorted(CurrentInventory.objects.values_list('item', flat=True))
+        CurrentInventory.rebuild()
+        self.assertEqual(currentItems,
+                         sorted(CurrentInventory.objects.values_list('item', flat=True)))
+        self.assertTrue(set(currentItems) <= set(item.pk for item in importedInventory))
+        
     def test_export_current_inventory(self):
         print 'running ImportsViewTests.test_export_current_inventory... '
         # populate the database with some data